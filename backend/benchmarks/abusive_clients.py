@@ -0,0 +1,205 @@
+"""Abusive clients against rate limiting and admission control.
+
+Starts the FastAPI app in-process on the scratch benchmark database. Each
+simulated client gets its own source address through httpx's ASGI
+transport. Three scenarios run in turn:
+
+- login brute force: one IP fires wrong-password logins. Beyond the auth
+  bucket every attempt must get 429 without reaching bcrypt, and a user
+  logging in from another IP must still succeed.
+- search flood: one IP floods ``/api/products?search=`` while a polite
+  client searches twice a second. The flooder must be held to its bucket
+  and the polite client must never be limited.
+- overload: ``--crowd`` distinct IPs, each within its own rate, search at
+  once. Requests beyond the search concurrency cap must be shed with 503.
+  They must not be rate limited, and admitted latency must stay bounded.
+
+Every check is printed. The script exits non-zero if any check fails, so it
+can gate a deploy.
+
+Usage: python -m benchmarks.abusive_clients [--products 2000] [--seconds 5] [--crowd 200]
+"""
+import argparse
+import asyncio
+import os
+import time
+from collections import Counter
+
+import httpx
+
+from benchmarks.common import BENCH_DB_NAME, percentiles, seed_products, write_results
+from catalog_events import CATALOG_RELOADED
+
+# Must be set before server is imported
+os.environ['DB_NAME'] = BENCH_DB_NAME
+os.environ['PAYMENT_GATEWAY'] = 'fake'
+os.environ['RATE_LIMITING'] = 'on'
+# Small caps so a single process can overrun them
+os.environ.setdefault('CONCURRENCY_CAPS', 'auth=8,search=16,payment=8')
+
+PASSWORD = "abuse-test-pass"
+SEARCH_TERMS = ["wireless", "speaker", "lamp", "watch", "leather", "camera"]
+
+
+def client_for(app, ip: str) -> httpx.AsyncClient:
+    transport = httpx.ASGITransport(app=app, client=(ip, 40000))
+    return httpx.AsyncClient(transport=transport, base_url="http://abuse", timeout=60)
+
+
+def allowance(limit, seconds: float) -> int:
+    """Most requests a bucket can admit in ``seconds``."""
+    return int(limit.burst + limit.rate * seconds) + 1
+
+
+class Checks:
+    def __init__(self):
+        self.results = []
+
+    def expect(self, name: str, ok: bool, detail: str) -> None:
+        self.results.append({"check": name, "ok": ok, "detail": detail})
+        print(f"[{'ok' if ok else 'FAIL'}] {name}: {detail}")
+
+    @property
+    def passed(self) -> bool:
+        return all(result["ok"] for result in self.results)
+
+
+async def login_bruteforce(server, checks: Checks, attempts: int, concurrency: int) -> dict:
+    email = "abuse-victim@example.com"
+    await server.db.users.delete_many({"email": email})
+    async with client_for(server.app, "198.51.100.10") as victim:
+        response = await victim.post("/api/auth/register", json={"email": email, "password": PASSWORD,
+                                                                  "full_name": "Abuse Victim"})
+        response.raise_for_status()
+
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    async with client_for(server.app, "203.0.113.66") as attacker:
+        async def attempt(i: int):
+            async with semaphore:
+                response = await attacker.post("/api/auth/login", json={"email": email, "password": f"guess-{i}"})
+            statuses[response.status_code] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(attempt(i) for i in range(attempts)))
+        elapsed = time.perf_counter() - started
+
+    async with client_for(server.app, "198.51.100.10") as victim:
+        response = await victim.post("/api/auth/login", json={"email": email, "password": PASSWORD})
+
+    # The register call came from another IP, so the attacker's bucket starts full
+    reached_bcrypt = attempts - statuses[429]
+    most = allowance(server.rate_limiter.limits["auth"], elapsed)
+    checks.expect("login: attacker held to auth bucket", reached_bcrypt <= most,
+                  f"{reached_bcrypt} of {attempts} attempts admitted, at most {most} allowed")
+    checks.expect("login: victim unaffected", response.status_code == 200,
+                  f"victim login returned {response.status_code}")
+    return {"attempts": attempts, "seconds": round(elapsed, 3), "statuses": dict(statuses)}
+
+
+async def search_flood(server, checks: Checks, seconds: float, concurrency: int) -> dict:
+    flood_statuses, polite_statuses = Counter(), Counter()
+    polite_latencies = []
+    deadline = time.perf_counter() + seconds
+
+    async with client_for(server.app, "203.0.113.77") as flooder, \
+            client_for(server.app, "198.51.100.20") as polite:
+        async def flood(n: int):
+            i = n
+            while time.perf_counter() < deadline:
+                response = await flooder.get("/api/products", params={"search": SEARCH_TERMS[i % len(SEARCH_TERMS)]})
+                flood_statuses[response.status_code] += 1
+                i += concurrency
+
+        async def browse():
+            i = 0
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await polite.get("/api/products", params={"search": SEARCH_TERMS[i % len(SEARCH_TERMS)]})
+                polite_latencies.append(time.perf_counter() - started)
+                polite_statuses[response.status_code] += 1
+                i += 1
+                await asyncio.sleep(0.5)
+
+        started = time.perf_counter()
+        await asyncio.gather(browse(), *(flood(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    admitted = sum(n for code, n in flood_statuses.items() if code != 429)
+    most = allowance(server.rate_limiter.limits["search"], elapsed)
+    checks.expect("search: flooder held to search bucket", admitted <= most,
+                  f"{admitted} of {sum(flood_statuses.values())} searches admitted, at most {most} allowed")
+    checks.expect("search: polite client never limited", polite_statuses[429] == 0,
+                  f"polite statuses {dict(polite_statuses)}")
+    return {
+        "seconds": round(elapsed, 3),
+        "flood_statuses": dict(flood_statuses),
+        "polite_statuses": dict(polite_statuses),
+        "polite_latency": percentiles(polite_latencies),
+    }
+
+
+async def overload(server, checks: Checks, crowd: int) -> dict:
+    statuses = Counter()
+    latencies = {200: [], 503: []}
+    clients = [client_for(server.app, f"10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}") for n in range(crowd)]
+    try:
+        async def search(n: int):
+            started = time.perf_counter()
+            response = await clients[n].get("/api/products", params={"search": SEARCH_TERMS[n % len(SEARCH_TERMS)]})
+            statuses[response.status_code] += 1
+            latencies.setdefault(response.status_code, []).append(time.perf_counter() - started)
+
+        await asyncio.gather(*(search(n) for n in range(crowd)))
+    finally:
+        for client in clients:
+            await client.aclose()
+
+    cap = server.rate_limiter.caps.caps.get("search")
+    checks.expect("overload: excess shed with 503", statuses[503] > 0 or cap is None or crowd <= cap,
+                  f"statuses {dict(statuses)} with search cap {cap}")
+    checks.expect("overload: nobody rate limited", statuses[429] == 0, f"{statuses[429]} requests got 429")
+    checks.expect("overload: everyone got an answer", statuses[200] + statuses[503] == crowd,
+                  f"{statuses[200]} served, {statuses[503]} shed of {crowd}")
+    return {
+        "crowd": crowd,
+        "statuses": dict(statuses),
+        "admitted_latency": percentiles(latencies[200]),
+        "shed_latency": percentiles(latencies[503]),
+    }
+
+
+async def run(args):
+    import server
+
+    checks = Checks()
+    async with server.app.router.lifespan_context(server.app):
+        print(f"Seeding {args.products} products into {BENCH_DB_NAME}...")
+        await seed_products(server.db.products, args.products)
+        await server.catalog_events.publish(CATALOG_RELOADED)
+        await server.search_index.rebuild()
+
+        results = {
+            "login_bruteforce": await login_bruteforce(server, checks, args.attempts, args.concurrency),
+            "search_flood": await search_flood(server, checks, args.seconds, args.concurrency),
+            "overload": await overload(server, checks, args.crowd),
+            "limiter": server.rate_limiter.stats(),
+        }
+    results["checks"] = checks.results
+    return results, checks.passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--attempts", type=int, default=200, help="login attempts by the brute forcer")
+    parser.add_argument("--seconds", type=float, default=5, help="length of the search flood")
+    parser.add_argument("--concurrency", type=int, default=16, help="parallel requests per abusive client")
+    parser.add_argument("--crowd", type=int, default=200, help="distinct clients in the overload burst")
+    parser.add_argument("--output", default="abusive_clients.json")
+    args = parser.parse_args()
+
+    results, passed = asyncio.run(run(args))
+    write_results(args.output, results)
+    if not passed:
+        raise SystemExit("Admission control checks failed")
@@ -0,0 +1,80 @@
+"""Per-request cost of access token verification.
+
+For each algorithm, compares three ways of checking the same token:
+
+- pem: ``jwt.decode`` handed the raw secret or PEM on every call (the old path)
+- prepared: ``jwt.decode`` with a key object parsed once
+- cached: ``TokenService.verify``, which skips the signature check for a token it already verified
+
+No database or server is needed; keys are generated in memory.
+
+Usage: python -m benchmarks.auth_benchmark [--repeat 2000]
+"""
+import argparse
+import time
+from datetime import timedelta
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+from benchmarks.common import percentiles, write_results
+from token_auth import TokenKeys, TokenService
+
+CLAIMS = {"sub": "5f0c6a52-3c1e-4f7e-9d47-8a3b2c1d0e9f", "email": "bench@example.com"}
+
+
+def private_pem(key) -> bytes:
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+
+
+def public_pem(key) -> bytes:
+    return key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+
+
+def key_sets():
+    yield "HS256", TokenKeys.symmetric("HS256", "bench-secret-key-of-reasonable-length"), "bench-secret-key-of-reasonable-length"
+    for algorithm, key in (
+        ("RS256", rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+        ("ES256", ec.generate_private_key(ec.SECP256R1())),
+        ("EdDSA", ed25519.Ed25519PrivateKey.generate()),
+    ):
+        yield algorithm, TokenKeys.from_pem(algorithm, private_pem(key), "bench"), public_pem(key)
+
+
+def measure(fn, repeat: int) -> dict:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def run(repeat: int) -> dict:
+    results = {}
+    for algorithm, keys, raw_key in key_sets():
+        service = TokenService(keys, expiration=timedelta(hours=1))
+        token = service.issue(CLAIMS)
+        prepared = keys.verification_key(keys.signing_kid)
+        service.verify(token)
+        results[algorithm] = {
+            "pem": measure(lambda: jwt.decode(token, raw_key, algorithms=[algorithm]), repeat),
+            "prepared": measure(lambda: jwt.decode(token, prepared, algorithms=[algorithm]), repeat),
+            "cached": measure(lambda: service.verify(token), repeat),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--output", default="auth_benchmark.json")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    print(f"{'algorithm':10} {'path':10} {'p50 ms':>9} {'p99 ms':>9}")
+    for algorithm, paths in results.items():
+        for path, stats in paths.items():
+            print(f"{algorithm:10} {path:10} {stats['p50_ms']:>9} {stats['p99_ms']:>9}")
+    write_results(args.output, {"repeat": args.repeat, "results": results})
@@ -0,0 +1,72 @@
+"""Full vs card product listings: bytes on the wire and latency.
+
+Runs the listing query with each projection against a seeded scratch
+collection and reports Mongo transfer size (BSON), response body size and
+query + serialization latency for one page.
+
+Usage: python -m benchmarks.card_view_benchmark [--products 10000] [--page-size 50] [--repeat 100]
+"""
+import argparse
+import asyncio
+import gzip
+from typing import List
+
+import bson
+
+from benchmarks.common import Timer, bench_client, percentiles, seed_products, write_results
+from serialization import ModelSerializer
+from server import PRODUCT_CARD_PROJECTION, PRODUCT_PROJECTION, Product, ProductCard
+
+
+async def run(product_count: int, page_size: int, repeat: int):
+    client, db = bench_client()
+    collection = db.card_bench_products
+    views = {
+        "full": (PRODUCT_PROJECTION, ModelSerializer(List[Product])),
+        "card": (PRODUCT_CARD_PROJECTION, ModelSerializer(List[ProductCard])),
+    }
+    results = {}
+    try:
+        await seed_products(collection, product_count)
+        await collection.create_index([("created_at", -1), ("id", -1)])
+        for name, (projection, serializer) in views.items():
+            samples = []
+            for _ in range(repeat):
+                with Timer() as t:
+                    docs = await collection.find({}, projection).sort([("created_at", -1), ("id", -1)]) \
+                        .limit(page_size).to_list(page_size)
+                    body = serializer.dumps(docs)
+                samples.append(t.elapsed)
+            results[name] = {
+                "mongo_bytes": sum(len(bson.encode(doc)) for doc in docs),
+                "response_bytes": len(body),
+                "response_gzip_bytes": len(gzip.compress(body)),
+                "latency": percentiles(samples),
+            }
+    finally:
+        await collection.drop()
+        client.close()
+
+    for name, r in results.items():
+        print(f"{name:5} mongo {r['mongo_bytes']:>7} B  body {r['response_bytes']:>7} B  "
+              f"gzip {r['response_gzip_bytes']:>6} B  p50 {r['latency']['p50_ms']:.2f}ms  p95 {r['latency']['p95_ms']:.2f}ms")
+    full, card = results["full"], results["card"]
+    print(f"card view: {card['response_bytes'] / full['response_bytes']:.0%} of full body, "
+          f"{card['mongo_bytes'] / full['mongo_bytes']:.0%} of Mongo transfer")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    results = asyncio.run(run(args.products, args.page_size, args.repeat))
+    if args.json:
+        write_results(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
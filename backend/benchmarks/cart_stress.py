@@ -0,0 +1,87 @@
+"""Concurrency stress check for cart writes.
+
+Fires many parallel adds for one user across a handful of products and
+verifies that no quantity was lost. ``--legacy`` runs the old
+read-modify-write implementation for comparison. Exits non-zero on a
+mismatch.
+
+Usage: python -m benchmarks.cart_stress [--adds 500] [--products 5] [--legacy]
+"""
+import argparse
+import asyncio
+import random
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+import cart_store
+from benchmarks.common import Timer, bench_client
+
+
+async def legacy_add(carts, user_id: str, item: dict) -> None:
+    cart_doc = await carts.find_one({"user_id": user_id}, {"_id": 0})
+    if not cart_doc:
+        cart_doc = {"id": str(uuid.uuid4()), "user_id": user_id, "items": []}
+        await carts.insert_one(dict(cart_doc))
+    items = cart_doc.get('items', [])
+    existing = next((i for i in items if i['product_id'] == item['product_id']), None)
+    if existing:
+        existing['quantity'] += item['quantity']
+    else:
+        items.append(dict(item))
+    await carts.update_one({"user_id": user_id}, {"$set": {"items": items}})
+
+
+async def run(adds: int, product_count: int, legacy: bool) -> bool:
+    client, db = bench_client()
+    carts = db.cart_stress_carts
+    await carts.drop()
+    await carts.create_index("user_id", unique=True)
+    user_id = str(uuid.uuid4())
+    rng = random.Random(7)
+    expected = Counter()
+
+    calls = []
+    for _ in range(adds):
+        product_id = f"product-{rng.randrange(product_count)}"
+        quantity = rng.randint(1, 3)
+        expected[product_id] += quantity
+        item = {"product_id": product_id, "quantity": quantity, "price": 9.99, "title": product_id, "image": ""}
+        if legacy:
+            calls.append(legacy_add(carts, user_id, item))
+        else:
+            calls.append(cart_store.add_item(carts, user_id, item, datetime.now(timezone.utc)))
+
+    try:
+        with Timer() as t:
+            results = await asyncio.gather(*calls, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        cart = await carts.find_one({"user_id": user_id}) or {"items": []}
+        actual = Counter({i['product_id']: i['quantity'] for i in cart['items']})
+        duplicates = len(cart['items']) - len(actual)
+        carts_created = await carts.count_documents({"user_id": user_id})
+    finally:
+        await carts.drop()
+        client.close()
+
+    print(f"{adds} concurrent adds in {t.elapsed:.2f}s ({adds / t.elapsed:.0f}/s), {len(errors)} errors")
+    ok = actual == expected and not errors and not duplicates and carts_created == 1
+    for product_id in sorted(expected):
+        marker = "" if actual[product_id] == expected[product_id] else "  <-- lost updates"
+        print(f"  {product_id}: expected {expected[product_id]}, got {actual[product_id]}{marker}")
+    print("OK" if ok else f"FAILED ({duplicates} duplicate lines, {carts_created} carts)")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--adds", type=int, default=500)
+    parser.add_argument("--products", type=int, default=5)
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.adds, args.products, args.legacy)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Shared helpers for the benchmark scripts.
+
+Benchmarks run against a scratch database (``<DB_NAME>_bench`` by default) on
+the MongoDB configured in backend/.env, so they never touch real data. Run
+them from the backend directory, e.g. ``python -m benchmarks.search_benchmark``.
+"""
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+load_dotenv(ROOT_DIR / '.env')
+
+BENCH_DB_NAME = os.environ.get('BENCH_DB_NAME', f"{os.environ.get('DB_NAME', 'marketplace_db')}_bench")
+
+CATEGORIES = ["Electronics", "Fashion", "Home & Garden", "Sports", "Books", "Toys & Games", "Beauty", "Automotive"]
+ADJECTIVES = ["wireless", "portable", "premium", "classic", "smart", "ergonomic", "organic", "vintage",
+              "compact", "waterproof", "leather", "bamboo", "stainless", "ultralight", "digital", "handmade"]
+NOUNS = ["headphones", "speaker", "backpack", "lamp", "watch", "jacket", "blender", "keyboard", "camera",
+         "sneakers", "notebook", "drone", "mattress", "bottle", "charger", "tent", "novel", "puzzle"]
+FILLER = ["with", "for", "everyday", "use", "and", "long", "battery", "life", "designed", "comfort",
+          "durable", "materials", "travel", "home", "office", "outdoor", "gift", "quality", "fast", "shipping"]
+IMAGE = "https://images.unsplash.com/photo-1505740420928-5e560c06d30e?w=800"
+
+
+def bench_client():
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    return client, client[BENCH_DB_NAME]
+
+
+def synthetic_products(count: int, seed: int = 42) -> Iterator[dict]:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(count):
+        title = f"{rng.choice(ADJECTIVES).title()} {rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS).title()} {i}"
+        description = " ".join(rng.choice(ADJECTIVES + NOUNS + FILLER) for _ in range(rng.randint(8, 24)))
+        yield {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "title": title,
+            "description": description.capitalize(),
+            "price": round(rng.uniform(2, 2000), 2),
+            "images": [IMAGE, IMAGE],
+            "category": rng.choice(CATEGORIES),
+            "stock": rng.randint(0, 500),
+            "rating": round(rng.uniform(1, 5), 1),
+            "reviews_count": rng.randint(0, 5000),
+            "created_at": start + timedelta(seconds=i),
+        }
+
+
+async def seed_products(collection, count: int, batch_size: int = 10000, seed: int = 42) -> None:
+    await collection.delete_many({})
+    batch: List[dict] = []
+    for product in synthetic_products(count, seed):
+        batch.append(product)
+        if len(batch) == batch_size:
+            await collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Summarize latency samples (seconds) in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(pick(0.50), 3),
+        "p95_ms": round(pick(0.95), 3),
+        "p99_ms": round(pick(0.99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def write_results(path: str, results) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Results written to {path}")
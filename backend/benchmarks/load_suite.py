@@ -0,0 +1,259 @@
+"""Mixed-traffic load test of the whole API, run in-process.
+
+Starts the FastAPI app (startup hooks included) on the scratch benchmark
+database with the fake payment gateway, so nothing leaves the machine but
+the local MongoDB connection. It seeds a synthetic catalog and users, then
+runs ``--concurrency`` virtual shoppers for ``--seconds``. Each shopper loops
+over weighted scenarios:
+
+- browse: categories, facets, card listings, category pages, search, product detail,
+  then a conditional revalidation of that product (If-None-Match)
+- cart: product detail, add to cart, view cart
+- checkout: add to cart, place order, open a payment session, check its status
+- history: order summaries, full order list and one order
+
+Requests go through httpx's ASGI transport, so latencies include routing,
+validation, serialization and Mongo, but not sockets. The results report
+p50/p95/p99 latency and throughput per endpoint, and are written as JSON
+tagged with the git commit. Pass ``--compare`` to diff a run against an
+earlier results file.
+
+Usage: python -m benchmarks.load_suite [--products 5000] [--users 50] [--seconds 30]
+       [--concurrency 32] [--mix browse=60,cart=20,checkout=5,history=15]
+       [--output load_suite.json] [--compare previous.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.common import BENCH_DB_NAME, CATEGORIES, percentiles, seed_products, write_results
+from catalog_events import CATALOG_RELOADED
+
+# Must be set before server is imported
+os.environ['DB_NAME'] = BENCH_DB_NAME
+os.environ['PAYMENT_GATEWAY'] = 'fake'
+os.environ['FAKE_GATEWAY_AUTO_PAY'] = 'true'
+# Measures capacity; admission control is exercised by benchmarks.abusive_clients
+os.environ.setdefault('RATE_LIMITING', 'off')
+
+SEARCH_TERMS = ["wireless", "speaker", "portable lamp", "smart watch", "leather", "camera", "tent", "organic"]
+ADDRESS = {"full_name": "Load Test", "address": "1 Main St", "city": "Springfield", "postal_code": "12345",
+           "country": "US", "phone": "+1 555 0100"}
+ORIGIN = "http://localhost:3000"
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    return mix
+
+
+class Shopper:
+    def __init__(self, client: httpx.AsyncClient, token: str, product_ids: list, rng: random.Random, recorder):
+        self.client = client
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.product_ids = product_ids
+        self.rng = rng
+        self.record = recorder
+        self.order_ids = []
+
+    async def call(self, label: str, method: str, url: str, extra_headers=None, **kwargs) -> httpx.Response:
+        headers = {**self.headers, **extra_headers} if extra_headers else self.headers
+        started = time.perf_counter()
+        response = await self.client.request(method, url, headers=headers, **kwargs)
+        self.record(label, time.perf_counter() - started, response.status_code)
+        return response
+
+    def product(self) -> str:
+        return self.rng.choice(self.product_ids)
+
+    async def browse(self):
+        await self.call("GET /api/categories", "GET", "/api/categories")
+        await self.call("GET /api/products/facets", "GET", "/api/products/facets")
+        await self.call("GET /api/products (card)", "GET", "/api/products", params={"view": "card", "limit": 24})
+        await self.call("GET /api/products?category", "GET", "/api/products",
+                        params={"category": self.rng.choice(CATEGORIES), "sort": "price_asc", "limit": 24})
+        await self.call("GET /api/products?search", "GET", "/api/products",
+                        params={"search": self.rng.choice(SEARCH_TERMS), "limit": 24})
+        product_id = self.product()
+        response = await self.call("GET /api/products/{product_id}", "GET", f"/api/products/{product_id}")
+        etag = response.headers.get("etag")
+        if etag:
+            await self.call("GET /api/products/{product_id} (revalidate)", "GET", f"/api/products/{product_id}",
+                            extra_headers={"If-None-Match": etag})
+
+    async def cart(self):
+        product_id = self.product()
+        await self.call("GET /api/products/{product_id}", "GET", f"/api/products/{product_id}")
+        await self.call("POST /api/cart/add", "POST", "/api/cart/add", json={"product_id": product_id, "quantity": 1})
+        await self.call("GET /api/cart", "GET", "/api/cart")
+
+    async def checkout(self):
+        await self.call("POST /api/cart/add", "POST", "/api/cart/add", json={"product_id": self.product(), "quantity": 1})
+        response = await self.call("POST /api/orders", "POST", "/api/orders",
+                                   json={"payment_method": "stripe", "shipping_address": ADDRESS})
+        if response.status_code != 200:
+            return
+        order_id = response.json()["order_id"]
+        self.order_ids.append(order_id)
+        response = await self.call("POST /api/payment/create-session", "POST", "/api/payment/create-session",
+                                   params={"order_id": order_id, "origin_url": ORIGIN})
+        if response.status_code != 200:
+            return
+        session_id = response.json()["session_id"]
+        await self.call("GET /api/payment/status/{session_id}", "GET", f"/api/payment/status/{session_id}")
+
+    async def history(self):
+        await self.call("GET /api/orders/history", "GET", "/api/orders/history", params={"limit": 20})
+        await self.call("GET /api/orders", "GET", "/api/orders", params={"limit": 20})
+        if self.order_ids:
+            await self.call("GET /api/orders/{order_id}", "GET", f"/api/orders/{self.rng.choice(self.order_ids)}")
+
+
+SCENARIOS = {"browse": Shopper.browse, "cart": Shopper.cart, "checkout": Shopper.checkout, "history": Shopper.history}
+
+
+async def seed(server, products: int, users: int):
+    db = server.db
+    await seed_products(db.products, products)
+    await db.categories.delete_many({})
+    await db.categories.insert_many([
+        {"id": str(uuid.uuid4()), "name": name, "slug": name.lower().replace(" & ", "-"), "description": "", "image": ""}
+        for name in CATEGORIES
+    ])
+    for name in ("carts", "orders", "order_summaries", "orders_archive", "payment_transactions", "catalog_facets"):
+        await db[name].delete_many({})
+    await db.users.delete_many({"email": {"$regex": "^load-"}})
+
+    # One bcrypt hash for everyone; tokens are minted directly, so login
+    # cost stays out of the shopping scenarios
+    password_hash = server.pwd_context.hash("load-test-pass")
+    tokens = []
+    user_docs = []
+    for i in range(users):
+        user = server.User(email=f"load-{i}@example.com", password_hash=password_hash, full_name=f"Load User {i}")
+        user_docs.append(user.model_dump())
+        tokens.append(server.create_access_token({"sub": user.id, "email": user.email}))
+    await db.users.insert_many(user_docs)
+    product_ids = [doc["id"] for doc in await db.products.find({}, {"_id": 0, "id": 1}).to_list(None)]
+    return tokens, product_ids
+
+
+async def run(args):
+    import server
+
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    scenario_counts = Counter()
+
+    def record(label: str, seconds: float, status_code: int) -> None:
+        latencies[label].append(seconds)
+        statuses[label][status_code] += 1
+
+    async with server.app.router.lifespan_context(server.app):
+        print(f"Seeding {args.products} products and {args.users} users into {BENCH_DB_NAME}...")
+        tokens, product_ids = await seed(server, args.products, args.users)
+        # Reload derived state from the fresh catalog before measuring
+        await server.catalog_events.publish(CATALOG_RELOADED)
+        await server.search_index.rebuild()
+        await server.catalog_facets.refresh()
+
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as client:
+            deadline = time.perf_counter() + args.seconds
+
+            async def shopper(n: int):
+                rng = random.Random(args.seed + n)
+                virtual = Shopper(client, tokens[n % len(tokens)], product_ids, rng, record)
+                while time.perf_counter() < deadline:
+                    name = rng.choices(names, weights)[0]
+                    scenario_counts[name] += 1
+                    await SCENARIOS[name](virtual)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(shopper(n) for n in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    for label in sorted(latencies):
+        samples = latencies[label]
+        endpoints[label] = {
+            **percentiles(samples),
+            "throughput_per_s": round(len(samples) / elapsed, 1),
+            "statuses": {str(code): n for code, n in sorted(statuses[label].items())},
+        }
+    total = sum(len(samples) for samples in latencies.values())
+    return {
+        "git_sha": git_revision(),
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {"products": args.products, "users": args.users, "seconds": args.seconds,
+                   "concurrency": args.concurrency, "mix": mix, "seed": args.seed},
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "throughput_per_s": round(total / elapsed, 1),
+        "scenarios": dict(scenario_counts),
+        "endpoints": endpoints,
+    }
+
+
+def print_report(results: dict, previous: dict = None) -> None:
+    print(f"\n{results['requests']} requests in {results['elapsed_s']}s "
+          f"({results['throughput_per_s']}/s) at {results['git_sha'][:12]}")
+    header = f"{'endpoint':42} {'n':>7} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}  errors"
+    if previous:
+        header += f"   p95 vs {previous['git_sha'][:8]}"
+    print(header)
+    for label, stats in results["endpoints"].items():
+        errors = sum(n for code, n in stats["statuses"].items() if int(code) >= 400)
+        line = (f"{label:42} {stats['count']:>7} {stats['throughput_per_s']:>8} {stats['p50_ms']:>8} "
+                f"{stats['p95_ms']:>8} {stats['p99_ms']:>8}  {errors}")
+        before = (previous or {}).get("endpoints", {}).get(label)
+        if before and before.get("p95_ms"):
+            line += f"   {(stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100:+.1f}%"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=32, help="simultaneous virtual shoppers")
+    parser.add_argument("--mix", default="browse=60,cart=20,checkout=5,history=15")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="load_suite.json")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(results, previous)
+    write_results(args.output, results)
@@ -0,0 +1,82 @@
+"""Show browse latency while logins are being hammered.
+
+Runs against a live API (start it with ``uvicorn server:app --port 8001``
+and leave ``RATE_LIMITING`` off; with it on, one client's logins get 429s).
+Measures GET /api/categories and /api/products latency first on their own,
+then while ``--login-concurrency`` clients loop on POST /api/auth/login.
+With bcrypt off the event loop the two browse distributions should match;
+logins beyond the pool's queue get fast 503s instead of stalling everyone.
+
+Usage: python -m benchmarks.login_load [--base-url http://localhost:8001] [--seconds 10]
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+from benchmarks.common import percentiles, write_results
+
+BROWSE_PATHS = ["/api/categories", "/api/products?limit=20"]
+
+
+async def browse(client: httpx.AsyncClient, deadline: float, samples: list) -> None:
+    i = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await client.get(BROWSE_PATHS[i % len(BROWSE_PATHS)])
+        samples.append(time.perf_counter() - started)
+        i += 1
+
+
+async def hammer_logins(client: httpx.AsyncClient, credentials: dict, deadline: float, statuses: Counter) -> None:
+    while time.perf_counter() < deadline:
+        response = await client.post("/api/auth/login", json=credentials)
+        statuses[response.status_code] += 1
+
+
+async def phase(client, credentials, seconds: float, browsers: int, logins: int):
+    deadline = time.perf_counter() + seconds
+    samples, statuses = [], Counter()
+    await asyncio.gather(
+        *(browse(client, deadline, samples) for _ in range(browsers)),
+        *(hammer_logins(client, credentials, deadline, statuses) for _ in range(logins)),
+    )
+    return {"browse": percentiles(samples), "login_statuses": dict(statuses),
+            "logins_per_s": round(sum(statuses.values()) / seconds, 1)}
+
+
+async def run(base_url: str, seconds: float, browsers: int, logins: int):
+    limits = httpx.Limits(max_connections=browsers + logins + 4)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        credentials = {"email": f"load-{uuid.uuid4().hex[:8]}@example.com", "password": "load-test-pass"}
+        response = await client.post("/api/auth/register", json={**credentials, "full_name": "Load Test"})
+        response.raise_for_status()
+
+        baseline = await phase(client, credentials, seconds, browsers, 0)
+        under_load = await phase(client, credentials, seconds, browsers, logins)
+
+    for name, result in (("baseline", baseline), ("under login load", under_load)):
+        b = result["browse"]
+        print(f"{name:18} browse p50 {b['p50_ms']:.1f}ms p95 {b['p95_ms']:.1f}ms p99 {b['p99_ms']:.1f}ms"
+              f"  logins/s {result['logins_per_s']}  statuses {result['login_statuses']}")
+    return {"baseline": baseline, "under_login_load": under_load}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--browsers", type=int, default=8)
+    parser.add_argument("--login-concurrency", type=int, default=64)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    results = asyncio.run(run(args.base_url, args.seconds, args.browsers, args.login_concurrency))
+    if args.json:
+        write_results(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Many buyers racing for the last units of one SKU.
+
+Every buyer has the same product in their cart and places an order at the
+same moment. The run checks that exactly ``--stock`` orders succeed, the
+rest get "Insufficient stock", and the product ends at zero stock with no
+reservations left behind by failed attempts.
+
+Usage: python -m benchmarks.order_contention [--buyers 500] [--stock 10]
+"""
+import argparse
+import asyncio
+import sys
+import uuid
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+
+from benchmarks.common import Timer, bench_client, percentiles, write_results
+from order_placement import OrderPlacementError, place_order, price_cart
+
+
+async def buy(db, user_id: str, samples: list) -> str:
+    with Timer() as t:
+        try:
+            items, quantities = await price_cart(db, user_id)
+            order = {
+                "id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "items": items,
+                "total_amount": sum(i['price'] * i['quantity'] for i in items),
+                "payment_method": "stripe",
+                "payment_status": "pending",
+                "status": "pending",
+                "created_at": datetime.now(timezone.utc),
+            }
+            await place_order(db, order, quantities, timedelta(minutes=30))
+            outcome = "ordered"
+        except OrderPlacementError as e:
+            outcome = f"{e.status_code} {e.detail}"
+    samples.append(t.elapsed)
+    return outcome
+
+
+async def run(buyers: int, stock: int):
+    client, db = bench_client()
+    product_id = str(uuid.uuid4())
+    try:
+        for name in ("products", "carts", "orders"):
+            await db[name].drop()
+        await db.products.create_index("id", unique=True)
+        await db.products.create_index("reservations.order_id", sparse=True)
+        await db.products.insert_one({"id": product_id, "title": "Last units", "price": 19.99,
+                                      "images": [], "stock": stock})
+        user_ids = [str(uuid.uuid4()) for _ in range(buyers)]
+        await db.carts.insert_many([
+            {"id": str(uuid.uuid4()), "user_id": uid,
+             "items": [{"product_id": product_id, "quantity": 1, "price": 1.0, "title": "", "image": ""}]}
+            for uid in user_ids
+        ])
+
+        samples = []
+        with Timer() as total:
+            outcomes = Counter(await asyncio.gather(*(buy(db, uid, samples) for uid in user_ids)))
+        product = await db.products.find_one({"id": product_id})
+        orders = await db.orders.count_documents({})
+    finally:
+        for name in ("products", "carts", "orders"):
+            await db[name].drop()
+        client.close()
+
+    result = {
+        "buyers": buyers,
+        "stock": stock,
+        "outcomes": dict(outcomes),
+        "orders_written": orders,
+        "final_stock": product['stock'],
+        "leftover_reservations": len(product.get('reservations', [])),
+        "elapsed_s": round(total.elapsed, 3),
+        "latency": percentiles(samples),
+    }
+    ok = orders == stock and product['stock'] == 0 and result["leftover_reservations"] == stock
+    print(f"{buyers} buyers for {stock} units in {total.elapsed:.2f}s: {dict(outcomes)}")
+    print(f"orders written {orders}, final stock {product['stock']}, "
+          f"reservations held {result['leftover_reservations']}, p99 {result['latency']['p99_ms']}ms")
+    print("OK" if ok else "FAILED: oversold or leaked stock")
+    return ok, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--buyers", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=10)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    ok, result = asyncio.run(run(args.buyers, args.stock))
+    if args.json:
+        write_results(args.json, result)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
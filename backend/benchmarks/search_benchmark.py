@@ -0,0 +1,88 @@
+"""Compare regex product search with the inverted index.
+
+``index`` includes fetching the hits from Mongo. ``index_cpu`` is the index
+lookup alone, which runs on the event loop and must stay small at every
+catalog size.
+
+Usage: python -m benchmarks.search_benchmark [--sizes 10000 100000 1000000] [--repeat 20] [--json out.json]
+"""
+import argparse
+import asyncio
+
+from benchmarks.common import Timer, bench_client, percentiles, seed_products, write_results
+from search_index import ProductSearchIndex
+
+QUERIES = ["s", "wi", "wireless", "head", "smart watch", "stainless bottle", "leather tent travel", "nothingmatches"]
+LIMIT = 50
+
+
+async def regex_search(collection, search: str):
+    query = {"$or": [
+        {"title": {"$regex": search, "$options": "i"}},
+        {"description": {"$regex": search, "$options": "i"}}
+    ]}
+    return await collection.find(query, {"_id": 0}).limit(LIMIT).to_list(LIMIT)
+
+
+async def index_search(index: ProductSearchIndex, collection, search: str):
+    hits = index.search(search, limit=LIMIT)
+    ranks = {product_id: rank for rank, (product_id, _) in enumerate(hits)}
+    products = await collection.find({"id": {"$in": list(ranks)}}, {"_id": 0}).to_list(len(ranks))
+    products.sort(key=lambda p: ranks[p['id']])
+    return products
+
+
+async def index_lookup(index: ProductSearchIndex, search: str):
+    return index.search(search, limit=LIMIT)
+
+
+async def run(sizes, repeat: int):
+    client, db = bench_client()
+    collection = db.search_bench_products
+    results = []
+    try:
+        for size in sizes:
+            print(f"Seeding {size} products...")
+            await seed_products(collection, size)
+            await collection.create_index("id", unique=True)
+
+            index = ProductSearchIndex(collection)
+            with Timer() as build:
+                await index.rebuild()
+            print(f"  index build: {build.elapsed:.2f}s ({len(index)} products)")
+
+            for search in QUERIES:
+                row = {"size": size, "query": search, "index_build_s": round(build.elapsed, 3)}
+                for name, call in (("regex", lambda: regex_search(collection, search)),
+                                   ("index", lambda: index_search(index, collection, search)),
+                                   ("index_cpu", lambda: index_lookup(index, search))):
+                    samples = []
+                    for _ in range(repeat):
+                        with Timer() as t:
+                            found = await call()
+                        samples.append(t.elapsed)
+                    row[name] = {**percentiles(samples), "results": len(found)}
+                results.append(row)
+                print(f"  {search!r:20} regex p50 {row['regex']['p50_ms']:>9.2f}ms  "
+                      f"index p50 {row['index']['p50_ms']:>8.2f}ms  "
+                      f"index cpu p99 {row['index_cpu']['p99_ms']:>7.2f}ms  "
+                      f"({row['regex']['results']} / {row['index']['results']} results)")
+    finally:
+        await collection.drop()
+        client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    results = asyncio.run(run(args.sizes, args.repeat))
+    if args.json:
+        write_results(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Per-endpoint response serialization cost, before and after the fast path.
+
+"before" reproduces FastAPI's handling of a ``response_model`` (validate the
+returned objects, ``jsonable_encoder``, ``json.dumps``); "after" is the
+``ModelSerializer`` path the handlers now use. No database is needed: the
+documents are synthetic and held in memory.
+
+Usage: python -m benchmarks.serialization_benchmark [--repeat 200] [--page-size 50]
+"""
+import argparse
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from benchmarks.common import Timer, percentiles, synthetic_products, write_results
+from serialization import ModelSerializer
+from server import Order, Product
+
+
+def synthetic_orders(count: int) -> List[dict]:
+    items = [{"product_id": str(uuid.uuid4()), "quantity": 2, "price": 19.99, "title": "Wireless Speaker",
+              "image": "https://images.unsplash.com/photo-1505740420928-5e560c06d30e?w=800"} for _ in range(3)]
+    address = {"full_name": "Ada Lovelace", "address": "1 Main St", "city": "London", "postal_code": "N1",
+               "country": "UK", "phone": "+44 20 0000 0000"}
+    return [{"id": str(uuid.uuid4()), "user_id": "u1", "items": items, "total_amount": 119.94,
+             "payment_method": "stripe", "payment_status": "paid", "shipping_address": address,
+             "status": "confirmed", "session_id": "", "created_at": datetime.now(timezone.utc)}
+            for _ in range(count)]
+
+
+def legacy_path(tp):
+    adapter = TypeAdapter(tp)
+
+    def render(data):
+        validated = adapter.validate_python(data)
+        return json.dumps(jsonable_encoder(validated)).encode()
+
+    return render
+
+
+def legacy_single_path(model):
+    adapter = TypeAdapter(model)
+
+    def render(doc):
+        # Handler built the model, then FastAPI validated and encoded it again
+        instance = model(**doc)
+        return json.dumps(jsonable_encoder(adapter.validate_python(instance.model_dump()))).encode()
+
+    return render
+
+
+def measure(render, data, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        with Timer() as t:
+            body = render(data)
+        samples.append(t.elapsed)
+    return {**percentiles(samples), "bytes": len(body)}
+
+
+def run(repeat: int, page_size: int):
+    products = list(synthetic_products(page_size))
+    orders = synthetic_orders(page_size)
+    cases = [
+        ("GET /api/products", products, legacy_path(List[Product]), ModelSerializer(List[Product]).dumps),
+        ("GET /api/products/{id}", products[0], legacy_single_path(Product), ModelSerializer(Product).dumps),
+        ("GET /api/orders", orders, legacy_path(List[Order]), ModelSerializer(List[Order]).dumps),
+        ("GET /api/orders/{id}", orders[0], legacy_single_path(Order), ModelSerializer(Order).dumps),
+    ]
+    results = []
+    for name, data, before, after in cases:
+        row = {"endpoint": name, "before": measure(before, data, repeat), "after": measure(after, data, repeat)}
+        speedup = row["before"]["p50_ms"] / max(row["after"]["p50_ms"], 1e-6)
+        row["speedup_p50"] = round(speedup, 2)
+        results.append(row)
+        print(f"{name:26} before p50 {row['before']['p50_ms']:7.3f}ms  after p50 {row['after']['p50_ms']:7.3f}ms  "
+              f"x{speedup:.1f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+    results = run(args.repeat, args.page_size)
+    if args.json:
+        write_results(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Stripe webhook retry storm against the payment job queue.
+
+Starts the FastAPI app in-process on the scratch benchmark database with the
+fake payment gateway. It creates ``--orders`` pending orders and their
+payment sessions. Then it delivers a ``checkout.session.completed`` webhook
+for each session ``--deliveries`` times (the same event id, as Stripe
+retries do), in shuffled order, ``--concurrency`` at a time.
+
+Reports webhook acknowledgement latency and throughput, then the time the
+background workers take to drain the queue. Finally it checks that every
+session produced exactly one job and every order ended up paid.
+
+Usage: python -m benchmarks.webhook_storm [--orders 2000] [--deliveries 3] [--concurrency 64]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+
+import httpx
+
+from benchmarks.common import BENCH_DB_NAME, percentiles, write_results
+
+# Must be set before server is imported
+os.environ['DB_NAME'] = BENCH_DB_NAME
+os.environ['PAYMENT_GATEWAY'] = 'fake'
+
+
+async def seed(db, count: int):
+    for name in ("orders", "order_summaries", "payment_transactions", "payment_jobs"):
+        await db[name].delete_many({})
+    from dates import utcnow
+    from order_history import summary_from_order
+
+    now = utcnow()
+    orders, transactions, sessions = [], [], []
+    for i in range(count):
+        order_id = str(uuid.uuid4())
+        session_id = f"cs_storm_{uuid.uuid4().hex}"
+        orders.append({
+            "id": order_id,
+            "user_id": "webhook-storm",
+            "items": [{"product_id": "storm", "title": "Storm", "price": 10.0, "quantity": 1, "image": ""}],
+            "total_amount": 10.0,
+            "shipping_address": {},
+            "payment_method": "stripe",
+            "payment_status": "pending",
+            "status": "pending",
+            "created_at": now,
+        })
+        transactions.append({
+            "id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "order_id": order_id,
+            "user_id": "webhook-storm",
+            "amount": 10.0,
+            "currency": "usd",
+            "payment_status": "initiated",
+            "created_at": now,
+        })
+        sessions.append((session_id, order_id, f"evt_storm_{i}"))
+    await db.orders.insert_many(orders)
+    await db.order_summaries.insert_many([summary_from_order(order) for order in orders])
+    await db.payment_transactions.insert_many(transactions)
+    return sessions
+
+
+async def run(args):
+    import server
+
+    db = server.db
+    async with server.app.router.lifespan_context(server.app):
+        print(f"Creating {args.orders} orders in {BENCH_DB_NAME}...")
+        sessions = await seed(db, args.orders)
+        deliveries = [session for session in sessions for _ in range(args.deliveries)]
+        random.Random(args.seed).shuffle(deliveries)
+
+        latencies = []
+        statuses = {}
+        semaphore = asyncio.Semaphore(args.concurrency)
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://storm", timeout=60) as client:
+
+            async def deliver(session_id: str, order_id: str, event_id: str):
+                body = json.dumps({"session_id": session_id, "payment_status": "paid", "event_id": event_id,
+                                   "metadata": {"order_id": order_id}})
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post("/api/webhook/stripe", content=body,
+                                                 headers={"Stripe-Signature": "storm"})
+                    latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(deliver(*session) for session in deliveries))
+            ack_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        while await server.payment_jobs.backlog():
+            if time.perf_counter() - started > args.drain_timeout:
+                raise SystemExit(f"Queue not drained after {args.drain_timeout}s")
+            await asyncio.sleep(0.05)
+        drain_seconds = time.perf_counter() - started
+
+        session_ids = [session_id for session_id, _, _ in sessions]
+        order_ids = [order_id for _, order_id, _ in sessions]
+        jobs = await db.payment_jobs.count_documents({"session_id": {"$in": session_ids}})
+        paid_orders = await db.orders.count_documents({"id": {"$in": order_ids}, "payment_status": "paid"})
+        paid_transactions = await db.payment_transactions.count_documents(
+            {"session_id": {"$in": session_ids}, "payment_status": "paid"}
+        )
+        queue = server.payment_jobs.stats()
+
+    return {
+        "orders": args.orders,
+        "deliveries": len(deliveries),
+        "concurrency": args.concurrency,
+        "ack": {**percentiles(latencies), "throughput_per_s": round(len(latencies) / ack_seconds, 1)},
+        "statuses": {str(code): n for code, n in sorted(statuses.items())},
+        "drain_seconds": round(drain_seconds, 3),
+        "jobs": jobs,
+        "paid_orders": paid_orders,
+        "paid_transactions": paid_transactions,
+        "queue": queue,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--deliveries", type=int, default=3, help="times each webhook is delivered")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default="webhook_storm.json")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    ack = results["ack"]
+    print(f"{results['deliveries']} deliveries: p50 {ack['p50_ms']} ms, p99 {ack['p99_ms']} ms, "
+          f"{ack['throughput_per_s']}/s; statuses {results['statuses']}")
+    print(f"Drained in {results['drain_seconds']}s; {results['jobs']} jobs, {results['paid_orders']} paid orders, "
+          f"{results['paid_transactions']} paid transactions for {results['orders']} sessions")
+    write_results(args.output, results)
+    if not results["jobs"] == results["paid_orders"] == results["paid_transactions"] == results["orders"]:
+        raise SystemExit("Webhook processing was not exactly-once")
@@ -0,0 +1,133 @@
+"""Small in-process caches.
+
+Entries live in one worker's memory, so writers must invalidate explicitly
+and the TTL bounds how long another worker can serve a stale value.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Sized
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire ``ttl`` seconds after being set."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._discard(key)
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._discard(key)
+        self._entries[key] = (value, expires_at)
+        self._added(key, value)
+        while self._over_capacity():
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        if self._discard(key):
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self.invalidations += len(self._entries)
+        for key in list(self._entries):
+            self._discard(key)
+
+    # Capacity accounting, overridden by size-aware subclasses
+
+    def _added(self, key: Hashable, value: Any) -> None:
+        pass
+
+    def _removed(self, key: Hashable, value: Any) -> None:
+        pass
+
+    def _over_capacity(self) -> bool:
+        return len(self._entries) > self.maxsize
+
+    def _discard(self, key: Hashable) -> bool:
+        entry = self._entries.pop(key, _MISSING)
+        if entry is _MISSING:
+            return False
+        self._removed(key, entry[0])
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class ByteLRUCache(TTLCache):
+    """TTLCache of sized values (``len`` in bytes), bounded by total payload size as well as entry count."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, maxsize: int = 100_000, ttl: float = 3600.0):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        # Bytes counted for each entry, so values that grow in place are
+        # released by what they were charged
+        self._charged: Dict[Hashable, int] = {}
+
+    def set(self, key: Hashable, value: Sized, ttl: Optional[float] = None) -> None:
+        if len(value) > self.max_bytes:
+            return
+        super().set(key, value, ttl)
+
+    def recount(self, key: Hashable) -> None:
+        """Charge the current size of an entry whose value has grown since it was set."""
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            return
+        size = len(entry[0])
+        self.current_bytes += size - self._charged[key]
+        self._charged[key] = size
+        while self._over_capacity():
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+            self.evictions += 1
+
+    def _added(self, key: Hashable, value: Sized) -> None:
+        self._charged[key] = len(value)
+        self.current_bytes += self._charged[key]
+
+    def _removed(self, key: Hashable, value: Sized) -> None:
+        self.current_bytes -= self._charged.pop(key)
+
+    def _over_capacity(self) -> bool:
+        return self.current_bytes > self.max_bytes or super()._over_capacity()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "bytes": self.current_bytes, "max_bytes": self.max_bytes}
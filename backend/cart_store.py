@@ -0,0 +1,73 @@
+"""Atomic cart writes.
+
+Each mutation is a single ``update_one`` evaluated by the server, so
+concurrent requests for the same user (two tabs, double clicks) can no
+longer overwrite each other's changes the way the old read-modify-write of
+the whole ``items`` array did.
+"""
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+# Upserts race on the unique carts.user_id index when a user's first two
+# writes arrive together; the loser simply retries as an update.
+UPSERT_ATTEMPTS = 3
+
+
+def _add_item_pipeline(item: dict, updated_at) -> list:
+    product_id = {"$literal": item["product_id"]}
+    items = {"$ifNull": ["$items", []]}
+    return [{"$set": {
+        "id": {"$ifNull": ["$id", str(uuid.uuid4())]},
+        "items": {"$cond": [
+            {"$in": [product_id, {"$map": {"input": items, "as": "i", "in": "$$i.product_id"}}]},
+            {"$map": {"input": items, "as": "i", "in": {"$cond": [
+                {"$eq": ["$$i.product_id", product_id]},
+                {"$mergeObjects": ["$$i", {"quantity": {"$add": ["$$i.quantity", item["quantity"]]}}]},
+                "$$i",
+            ]}}},
+            {"$concatArrays": [items, [{"$literal": item}]]},
+        ]},
+        "updated_at": {"$literal": updated_at},
+    }}]
+
+
+async def add_item(carts, user_id: str, item: dict, updated_at) -> None:
+    """Add ``item`` to the user's cart, or bump its quantity if already present.
+
+    Creates the cart if the user has none.
+    """
+    pipeline = _add_item_pipeline(item, updated_at)
+    for attempt in range(UPSERT_ATTEMPTS):
+        try:
+            await carts.update_one({"user_id": user_id}, pipeline, upsert=True)
+            return
+        except DuplicateKeyError:
+            if attempt == UPSERT_ATTEMPTS - 1:
+                raise
+
+
+async def set_item_quantity(carts, user_id: str, product_id: str, quantity: int, updated_at) -> bool:
+    """Set an item's quantity, removing it when ``quantity`` <= 0.
+
+    Returns False if the cart does not contain the product.
+    """
+    query = {"user_id": user_id, "items.product_id": product_id}
+    if quantity <= 0:
+        update = {"$pull": {"items": {"product_id": product_id}}, "$set": {"updated_at": updated_at}}
+    else:
+        update = {"$set": {"items.$.quantity": quantity, "updated_at": updated_at}}
+    result = await carts.update_one(query, update)
+    return result.matched_count == 1
+
+
+async def get_or_create(carts, user_id: str, new_cart: dict) -> dict:
+    """Return the user's cart, inserting ``new_cart`` if there is none."""
+    cart_doc = await carts.find_one({"user_id": user_id}, {"_id": 0})
+    if cart_doc:
+        return cart_doc
+    result = await carts.update_one({"user_id": user_id}, {"$setOnInsert": new_cart}, upsert=True)
+    if result.upserted_id is None:
+        # Another request created it in the meantime
+        return await carts.find_one({"user_id": user_id}, {"_id": 0})
+    return new_cart
@@ -0,0 +1,201 @@
+"""Catalog change notifications.
+
+Components that keep derived state about the catalog (the search index,
+caches) subscribe to ``catalog_events``. Writes made by this process publish
+directly; writes made elsewhere (seed_data.py, other API workers) are picked
+up by ``watch_catalog`` from a Mongo change stream, or by polling the catalog
+version document when the deployment has no replica set.
+
+The change stream survives connection errors: it reopens with backoff from
+the last resume token, and if the oplog no longer has that point it
+publishes ``CATALOG_RELOADED`` so listeners rebuild. The polling fallback
+only sees bulk changes that bump the catalog version. On a standalone
+server, stock and product changes made by other workers never reach this
+worker's listeners; its caches only catch up when their entries expire.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+CATALOG_META_ID = "catalog"
+
+# Event kinds
+PRODUCT_CHANGED = "product_changed"
+# Only stock/reservations changed; searchable fields are untouched
+STOCK_CHANGED = "stock_changed"
+# A product was deleted but only its Mongo ``_id`` is known (no pre-image)
+PRODUCT_DELETED = "product_deleted"
+CATEGORIES_CHANGED = "categories_changed"
+CATALOG_RELOADED = "catalog_reloaded"
+
+WATCHED_COLLECTIONS = ["products", "categories"]
+# ChangeStreamHistoryLost, ChangeStreamFatalError: the resume token is unusable
+CHANGE_STREAM_HISTORY_LOST = {280, 286}
+# Options that ask for pre-images; servers before 6.0 reject them
+PRE_IMAGE_OPTIONS = {"full_document_before_change": "whenAvailable"}
+
+
+@dataclass
+class CatalogEvent:
+    kind: str
+    product_id: Optional[str] = None
+    # Product after the change; None for deletes or when unknown
+    document: Optional[dict] = None
+    # Product before the change: {} for inserts, None when unknown (no
+    # change-stream pre-images, or a change made by this process)
+    previous: Optional[dict] = None
+    # Unique per change-stream event, so every worker sees the same id
+    event_id: Optional[str] = None
+    # Change-stream documentKey ({"_id": ...}) of a PRODUCT_DELETED product
+    document_key: Optional[dict] = None
+
+
+Listener = Callable[[CatalogEvent], Awaitable[None]]
+
+
+class CatalogEvents:
+    def __init__(self):
+        self._listeners: List[Listener] = []
+        # True while a change stream delivers other processes' writes
+        self.streaming = False
+
+    def subscribe(self, listener: Listener) -> None:
+        self._listeners.append(listener)
+
+    async def publish(self, kind: str, product_id: Optional[str] = None, document: Optional[dict] = None,
+                      previous: Optional[dict] = None, event_id: Optional[str] = None,
+                      document_key: Optional[dict] = None) -> None:
+        event = CatalogEvent(kind, product_id, document, previous, event_id, document_key)
+        for listener in list(self._listeners):
+            try:
+                await listener(event)
+            except Exception:
+                logger.exception(f"Catalog listener failed for {kind} {product_id or ''}")
+
+
+catalog_events = CatalogEvents()
+
+
+async def bump_catalog_version(db) -> int:
+    """Record an out-of-band catalog change so polling workers notice it."""
+    meta = await db.catalog_meta.find_one_and_update(
+        {"_id": CATALOG_META_ID},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return meta["version"]
+
+
+async def get_catalog_version(db) -> int:
+    meta = await db.catalog_meta.find_one({"_id": CATALOG_META_ID})
+    return meta["version"] if meta else 0
+
+
+def _only_stock_changed(change: dict) -> bool:
+    description = change.get("updateDescription") or {}
+    fields = list(description.get("updatedFields", {})) + list(description.get("removedFields", []))
+    return bool(fields) and all(f.split(".")[0] in ("stock", "reservations") for f in fields)
+
+
+async def _dispatch_change(change: dict, events: CatalogEvents) -> None:
+    operation = change["operationType"]
+    collection = change.get("to", change.get("ns", {})).get("coll")
+    document = change.get("fullDocument")
+    previous = {} if operation == "insert" else change.get("fullDocumentBeforeChange")
+    event_id = change["_id"].get("_data")
+    if collection == "categories":
+        await events.publish(CATEGORIES_CHANGED)
+    elif operation == "update" and document and _only_stock_changed(change):
+        await events.publish(STOCK_CHANGED, document.get("id"), document)
+    elif operation in ("insert", "update", "replace") and document:
+        await events.publish(PRODUCT_CHANGED, document.get("id"), document, previous, event_id)
+    elif operation == "delete" and previous:
+        await events.publish(PRODUCT_CHANGED, previous.get("id"), None, previous, event_id)
+    elif operation == "delete":
+        # Without a pre-image a delete only carries the Mongo _id, not our
+        # product id; listeners drop what they cannot key by _id
+        await events.publish(PRODUCT_DELETED, event_id=event_id, document_key=change.get("documentKey"))
+    else:
+        # Drops and renames come from bulk re-imports
+        await events.publish(CATALOG_RELOADED)
+
+
+async def _watch_change_stream(db, events: CatalogEvents, max_backoff: float) -> None:
+    """Follow the change stream until cancelled; raises OperationFailure if the server has none."""
+    pipeline = [{"$match": {"$or": [
+        {"ns.coll": {"$in": WATCHED_COLLECTIONS}},
+        {"to.coll": {"$in": WATCHED_COLLECTIONS}},
+    ]}}]
+    resume_token = None
+    opened = False
+    # Pre-images need MongoDB 6.0+ with changeStreamPreAndPostImages enabled
+    # on products; without them deletes and facet counts take coarser paths
+    options = dict(PRE_IMAGE_OPTIONS)
+    backoff = min(1.0, max_backoff)
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup", resume_after=resume_token,
+                                **options) as stream:
+                if opened and resume_token is None:
+                    # Changes made while the stream was down are unknown
+                    await events.publish(CATALOG_RELOADED)
+                opened = True
+                events.streaming = True
+                backoff = min(1.0, max_backoff)
+                resume_token = stream.resume_token
+                async for change in stream:
+                    await _dispatch_change(change, events)
+                    resume_token = stream.resume_token
+        except OperationFailure as e:
+            events.streaming = False
+            if not opened and options:
+                logger.warning(f"Catalog change stream rejected pre-images ({e}); watching without them")
+                options = {}
+                continue
+            if not opened:
+                raise
+            if e.code in CHANGE_STREAM_HISTORY_LOST:
+                logger.warning(f"Catalog change stream cannot resume ({e}); reloading")
+                resume_token = None
+                continue
+            logger.warning(f"Catalog change stream failed ({e}); reopening in {backoff:.0f}s")
+        except PyMongoError as e:
+            events.streaming = False
+            logger.warning(f"Catalog change stream interrupted ({e}); reopening in {backoff:.0f}s")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, max_backoff)
+
+
+async def _poll_catalog_version(db, events: CatalogEvents, poll_interval: float) -> None:
+    version = await get_catalog_version(db)
+    while True:
+        await asyncio.sleep(poll_interval)
+        try:
+            current = await get_catalog_version(db)
+        except PyMongoError as e:
+            logger.warning(f"Catalog version poll failed: {e}")
+            continue
+        if current != version:
+            version = current
+            await events.publish(CATALOG_RELOADED)
+
+
+async def watch_catalog(db, events: CatalogEvents = catalog_events, poll_interval: float = 5.0,
+                        max_backoff: float = 60.0) -> None:
+    """Forward external catalog changes to ``events`` until cancelled."""
+    try:
+        await _watch_change_stream(db, events, max_backoff)
+    except OperationFailure as e:
+        # Usually a standalone server, which has no change streams
+        logger.warning(
+            f"Catalog change stream unavailable ({e}); polling catalog version every {poll_interval}s. "
+            "Stock and product changes made by other workers will not reach this worker's caches."
+        )
+    await _poll_catalog_version(db, events, poll_interval)
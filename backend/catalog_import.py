@@ -0,0 +1,337 @@
+"""Bulk catalog import from CSV or JSONL.
+
+Rows are streamed into a staging collection with unordered, batched upserts
+keyed on ``sku``, several batches in flight at once. Once every row is
+loaded and the staging collection has the live indexes, it is renamed over
+``products`` in one step, so readers see either the old catalog or the new
+one and never a partial load.
+
+Product ids are stable across imports: a SKU already in the live catalog
+keeps its id and ``created_at``, so carts and orders keep pointing at it. New
+SKUs get an id derived from the SKU. Live products without a ``sku`` (made
+by hand, or by seed_data.py before it used SKUs) are not matched and are
+dropped by the swap; give them their SKU first to keep their ids.
+
+The swap is skipped, and the staging collection dropped, when no row was
+imported or more than ``--max-reject-ratio`` of the rows were rejected
+(a wrong header or column mapping), so a bad file cannot empty the catalog. Stock held by unpaid orders is carried
+over just before the swap. An order reserved in the moment between that
+carry-over and the rename keeps its order but not its hold on the new stock.
+
+Usage: python catalog_import.py products.csv [--categories categories.jsonl]
+       [--batch-size 1000] [--concurrency 4] [--max-reject-ratio 0.05]
+
+CSV columns: sku, title, description, price, images (separated by ``|``),
+category, stock, rating, reviews_count. JSONL rows use the same keys, with
+``images`` as a list.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, Iterable, List, Optional, Union
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from catalog_events import bump_catalog_version
+from dates import utcnow
+from db_indexes import INDEXES, ensure_collection_indexes
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# Namespace for ids derived from SKUs
+SKU_NAMESPACE = uuid.UUID("6f1d3c52-8a4e-4c7b-9a0f-2b6e5d4c3a19")
+DUPLICATE_KEY = 11000
+PROGRESS_INTERVAL_SECONDS = 2.0
+MAX_REJECT_RATIO = 0.05
+
+Rows = Union[Iterable[dict], AsyncIterator[dict]]
+
+
+@dataclass
+class ImportReport:
+    read: int = 0
+    upserted: int = 0
+    rejected: int = 0
+    errors: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.read / self.seconds if self.seconds else 0.0
+
+    @property
+    def reject_ratio(self) -> float:
+        return self.rejected / self.read if self.read else 0.0
+
+
+class ImportAborted(Exception):
+    """The load looked wrong, so the live catalog was left untouched."""
+
+    def __init__(self, message: str, report: ImportReport):
+        super().__init__(message)
+        self.report = report
+
+
+def _slugify(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def product_from_row(row: dict) -> dict:
+    """Validate one input row; raises ValueError when it cannot be imported."""
+    sku = str(row.get("sku") or "").strip()
+    title = str(row.get("title") or "").strip()
+    category = str(row.get("category") or "").strip()
+    if not sku or not title or not category:
+        raise ValueError("sku, title and category are required")
+    images = row.get("images") or []
+    if isinstance(images, str):
+        images = [image.strip() for image in images.split("|") if image.strip()]
+    try:
+        return {
+            "sku": sku,
+            "title": title,
+            "description": str(row.get("description") or ""),
+            "price": float(row["price"]),
+            "images": list(images),
+            "category": category,
+            "stock": int(row.get("stock") or 0),
+            "rating": float(row.get("rating") or 0),
+            "reviews_count": int(row.get("reviews_count") or 0),
+        }
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"missing or malformed field: {e}")
+
+
+def category_from_row(row: dict) -> dict:
+    name = str(row.get("name") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    return {
+        "name": name,
+        "slug": str(row.get("slug") or _slugify(name)),
+        "description": str(row.get("description") or ""),
+        "image": str(row.get("image") or ""),
+    }
+
+
+def read_rows(path: Path) -> Iterable[dict]:
+    """Stream rows from a .csv or .jsonl file without loading it whole."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.suffix.lower() == ".csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+async def _aiter(rows: Rows) -> AsyncIterator[dict]:
+    if hasattr(rows, "__aiter__"):
+        async for row in rows:
+            yield row
+    else:
+        for n, row in enumerate(rows, 1):
+            yield row
+            if n % 1000 == 0:
+                await asyncio.sleep(0)
+
+
+class CatalogImporter:
+    def __init__(self, db, batch_size: int = 1000, concurrency: int = 4, progress: bool = True,
+                 max_reject_ratio: float = MAX_REJECT_RATIO):
+        self.db = db
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.progress = progress
+        self.max_reject_ratio = max_reject_ratio
+
+    def _check(self, report: ImportReport) -> None:
+        if report.upserted == 0:
+            raise ImportAborted(f"No products imported from {report.read} rows", report)
+        if report.reject_ratio > self.max_reject_ratio:
+            raise ImportAborted(
+                f"{report.rejected} of {report.read} rows rejected, above the limit of {self.max_reject_ratio:.0%}",
+                report
+            )
+
+    async def _write_batch(self, staging, batch: List[dict], report: ImportReport) -> None:
+        # Existing SKUs keep their id and created_at
+        live = await self.db.products.find(
+            {"sku": {"$in": [product["sku"] for product in batch]}},
+            {"_id": 0, "sku": 1, "id": 1, "created_at": 1}
+        ).to_list(len(batch))
+        known = {doc["sku"]: doc for doc in live}
+        now = utcnow()
+        ops = []
+        for product in batch:
+            existing = known.get(product["sku"], {})
+            ops.append(UpdateOne(
+                {"sku": product["sku"]},
+                {
+                    "$set": product,
+                    "$setOnInsert": {
+                        "id": existing.get("id") or str(uuid.uuid5(SKU_NAMESPACE, product["sku"])),
+                        "created_at": existing.get("created_at") or now,
+                    },
+                },
+                upsert=True
+            ))
+        try:
+            result = await staging.bulk_write(ops, ordered=False)
+            report.upserted += result.upserted_count + result.modified_count
+        except BulkWriteError as e:
+            details = e.details
+            report.upserted += details.get("nUpserted", 0) + details.get("nModified", 0)
+            # Two in-flight batches inserting the same SKU race on the unique
+            # index; the loser becomes an update on retry
+            retry = [ops[error["index"]] for error in details["writeErrors"] if error["code"] == DUPLICATE_KEY]
+            for error in details["writeErrors"]:
+                if error["code"] != DUPLICATE_KEY:
+                    report.rejected += 1
+                    report.errors.append(f"{batch[error['index']]['sku']}: {error['errmsg']}")
+            if retry:
+                result = await staging.bulk_write(retry, ordered=False)
+                report.upserted += result.upserted_count + result.modified_count
+
+    async def _load(self, staging, rows: Rows, report: ImportReport, started: float) -> None:
+        # Bounded queue: reading pauses while every writer is busy
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        failures: List[BaseException] = []
+
+        async def writer():
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                if failures:
+                    continue
+                try:
+                    await self._write_batch(staging, batch, report)
+                except Exception as e:
+                    failures.append(e)
+
+        writers = [asyncio.create_task(writer()) for _ in range(self.concurrency)]
+        try:
+            batch: List[dict] = []
+            last_report = time.perf_counter()
+            async for row in _aiter(rows):
+                if failures:
+                    break
+                report.read += 1
+                try:
+                    batch.append(product_from_row(row))
+                except ValueError as e:
+                    report.rejected += 1
+                    report.errors.append(f"row {report.read}: {e}")
+                if len(batch) >= self.batch_size:
+                    await queue.put(batch)
+                    batch = []
+                if self.progress and time.perf_counter() - last_report >= PROGRESS_INTERVAL_SECONDS:
+                    last_report = time.perf_counter()
+                    elapsed = last_report - started
+                    print(f"{report.read} rows read, {report.upserted} upserted, {report.rejected} rejected ({report.read / elapsed:.0f} rows/s)")
+            if batch:
+                await queue.put(batch)
+            for _ in writers:
+                await queue.put(None)
+            await asyncio.gather(*writers)
+        finally:
+            for task in writers:
+                task.cancel()
+        if failures:
+            raise failures[0]
+
+    async def _carry_over_reservations(self, staging) -> None:
+        # Available stock is on-hand stock minus what unpaid orders hold
+        async for doc in self.db.products.find(
+            {"reservations.order_id": {"$exists": True}},
+            {"_id": 0, "id": 1, "reservations": 1}
+        ):
+            reserved = sum(reservation["quantity"] for reservation in doc["reservations"])
+            await staging.update_one(
+                {"id": doc["id"]},
+                {"$set": {"reservations": doc["reservations"]}, "$inc": {"stock": -reserved}}
+            )
+
+    async def _import_categories(self, rows: Rows, report: ImportReport):
+        staging = self.db[f"categories_import_{uuid.uuid4().hex[:12]}"]
+        live = {doc["slug"]: doc["id"] for doc in await self.db.categories.find({}, {"_id": 0, "slug": 1, "id": 1}).to_list(None)}
+        categories = []
+        async for row in _aiter(rows):
+            try:
+                category = category_from_row(row)
+            except ValueError as e:
+                report.errors.append(f"category: {e}")
+                continue
+            category["id"] = live.get(category["slug"]) or str(uuid.uuid5(SKU_NAMESPACE, f"category:{category['slug']}"))
+            categories.append(category)
+        if categories:
+            await staging.insert_many(categories)
+        return staging
+
+    async def run(self, products: Rows, categories: Optional[Rows] = None) -> ImportReport:
+        report = ImportReport()
+        started = time.perf_counter()
+        staging = self.db[f"products_import_{uuid.uuid4().hex[:12]}"]
+        categories_staging = None
+        try:
+            # Indexes first: the sku upserts need the unique index
+            await ensure_collection_indexes(staging, INDEXES["products"])
+            await self._load(staging, products, report, started)
+            self._check(report)
+            if categories is not None:
+                categories_staging = await self._import_categories(categories, report)
+            await self._carry_over_reservations(staging)
+            await staging.rename("products", dropTarget=True)
+            if categories_staging is not None:
+                await categories_staging.rename("categories", dropTarget=True)
+        except BaseException:
+            await staging.drop()
+            if categories_staging is not None:
+                await categories_staging.drop()
+            raise
+        await bump_catalog_version(self.db)
+        report.seconds = time.perf_counter() - started
+        return report
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        importer = CatalogImporter(db, batch_size=args.batch_size, concurrency=args.concurrency,
+                                   max_reject_ratio=args.max_reject_ratio)
+        categories = read_rows(Path(args.categories)) if args.categories else None
+        report = await importer.run(read_rows(Path(args.products)), categories)
+    except ImportAborted as e:
+        for error in e.report.errors[:20]:
+            print(f"  rejected {error}")
+        raise SystemExit(f"Import aborted, catalog unchanged: {e}")
+    finally:
+        client.close()
+    for error in report.errors[:20]:
+        print(f"  rejected {error}")
+    print(f"Imported {report.upserted} products from {report.read} rows in {report.seconds:.1f}s "
+          f"({report.rate:.0f} rows/s), {report.rejected} rejected")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("products", help="CSV or JSONL file of products")
+    parser.add_argument("--categories", help="CSV or JSONL file of categories, replacing the current ones")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4, help="batches written in parallel")
+    parser.add_argument("--max-reject-ratio", type=float, default=MAX_REJECT_RATIO,
+                        help="abort without swapping when more of the rows than this are rejected")
+    asyncio.run(main(parser.parse_args()))
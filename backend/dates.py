@@ -0,0 +1,43 @@
+"""Timestamp storage helpers.
+
+Timestamps are stored as native BSON dates. Documents written before that
+change hold ISO strings until ``migrate_dates.py`` has converted them. The
+pydantic models parse either form on their own; ``coerce_datetimes`` does
+the same for raw documents that never pass through a model (exports).
+Until the migration finishes, keyset pages sorted on a timestamp stop at the
+boundary between converted and unconverted documents, because Mongo orders
+strings and dates as different types.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Tuple
+
+# Every timestamp field the API persists, by collection
+DATETIME_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "users": ("created_at",),
+    "products": ("created_at",),
+    "carts": ("updated_at",),
+    "orders": ("created_at", "reservation_expires_at"),
+    "order_summaries": ("created_at",),
+    "orders_archive": ("created_at", "reservation_expires_at"),
+    "payment_transactions": ("created_at",),
+}
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def parse_datetime(value):
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value)
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    return value
+
+
+def coerce_datetimes(doc: dict, fields: Iterable[str]) -> dict:
+    """Convert any legacy ISO-string timestamps in ``doc`` in place."""
+    for field in fields:
+        value = doc.get(field)
+        if isinstance(value, str):
+            doc[field] = parse_datetime(value)
+    return doc
@@ -0,0 +1,136 @@
+"""Index declarations for the collections the API queries.
+
+``ensure_indexes`` runs on startup: it creates any declared index that is
+missing (matching on key pattern, so indexes created by hand under another
+name are left alone) and logs every query pattern in ``QUERY_PATTERNS`` that
+no index supports. Add a pattern here whenever a handler starts filtering on
+a new field.
+"""
+import logging
+from typing import Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "products": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Keyset pagination sorts (see pagination.PRODUCT_SORTS)
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("price", ASCENDING), ("id", ASCENDING)], name="price_id"),
+        IndexModel([("rating", DESCENDING), ("id", DESCENDING)], name="rating_id"),
+        # The same sorts within a category; these also serve plain category lookups
+        IndexModel([("category", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+                   name="category_created_at_id"),
+        IndexModel([("category", ASCENDING), ("price", ASCENDING), ("id", ASCENDING)], name="category_price_id"),
+        IndexModel([("category", ASCENDING), ("rating", DESCENDING), ("id", DESCENDING)], name="category_rating_id"),
+        # Stock held by unpaid orders (see order_placement.py)
+        IndexModel([("reservations.order_id", ASCENDING)], name="reservations_order_id", sparse=True),
+        # Catalog imports upsert on SKU; hand-made products may not have one
+        IndexModel([("sku", ASCENDING)], name="sku_unique", unique=True,
+                   partialFilterExpression={"sku": {"$type": "string"}}),
+    ],
+    "carts": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_id_created_at_id"),
+        # Only unpaid orders carry the field, so the index stays small
+        IndexModel([("reservation_expires_at", ASCENDING)], name="reservation_expires_at", sparse=True),
+        # Archiving scans for old settled orders (see order_history.py)
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+    # Order history (see order_history.py)
+    "order_summaries": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_id_created_at_id"),
+    ],
+    "orders_archive": [
+        IndexModel([("id", ASCENDING), ("user_id", ASCENDING)], name="id_user_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="user_id_created_at_id"),
+    ],
+    # Payment transition queue (see payment_jobs.py)
+    "payment_jobs": [
+        IndexModel([("status", ASCENDING), ("available_at", ASCENDING)], name="status_available_at"),
+        IndexModel([("claim", ASCENDING)], name="claim", sparse=True),
+        # Finished jobs are the dedup record and expire after a week
+        IndexModel([("done_at", ASCENDING)], name="done_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+    ],
+}
+
+# (collection, equality fields) for every lookup server.py issues
+QUERY_PATTERNS: List[Tuple[str, Tuple[str, ...]]] = [
+    ("users", ("id",)),
+    ("users", ("email",)),
+    ("products", ("id",)),
+    ("products", ("category",)),
+    ("products", ("reservations.order_id",)),
+    ("products", ("sku",)),
+    ("carts", ("user_id",)),
+    ("orders", ("id",)),
+    ("orders", ("id", "user_id")),
+    ("orders", ("user_id",)),
+    ("orders", ("reservation_expires_at",)),
+    ("orders", ("created_at",)),
+    ("order_summaries", ("id",)),
+    ("order_summaries", ("user_id",)),
+    ("orders_archive", ("id",)),
+    ("orders_archive", ("id", "user_id")),
+    ("orders_archive", ("user_id",)),
+    ("payment_jobs", ("status",)),
+    ("payment_jobs", ("claim",)),
+    ("payment_transactions", ("session_id",)),
+    ("payment_transactions", ("session_id", "user_id")),
+]
+
+
+def _key_fields(index_info: dict) -> Tuple[str, ...]:
+    return tuple(field for field, _ in index_info["key"])
+
+
+async def ensure_collection_indexes(collection, models: List[IndexModel]) -> int:
+    """Create the indexes in ``models`` that ``collection`` lacks; returns how many were created."""
+    existing = {tuple(info["key"]) for info in (await collection.index_information()).values()}
+    created = 0
+    for model in models:
+        document = model.document
+        if tuple(document["key"].items()) in existing:
+            continue
+        try:
+            await collection.create_indexes([model])
+            created += 1
+            logger.info(f"Created index {collection.name}.{document['name']}")
+        except OperationFailure as e:
+            # Usually duplicate data under a unique index; keep serving without it
+            logger.error(f"Could not create index {collection.name}.{document['name']}: {e}")
+    return created
+
+
+async def ensure_indexes(db) -> None:
+    for name, models in INDEXES.items():
+        await ensure_collection_indexes(db[name], models)
+    await report_unindexed_queries(db)
+
+
+async def report_unindexed_queries(db) -> List[Tuple[str, Tuple[str, ...]]]:
+    """Log and return query patterns whose leading field no index starts with."""
+    leading_fields: Dict[str, set] = {}
+    unindexed = []
+    for collection, fields in QUERY_PATTERNS:
+        if collection not in leading_fields:
+            info = await db[collection].index_information()
+            leading_fields[collection] = {_key_fields(index)[0] for index in info.values()}
+        if not leading_fields[collection] & set(fields):
+            unindexed.append((collection, fields))
+            logger.warning(f"No index supports {collection} queries on {', '.join(fields)}")
+    return unindexed
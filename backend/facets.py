@@ -0,0 +1,208 @@
+"""Category, price and rating facet counts for the catalog sidebar.
+
+Filtered facets (a search or a category) come from one ``$facet``
+aggregation. Counts for the unfiltered catalog are kept in a summary
+document in ``catalog_facets`` so the landing page is a single ``find_one``.
+The summary is rebuilt in full when the catalog is reloaded, and patched with
+``$inc`` deltas for single-product changes whenever the change stream supplies
+the product's previous version. Every worker sees the same change events, so
+each delta is tagged with the event id and applied at most once.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from urllib.parse import quote, unquote
+
+from pymongo.errors import PyMongoError
+
+from catalog_events import CATALOG_RELOADED, PRODUCT_CHANGED, PRODUCT_DELETED, CatalogEvent
+from dates import utcnow
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_ID = "all"
+# Bucket lower bounds; the last bucket is open-ended
+PRICE_BOUNDARIES = [0, 25, 50, 100, 250, 500, 1000]
+RATING_BOUNDARIES = [0, 1, 2, 3, 4]
+# Event ids remembered on the summary for idempotent deltas
+APPLIED_EVENTS_KEPT = 1000
+REFRESH_DELAY_SECONDS = 2.0
+
+
+def bucket_for(value, boundaries: List[float]) -> float:
+    """Lower bound of the ``$bucket`` a value falls into, matching Mongo's placement."""
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return boundaries[-1]
+    if value < boundaries[0] or value >= boundaries[-1]:
+        return boundaries[-1]
+    for lower, upper in zip(boundaries, boundaries[1:]):
+        if lower <= value < upper:
+            return lower
+    return boundaries[-1]
+
+
+def _bucket_stage(field: str, boundaries: List[float]) -> dict:
+    # Values past the last bound (and missing values) land in the open bucket
+    return {"$bucket": {
+        "groupBy": f"${field}",
+        "boundaries": boundaries,
+        "default": boundaries[-1],
+        "output": {"count": {"$sum": 1}},
+    }}
+
+
+def facet_pipeline(match: dict, category: Optional[str] = None) -> List[dict]:
+    """One aggregation returning every facet for ``match``.
+
+    The category facet ignores the selected category so the sidebar can still
+    show the alternatives; price and rating are narrowed to it.
+    """
+    narrowed = [{"$match": {"category": category}}] if category else []
+    return [
+        {"$match": match},
+        {"$project": {"_id": 0, "category": 1, "price": 1, "rating": 1}},
+        {"$facet": {
+            "categories": [{"$sortByCount": "$category"}],
+            "price": narrowed + [_bucket_stage("price", PRICE_BOUNDARIES)],
+            "rating": narrowed + [_bucket_stage("rating", RATING_BOUNDARIES)],
+            "total": narrowed + [{"$count": "count"}],
+        }},
+    ]
+
+
+def _buckets(counts: Dict[float, int], boundaries: List[float]) -> List[dict]:
+    upper_bounds = boundaries[1:] + [None]
+    return [
+        {"min": lower, "max": upper, "count": counts.get(lower, 0)}
+        for lower, upper in zip(boundaries, upper_bounds)
+    ]
+
+
+def _format(categories: Dict[str, int], price: Dict[float, int], rating: Dict[float, int], total: int) -> dict:
+    ordered = sorted(((name, n) for name, n in categories.items() if n > 0), key=lambda item: (-item[1], item[0]))
+    return {
+        "categories": [{"value": name, "count": n} for name, n in ordered],
+        "price": _buckets(price, PRICE_BOUNDARIES),
+        "rating": _buckets(rating, RATING_BOUNDARIES),
+        "total": total,
+    }
+
+
+def _escape_key(key) -> str:
+    # Field names may not contain "." or start with "$"
+    return quote(str(key), safe=" ").replace(".", "%2E")
+
+
+def _summary_counts(doc: dict, field: str) -> Dict[float, int]:
+    return {float(key): n for key, n in doc.get(field, {}).items()}
+
+
+class CatalogFacets:
+    def __init__(self, products, summaries):
+        self.products = products
+        self.summaries = summaries
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.deltas_applied = 0
+        self.refreshes = 0
+
+    async def compute(self, match: dict, category: Optional[str] = None) -> dict:
+        result = await self.products.aggregate(facet_pipeline(match, category)).to_list(1)
+        facets = result[0] if result else {}
+        total = facets.get("total") or [{"count": 0}]
+        return _format(
+            {row["_id"]: row["count"] for row in facets.get("categories", []) if row["_id"] is not None},
+            {row["_id"]: row["count"] for row in facets.get("price", [])},
+            {row["_id"]: row["count"] for row in facets.get("rating", [])},
+            total[0]["count"],
+        )
+
+    async def for_category(self, category: str) -> dict:
+        """Facets within one category, without aggregating the whole catalog."""
+        facets = await self.compute({"category": category})
+        facets["categories"] = (await self.summary())["categories"]
+        return facets
+
+    async def summary(self) -> dict:
+        """Facets for the whole catalog, from the precomputed summary."""
+        doc = await self.summaries.find_one({"_id": SUMMARY_ID}, {"applied": 0})
+        if doc is None:
+            await self.refresh()
+            doc = await self.summaries.find_one({"_id": SUMMARY_ID}, {"applied": 0})
+        return _format(
+            {unquote(key): n for key, n in doc.get("categories", {}).items()},
+            _summary_counts(doc, "price"),
+            _summary_counts(doc, "rating"),
+            doc.get("total", 0),
+        )
+
+    async def refresh(self) -> None:
+        """Recount the whole catalog into the summary document."""
+        self.refreshes += 1
+        facets = await self.compute({})
+        await self.summaries.update_one(
+            {"_id": SUMMARY_ID},
+            {"$set": {
+                "categories": {_escape_key(row["value"]): row["count"] for row in facets["categories"]},
+                "price": {_escape_key(row["min"]): row["count"] for row in facets["price"]},
+                "rating": {_escape_key(row["min"]): row["count"] for row in facets["rating"]},
+                "total": facets["total"],
+                "refreshed_at": utcnow(),
+            }},
+            upsert=True,
+        )
+
+    async def ensure_summary(self) -> None:
+        if await self.summaries.count_documents({"_id": SUMMARY_ID}, limit=1) == 0:
+            await self.refresh()
+
+    def schedule_refresh(self, delay: float = REFRESH_DELAY_SECONDS) -> None:
+        """Recount after ``delay``, coalescing bursts of changes into one pass."""
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.ensure_future(self._delayed_refresh(delay))
+
+    async def _delayed_refresh(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        try:
+            await self.refresh()
+        except PyMongoError as e:
+            logger.error(f"Facet summary refresh failed: {e}")
+
+    async def apply_delta(self, before: dict, after: Optional[dict], event_id: str) -> None:
+        increments: Dict[str, int] = {}
+        for doc, sign in ((before, -1), (after, 1)):
+            if not doc:
+                continue
+            keys = [
+                f"price.{_escape_key(bucket_for(doc.get('price'), PRICE_BOUNDARIES))}",
+                f"rating.{_escape_key(bucket_for(doc.get('rating'), RATING_BOUNDARIES))}",
+                "total",
+            ]
+            if doc.get("category") is not None:
+                keys.append(f"categories.{_escape_key(doc['category'])}")
+            for key in keys:
+                increments[key] = increments.get(key, 0) + sign
+        increments = {key: n for key, n in increments.items() if n}
+        if not increments:
+            return
+        result = await self.summaries.update_one(
+            {"_id": SUMMARY_ID, "applied": {"$ne": event_id}},
+            {
+                "$inc": increments,
+                "$push": {"applied": {"$each": [event_id], "$slice": -APPLIED_EVENTS_KEPT}},
+            },
+        )
+        self.deltas_applied += result.modified_count
+
+    async def handle_catalog_event(self, event: CatalogEvent) -> None:
+        if event.kind in (CATALOG_RELOADED, PRODUCT_DELETED):
+            self.schedule_refresh()
+        elif event.kind == PRODUCT_CHANGED:
+            if event.previous is not None and event.event_id:
+                await self.apply_delta(event.previous, event.document, event.event_id)
+            else:
+                # Without the previous version the old buckets are unknown
+                self.schedule_refresh()
+
+    def stats(self) -> dict:
+        return {"deltas_applied": self.deltas_applied, "refreshes": self.refreshes}
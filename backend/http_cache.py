@@ -0,0 +1,104 @@
+"""Conditional GET for catalog responses.
+
+Cached catalog bodies carry a strong ``ETag``, a hash of the exact JSON
+bytes computed once when the body is cached. The tag depends only on the
+content, so every worker gives the same tag for the same product and the
+CDN can revalidate against any of them. A request whose ``If-None-Match``
+matches gets a bodiless 304. ``Cache-Control`` lets browsers and shared
+caches reuse a body for ``CATALOG_MAX_AGE`` seconds before revalidating.
+
+Large bodies that are stored in a cache also keep their compressed
+variants. The handler picks an encoding from ``Accept-Encoding`` and
+compresses the body the first time that encoding is asked for. Bodies that
+are not cached go out uncompressed and are left to ``CompressionMiddleware``.
+Each encoding is a separate representation with its own tag
+(``"<hash>-br"``), but any of them revalidates the others since the content
+is the same.
+
+Products carry no modification time, so there is no ``Last-Modified``;
+clients revalidate with the ETag alone.
+"""
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+from fastapi import Request, Response
+
+from response_compression import choose_encoding, compress_stored, encoded_etag, stored_encodings
+
+CATALOG_MAX_AGE = int(os.environ.get('CATALOG_MAX_AGE', 60))
+CATALOG_CACHE_CONTROL = f"public, max-age={CATALOG_MAX_AGE}"
+
+
+def strong_etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+@dataclass
+class CachedBody:
+    body: bytes
+    etag: str
+    # Sent with the body and with 304s, e.g. X-Next-Cursor
+    headers: Dict[str, str] = field(default_factory=dict)
+    # Content-Encoding -> compressed body, or None where it is no smaller
+    encodings: Dict[str, Optional[bytes]] = field(default_factory=dict)
+    # Set by the cache that stores the body, which must recount its size
+    # whenever a variant is added; bodies that are not stored keep none
+    on_grow: Optional[Callable[[], None]] = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def of(cls, body: bytes, headers: Optional[Dict[str, str]] = None) -> "CachedBody":
+        return cls(body, strong_etag(body), headers or {})
+
+    @property
+    def stored(self) -> bool:
+        return self.on_grow is not None
+
+    def variant(self, encoding: str) -> Optional[bytes]:
+        """The body in ``encoding``, compressed on first use; None if compression does not pay."""
+        if encoding not in self.encodings:
+            self.encodings[encoding] = compress_stored(self.body, encoding)
+            self.on_grow()
+        return self.encodings[encoding]
+
+    def __len__(self) -> int:
+        # Sized by payload for ByteLRUCache
+        return len(self.body) + sum(len(variant) for variant in self.encodings.values() if variant)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so W/ tags from a CDN that
+    # recompressed the body still match; so do tags of other encodings
+    return any(_content_tag(tag) == etag for tag in if_none_match.split(","))
+
+
+def _content_tag(tag: str) -> str:
+    tag = tag.strip().removeprefix("W/")
+    base, dash, _ = tag.partition("-")
+    return f'{base}"' if dash else tag
+
+
+def conditional_response(request: Request, cached: CachedBody, cache_control: str = CATALOG_CACHE_CONTROL) -> Response:
+    encoding = None
+    if cached.stored:
+        encoding = choose_encoding(request.headers.get("accept-encoding"), stored_encodings(cached.body))
+    content = cached.variant(encoding) if encoding else None
+    if content is None:
+        encoding = None
+    headers = {
+        **cached.headers,
+        "ETag": encoded_etag(cached.etag, encoding),
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+    if encoding is None:
+        return Response(content=cached.body, media_type="application/json", headers=headers)
+    headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type="application/json", headers=headers)
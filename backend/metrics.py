@@ -0,0 +1,249 @@
+"""Request and MongoDB metrics in Prometheus text format.
+
+``MetricsMiddleware`` times every request and records its status, response
+size and the route template it matched (``/api/products/{product_id}``, not
+the raw path, to keep label sets small). ``MongoCommandListener`` is
+registered on the Motor client and times every command. It attributes each
+command to the request that issued it through a context variable, which
+Motor copies into the executor threads that run the driver. The two
+together give per-route Mongo round trips and time.
+"""
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 32, 64)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(values: Dict[str, str]) -> Labels:
+    return tuple(sorted(values.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+        self._values: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _labels(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][position] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            snapshot = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _format_value(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter("http_requests_total", "Requests by route and status.")
+http_latency = registry.histogram("http_request_duration_seconds", "Request latency by route.")
+http_in_flight = registry.gauge("http_requests_in_flight", "Requests currently being handled.")
+http_response_size = registry.histogram("http_response_size_bytes", "Response body size by route.", SIZE_BUCKETS)
+request_mongo_commands = registry.histogram("http_request_mongo_commands", "Mongo round trips per request, by route.", COUNT_BUCKETS)
+request_mongo_seconds = registry.histogram("http_request_mongo_seconds", "Time spent in Mongo per request, by route.")
+mongo_commands = registry.counter("mongo_commands_total", "Mongo commands by name and outcome.")
+mongo_latency = registry.histogram("mongo_command_duration_seconds", "Mongo command latency by name.")
+
+
+@dataclass
+class RequestStats:
+    route: str = "unmatched"
+    mongo_commands: int = 0
+    mongo_seconds: float = 0.0
+    # Command names in issue order, for query budgets and debugging
+    commands: List[str] = field(default_factory=list)
+    # Enclosing scope (a query-counting block around a test request), which
+    # is charged for the same commands
+    parent: Optional["RequestStats"] = None
+
+    def record(self, command: str, seconds: float) -> None:
+        stats = self
+        while stats is not None:
+            stats.mongo_commands += 1
+            stats.mongo_seconds += seconds
+            stats.commands.append(command)
+            stats = stats.parent
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self._pending: Dict[Tuple, Tuple[str, str, Optional[RequestStats]]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            # getMore carries a cursor id; the collection is separate
+            target = event.command.get("collection", "")
+        description = f"{event.command_name} {target}".rstrip()
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (event.command_name, description, current_request.get())
+
+    def _finished(self, event, outcome: str) -> None:
+        with self._lock:
+            name, description, stats = self._pending.pop(
+                (event.connection_id, event.request_id), (event.command_name, event.command_name, None)
+            )
+        seconds = event.duration_micros / 1_000_000
+        mongo_commands.inc(command=name, outcome=outcome)
+        mongo_latency.observe(seconds, command=name)
+        if stats is not None:
+            stats.record(description, seconds)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finished(event, "success")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finished(event, "failure")
+
+
+def route_template(scope: dict) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses (SSE, exports) are not buffered."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(parent=current_request.get())
+        token = current_request.set(stats)
+        method = scope["method"]
+        status_code = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            current_request.reset(token)
+            # The router records the matched route on the scope
+            route = stats.route = route_template(scope)
+            http_requests.inc(method=method, route=route, status=str(status_code))
+            http_latency.observe(elapsed, method=method, route=route)
+            http_response_size.observe(size, route=route)
+            request_mongo_commands.observe(stats.mongo_commands, route=route)
+            request_mongo_seconds.observe(stats.mongo_seconds, route=route)
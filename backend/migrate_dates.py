@@ -0,0 +1,98 @@
+"""Convert ISO-string timestamps to native BSON dates, in place.
+
+Safe to run against a live database: it walks each collection in ``_id``
+order in small batches, and each update only applies if the field still
+holds the string it read, so concurrent writes are never overwritten. Progress
+is checkpointed in the ``migrations`` collection, so an interrupted run
+resumes where it stopped.
+
+Usage: python migrate_dates.py [--batch-size 1000] [--pause 0.05] [--collection orders] [--restart]
+"""
+import argparse
+import asyncio
+import os
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from dates import DATETIME_FIELDS, parse_datetime
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+mongo_url = os.environ['MONGO_URL']
+db_name = os.environ['DB_NAME']
+
+MIGRATION_ID = "native_dates"
+
+
+async def migrate_collection(db, name: str, fields, batch_size: int, pause: float, restart: bool) -> int:
+    checkpoint_id = f"{MIGRATION_ID}:{name}"
+    checkpoint = None if restart else await db.migrations.find_one({"_id": checkpoint_id})
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    converted = checkpoint.get("converted", 0) if checkpoint else 0
+    if checkpoint and checkpoint.get("done"):
+        print(f"{name}: already migrated ({converted} documents)")
+        return 0
+
+    string_filter = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    started = time.perf_counter()
+    run_converted = 0
+    while True:
+        query = {"$and": [string_filter, {"_id": {"$gt": last_id}}]} if last_id is not None else string_filter
+        projection = {field: 1 for field in fields}
+        batch = await db[name].find(query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        ops = []
+        for doc in batch:
+            for field in fields:
+                value = doc.get(field)
+                if isinstance(value, str):
+                    ops.append(UpdateOne(
+                        {"_id": doc["_id"], field: value},
+                        {"$set": {field: parse_datetime(value)}}
+                    ))
+        result = await db[name].bulk_write(ops, ordered=False)
+        last_id = batch[-1]["_id"]
+        run_converted += result.modified_count
+        converted += result.modified_count
+        await db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_id": last_id, "converted": converted, "done": False}},
+            upsert=True
+        )
+        rate = run_converted / max(time.perf_counter() - started, 1e-9)
+        print(f"{name}: {converted} fields converted ({rate:.0f}/s)")
+        if pause:
+            await asyncio.sleep(pause)
+
+    await db.migrations.update_one({"_id": checkpoint_id}, {"$set": {"done": True, "converted": converted}}, upsert=True)
+    print(f"{name}: done, {converted} fields converted")
+    return run_converted
+
+
+async def migrate(batch_size: int, pause: float, only=None, restart: bool = False):
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+    try:
+        for name, fields in DATETIME_FIELDS.items():
+            if only and name not in only:
+                continue
+            await migrate_collection(db, name, fields, batch_size, pause, restart)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches")
+    parser.add_argument("--collection", action="append", help="limit to this collection (repeatable)")
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoints")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.pause, args.collection, args.restart))
@@ -0,0 +1,63 @@
+"""Payment status push and upstream call coalescing.
+
+``OrderStatusHub`` is an in-process pub/sub keyed by checkout session id:
+the webhook (or a status check that discovers a payment) publishes once and
+every open status stream for that session receives it. Streams on another
+worker do not see the event, so they also re-read the transaction on a slow
+timer as a fallback.
+
+``SingleFlight`` collapses concurrent calls with the same key into one, so a
+burst of status polls for one session makes a single Stripe request.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Set
+
+
+class OrderStatusHub:
+    def __init__(self, queue_size: int = 8):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.published = 0
+
+    def subscribe(self, session_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(session_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, session_id: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(session_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[session_id]
+
+    def publish(self, session_id: str, event: dict) -> None:
+        self.published += 1
+        for queue in self._subscribers.get(session_id, ()):
+            if queue.full():
+                # A slow client only needs the latest status
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # Shield so one caller disconnecting does not cancel the shared call
+            return await asyncio.shield(future)
+        self.calls += 1
+        future = asyncio.ensure_future(fn())
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
@@ -0,0 +1,142 @@
+"""Compact order summaries and the archived-orders tier.
+
+Every order has a summary in ``order_summaries`` (id, date, total, statuses,
+item count, first image). The summary is written with the order and updated
+whenever the order's status changes, so history pages never load line items
+or addresses.
+
+Settled orders (anything no longer ``pending``) older than the archive window
+move from ``orders`` to ``orders_archive``, which keeps the hot collection
+and its indexes small. Their summaries stay and are flagged ``archived``, and
+``find_order`` still returns them on demand.
+
+Usage: python order_history.py backfill
+       python order_history.py archive [--older-than-days 180] [--batch-size 500]
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne, UpdateOne
+
+from dates import utcnow
+from db_indexes import INDEXES, ensure_collection_indexes
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 500
+
+
+def summary_from_order(order: dict) -> dict:
+    items = order.get('items') or []
+    return {
+        "id": order['id'],
+        "user_id": order['user_id'],
+        "created_at": order['created_at'],
+        "total_amount": order['total_amount'],
+        "payment_method": order.get('payment_method', ""),
+        "payment_status": order.get('payment_status', "pending"),
+        "status": order.get('status', "pending"),
+        "item_count": sum(item.get('quantity', 0) for item in items),
+        "image": items[0].get('image', "") if items else "",
+        "archived": False,
+    }
+
+
+async def write_summary(db, order: dict) -> None:
+    await db.order_summaries.replace_one({"id": order['id']}, summary_from_order(order), upsert=True)
+
+
+async def update_summary(db, order_id: str, fields: dict) -> None:
+    await db.order_summaries.update_one({"id": order_id}, {"$set": fields})
+
+
+async def update_summaries(db, order_ids: List[str], fields: dict) -> None:
+    await db.order_summaries.update_many({"id": {"$in": order_ids}}, {"$set": fields})
+
+
+async def find_order(db, query: dict, projection: Optional[dict] = None) -> Optional[dict]:
+    """Look ``query`` up in the hot orders, then in the archive."""
+    order = await db.orders.find_one(query, projection)
+    if order is None:
+        order = await db.orders_archive.find_one(query, projection)
+    return order
+
+
+async def archive_orders(db, older_than: timedelta, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move settled orders created before ``older_than`` ago into the archive; returns how many moved."""
+    cutoff = utcnow() - older_than
+    moved = 0
+    while True:
+        batch = await db.orders.find(
+            {"created_at": {"$lt": cutoff}, "status": {"$ne": "pending"}}
+        ).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return moved
+        # Copy first: an interrupted run leaves duplicates, never losses
+        await db.orders_archive.bulk_write(
+            [ReplaceOne({"id": order['id']}, order, upsert=True) for order in batch], ordered=False
+        )
+        # Only delete copies that are still current; a concurrent update
+        # leaves the order in place for the next run
+        deleted = []
+        for order in batch:
+            result = await db.orders.delete_one(order)
+            if result.deleted_count:
+                deleted.append(order['id'])
+        if deleted:
+            await db.order_summaries.bulk_write(
+                [UpdateOne({"id": order_id}, {"$set": {"archived": True}}) for order_id in deleted], ordered=False
+            )
+        moved += len(deleted)
+        if not deleted:
+            # Every candidate changed under us; try again on the next run
+            return moved
+
+
+async def backfill_summaries(db, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    written = 0
+    for collection, archived in ((db.orders, False), (db.orders_archive, True)):
+        ops = []
+        async for order in collection.find({}, {"shipping_address": 0}).batch_size(batch_size):
+            ops.append(ReplaceOne({"id": order['id']}, {**summary_from_order(order), "archived": archived}, upsert=True))
+            if len(ops) == batch_size:
+                await db.order_summaries.bulk_write(ops, ordered=False)
+                written += len(ops)
+                ops = []
+        if ops:
+            await db.order_summaries.bulk_write(ops, ordered=False)
+            written += len(ops)
+    return written
+
+
+async def main(args):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    try:
+        for name in ("order_summaries", "orders_archive"):
+            await ensure_collection_indexes(db[name], INDEXES[name])
+        if args.command == "backfill":
+            print(f"Wrote {await backfill_summaries(db, args.batch_size)} order summaries")
+        else:
+            moved = await archive_orders(db, timedelta(days=args.older_than_days), args.batch_size)
+            print(f"Archived {moved} orders")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["backfill", "archive"])
+    parser.add_argument("--older-than-days", type=int, default=180)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    asyncio.run(main(parser.parse_args()))
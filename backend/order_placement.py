@@ -0,0 +1,208 @@
+"""Order placement with stock reservation.
+
+Placing an order costs a fixed number of round trips however many lines
+the cart has: read the cart, load every product with one ``$in`` query
+(prices are recomputed from the catalog, not trusted from the cart), reserve
+stock with one ``bulk_write`` of conditional ``$inc`` updates, insert the
+order and its history summary, and clear the ordered lines from the cart.
+
+Each reservation is also recorded on the product as
+``reservations: [{order_id, quantity}]``, which lets a partial failure, an
+expired payment window or a confirmed payment find exactly what a given
+order holds without a multi-document transaction.
+
+An order paid after its reservation expired has already had its stock
+returned. Payment takes the stock again when it is still there; otherwise
+the order is marked ``needs_review`` so it is refunded or fulfilled by hand
+instead of being confirmed against stock that was sold to someone else.
+"""
+import logging
+from datetime import timedelta
+from typing import Dict, List, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from dates import utcnow
+from order_history import update_summaries, update_summary, write_summary
+
+logger = logging.getLogger(__name__)
+
+SWEEP_BATCH_SIZE = 200
+
+NEEDS_REVIEW = "needs_review"
+
+
+class OrderPlacementError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+async def price_cart(db, user_id: str) -> Tuple[List[dict], Dict[str, int]]:
+    """Return the cart's lines priced from the catalog, and quantity per product."""
+    cart_doc = await db.carts.find_one({"user_id": user_id}, {"_id": 0, "items": 1})
+    if not cart_doc or not cart_doc.get('items'):
+        raise OrderPlacementError(400, "Cart is empty")
+
+    quantities: Dict[str, int] = {}
+    for item in cart_doc['items']:
+        quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+    # Carts written before quantities were validated may hold zero or negative
+    # lines, which would add stock back on reservation and discount the total
+    invalid = [pid for pid, quantity in quantities.items() if quantity < 1]
+    if invalid:
+        raise OrderPlacementError(400, f"Invalid quantity for products: {', '.join(invalid)}")
+
+    projection = {"_id": 0, "id": 1, "title": 1, "price": 1, "images": {"$slice": 1}}
+    products = await db.products.find({"id": {"$in": list(quantities)}}, projection).to_list(len(quantities))
+    by_id = {p['id']: p for p in products}
+    missing = [pid for pid in quantities if pid not in by_id]
+    if missing:
+        raise OrderPlacementError(409, f"Products no longer available: {', '.join(missing)}")
+
+    items = [
+        {
+            "product_id": pid,
+            "quantity": quantity,
+            "price": by_id[pid]['price'],
+            "title": by_id[pid]['title'],
+            "image": by_id[pid]['images'][0] if by_id[pid].get('images') else "",
+        }
+        for pid, quantity in quantities.items()
+    ]
+    return items, quantities
+
+
+def order_quantities(order: dict) -> Dict[str, int]:
+    quantities: Dict[str, int] = {}
+    for item in order['items']:
+        quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+    return quantities
+
+
+async def reserve_stock(products, order_id: str, quantities: Dict[str, int]) -> None:
+    """Atomically take stock for every line, or none of them."""
+    ops = [
+        UpdateOne(
+            # A product already holding this order's reservation is not taken twice
+            {"id": pid, "stock": {"$gte": quantity}, "reservations.order_id": {"$ne": order_id}},
+            {"$inc": {"stock": -quantity}, "$push": {"reservations": {"order_id": order_id, "quantity": quantity}}}
+        )
+        for pid, quantity in quantities.items()
+    ]
+    try:
+        result = await products.bulk_write(ops, ordered=False)
+    except BulkWriteError:
+        # The updates that did not fail were applied
+        await release_stock(products, order_id, quantities)
+        raise
+    if result.modified_count != len(ops):
+        await release_stock(products, order_id, quantities)
+        raise OrderPlacementError(409, "Insufficient stock for one or more items")
+
+
+async def release_stock(products, order_id: str, quantities: Dict[str, int]) -> int:
+    """Return reserved stock; only products still holding a reservation for ``order_id`` match."""
+    ops = [
+        UpdateOne(
+            {"id": pid, "reservations.order_id": order_id},
+            {"$inc": {"stock": quantity}, "$pull": {"reservations": {"order_id": order_id}}}
+        )
+        for pid, quantity in quantities.items()
+    ]
+    if not ops:
+        return 0
+    result = await products.bulk_write(ops, ordered=False)
+    return result.modified_count
+
+
+async def place_order(db, order_dict: dict, quantities: Dict[str, int], reservation_ttl: timedelta) -> None:
+    """Reserve stock, write ``order_dict`` and remove the ordered lines from the cart."""
+    await reserve_stock(db.products, order_dict['id'], quantities)
+    order_dict['reservation_expires_at'] = utcnow() + reservation_ttl
+    try:
+        await db.orders.insert_one(order_dict)
+    except Exception:
+        await release_stock(db.products, order_dict['id'], quantities)
+        raise
+    await write_summary(db, order_dict)
+    await db.carts.update_one(
+        {"user_id": order_dict['user_id']},
+        {"$pull": {"items": {"product_id": {"$in": list(quantities)}}},
+         "$set": {"updated_at": utcnow()}}
+    )
+
+
+async def _reserve_late_orders(db, collection, order_ids: List[str]) -> List[str]:
+    """Take stock again for expired orders that have now been paid; returns the ids that could not get it."""
+    late = await collection.find(
+        {"id": {"$in": order_ids}, "status": "expired"}, {"_id": 0, "id": 1, "items": 1}
+    ).to_list(None)
+    unfulfilled = []
+    for order in late:
+        try:
+            await reserve_stock(db.products, order['id'], order_quantities(order))
+        except OrderPlacementError:
+            logger.error(f"Order {order['id']} was paid after its stock was released and is out of stock; "
+                         f"flagged for review")
+            unfulfilled.append(order['id'])
+        else:
+            logger.warning(f"Order {order['id']} was paid after its reservation expired; stock reserved again")
+    return unfulfilled
+
+
+async def mark_orders_paid(db, order_ids: List[str]) -> None:
+    """Confirm paid orders and make their reservations permanent."""
+    update = {"$set": {"payment_status": "paid", "status": "confirmed"}, "$unset": {"reservation_expires_at": ""}}
+    review = {"$set": {"payment_status": "paid", "status": NEEDS_REVIEW}}
+    unfulfilled = await _reserve_late_orders(db, db.orders, order_ids)
+    if unfulfilled:
+        await db.orders.update_many({"id": {"$in": unfulfilled}}, review)
+    confirmed = [order_id for order_id in order_ids if order_id not in unfulfilled]
+    result = await db.orders.update_many({"id": {"$in": confirmed}}, update)
+    if result.matched_count < len(confirmed):
+        # Expired long enough ago to have been archived
+        archived_unfulfilled = await _reserve_late_orders(db, db.orders_archive, confirmed)
+        if archived_unfulfilled:
+            await db.orders_archive.update_many({"id": {"$in": archived_unfulfilled}}, review)
+            confirmed = [order_id for order_id in confirmed if order_id not in archived_unfulfilled]
+            unfulfilled += archived_unfulfilled
+        await db.orders_archive.update_many({"id": {"$in": confirmed}}, update)
+    await db.products.update_many(
+        {"reservations.order_id": {"$in": confirmed}},
+        {"$pull": {"reservations": {"order_id": {"$in": confirmed}}}}
+    )
+    await update_summaries(db, confirmed, {"payment_status": "paid", "status": "confirmed"})
+    if unfulfilled:
+        await update_summaries(db, unfulfilled, {"payment_status": "paid", "status": NEEDS_REVIEW})
+
+
+async def release_expired_reservations(db) -> Dict[str, List[str]]:
+    """Expire unpaid orders past their reservation window and return their stock.
+
+    Returns the product ids released, per expired order.
+    """
+    now = utcnow()
+    candidates = await db.orders.find(
+        {"reservation_expires_at": {"$lt": now}},
+        {"_id": 0, "id": 1, "items": 1}
+    ).limit(SWEEP_BATCH_SIZE).to_list(SWEEP_BATCH_SIZE)
+
+    expired: Dict[str, List[str]] = {}
+    for order in candidates:
+        # Claim the order first so a concurrent payment or sweeper wins cleanly
+        claimed = await db.orders.update_one(
+            {"id": order['id'], "payment_status": {"$ne": "paid"}, "reservation_expires_at": {"$lt": now}},
+            {"$set": {"status": "expired"}, "$unset": {"reservation_expires_at": ""}}
+        )
+        if not claimed.modified_count:
+            continue
+        await update_summary(db, order['id'], {"status": "expired"})
+        quantities = order_quantities(order)
+        await release_stock(db.products, order['id'], quantities)
+        expired[order['id']] = list(quantities)
+    if expired:
+        logger.info(f"Released stock for {len(expired)} expired orders")
+    return expired
@@ -0,0 +1,164 @@
+"""Keyset (cursor) pagination.
+
+Pages are ordered by a sort field with ``id`` as tie-breaker, and the cursor
+carries the last row's ``(value, id)``, so fetching page N costs one indexed
+range scan no matter how deep N is. Cursors are opaque base64url strings;
+clients must echo them back unchanged.
+"""
+import base64
+import json
+import math
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+
+
+class SortSpec(NamedTuple):
+    name: str
+    field: str
+    direction: int
+
+
+PRODUCT_SORTS: Dict[str, SortSpec] = {
+    "newest": SortSpec("newest", "created_at", DESCENDING),
+    "price_asc": SortSpec("price_asc", "price", ASCENDING),
+    "price_desc": SortSpec("price_desc", "price", DESCENDING),
+    "rating": SortSpec("rating", "rating", DESCENDING),
+}
+
+ORDER_SORTS: Dict[str, SortSpec] = {
+    "newest": SortSpec("newest", "created_at", DESCENDING),
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    # The value is spliced into a Mongo filter, so anything but a scalar
+    # (e.g. {"$ne": null}) would let a forged cursor rewrite the query
+    if isinstance(value, dict):
+        if set(value) != {"$dt"} or not isinstance(value["$dt"], str):
+            raise InvalidCursor("Malformed cursor")
+        try:
+            return datetime.fromisoformat(value["$dt"])
+        except ValueError:
+            raise InvalidCursor("Malformed cursor")
+    if value is not None and not isinstance(value, (str, int, float)):
+        raise InvalidCursor("Malformed cursor")
+    if isinstance(value, float) and not math.isfinite(value):
+        raise InvalidCursor("Malformed cursor")
+    return value
+
+
+def encode_cursor(sort_name: str, value: Any, last_id: str) -> str:
+    raw = json.dumps([sort_name, _encode_value(value), last_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _unpack(cursor: str) -> Tuple[str, Any, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        name, value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+    if not isinstance(name, str) or not isinstance(last_id, str):
+        raise InvalidCursor("Malformed cursor")
+    return name, value, last_id
+
+
+def cursor_sort(cursor: str) -> str:
+    """Return the name of the sort order ``cursor`` was issued for."""
+    return _unpack(cursor)[0]
+
+
+def decode_cursor(cursor: str, sort_name: str) -> Tuple[Any, str]:
+    name, value, last_id = _unpack(cursor)
+    if name != sort_name:
+        raise InvalidCursor("Cursor was issued for a different sort order")
+    return _decode_value(value), last_id
+
+
+def sort_keys(spec: SortSpec) -> List[Tuple[str, int]]:
+    return [(spec.field, spec.direction), ("id", spec.direction)]
+
+
+def keyset_filter(spec: SortSpec, value: Any, last_id: str) -> dict:
+    op = "$gt" if spec.direction == ASCENDING else "$lt"
+    return {"$or": [
+        {spec.field: {op: value}},
+        {spec.field: value, "id": {op: last_id}},
+    ]}
+
+
+def _with_keyset(query: dict, spec: SortSpec, value: Any, last_id: str) -> dict:
+    keyset = keyset_filter(spec, value, last_id)
+    return {"$and": [query, keyset]} if query else keyset
+
+
+async def fetch_page(
+    collection,
+    query: dict,
+    spec: SortSpec,
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[dict] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """Return one page of documents and the cursor for the next page (None on the last page)."""
+    return await fetch_merged_page([collection], query, spec, limit, cursor, projection)
+
+
+async def fetch_merged_page(
+    collections: List[Any],
+    query: dict,
+    spec: SortSpec,
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[dict] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """``fetch_page`` over collections that split one set of documents between them, e.g. hot and archived.
+
+    The cursor is a position in the sort order, so it stays valid when a
+    document moves from one collection to another between pages.
+    """
+    if cursor:
+        value, last_id = decode_cursor(cursor, spec.name)
+        query = _with_keyset(query, spec, value, last_id)
+    # One extra row tells us whether another page exists
+    docs = []
+    for collection in collections:
+        docs += await collection.find(query, projection).sort(sort_keys(spec)).limit(limit + 1).to_list(limit + 1)
+    if len(collections) > 1:
+        # A document moved while we read may come back from both
+        docs = list({doc["id"]: doc for doc in docs}.values())
+        docs.sort(key=lambda doc: (doc.get(spec.field), doc["id"]), reverse=spec.direction == DESCENDING)
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    last = docs[-1]
+    return docs, encode_cursor(spec.name, last.get(spec.field), last["id"])
+
+
+async def iterate_keyset(
+    collection,
+    query: dict,
+    spec: SortSpec,
+    projection: Optional[dict] = None,
+    batch_size: int = 500,
+) -> AsyncIterator[dict]:
+    """Stream every matching document in ``spec`` order, one page at a time."""
+    cursor = None
+    while True:
+        docs, cursor = await fetch_page(collection, query, spec, batch_size, cursor, projection)
+        for doc in docs:
+            yield doc
+        if cursor is None:
+            return
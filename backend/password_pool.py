@@ -0,0 +1,76 @@
+"""Bounded worker pool for bcrypt.
+
+bcrypt takes 100-300 ms per call. Running it inline in an ``async def``
+handler stalls every other request on the worker, so hashing and
+verification run on a small dedicated thread pool instead (the bcrypt
+backend releases the GIL while it works). Work beyond ``max_workers +
+max_queue`` outstanding calls is rejected with ``PoolSaturated`` so a login
+burst sheds load instead of queueing without bound.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, context, max_workers: int = 4, max_queue: int = 32):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise PoolSaturated()
+        self._pending += 1
+        self.peak_pending = max(self.peak_pending, self._pending)
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                self.total_wait_seconds += started - submitted
+                self.total_run_seconds += time.perf_counter() - started
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self._pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self.context.verify, password, hashed)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        completed = self.completed or 1
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._pending,
+            "queued": max(0, self._pending - self.max_workers),
+            "peak_in_flight": self.peak_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait_seconds / completed * 1000, 3),
+            "avg_run_ms": round(self.total_run_seconds / completed * 1000, 3),
+        }
@@ -0,0 +1,206 @@
+"""Application-scoped payment gateway.
+
+``create_gateway`` is called once when the app starts. The Stripe gateway
+reuses one ``StripeCheckout`` per webhook URL (instead of one per request),
+points the Stripe SDK at a keep-alive HTTP client, and wraps calls with a
+timeout and jittered retries. ``FakeGateway`` implements the same interface
+in memory so the payment flow can be tested and benchmarked offline; select
+it with ``PAYMENT_GATEWAY=fake``.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayError(Exception):
+    pass
+
+
+@dataclass
+class SessionResult:
+    session_id: str
+    url: str
+
+
+@dataclass
+class StatusResult:
+    status: str
+    payment_status: str
+    amount_total: int
+    currency: str
+    metadata: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class WebhookResult:
+    event_type: str
+    event_id: str
+    session_id: str
+    payment_status: str
+    metadata: Dict[str, str] = field(default_factory=dict)
+
+
+class StripeGateway:
+    def __init__(self, api_key: str, default_webhook_url: str, timeout: float = 15.0, max_retries: int = 2,
+                 backoff: float = 0.25):
+        from emergentintegrations.payments.stripe.checkout import StripeCheckout
+        self._checkout_class = StripeCheckout
+        self.api_key = api_key
+        self.default_webhook_url = default_webhook_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._clients = {}
+        self._configure_http_client()
+
+    def _configure_http_client(self) -> None:
+        try:
+            import stripe
+        except ImportError:
+            return
+        # One keep-alive client for every Stripe call, instead of a new
+        # connection (and TLS handshake) per request. Stripe adds
+        # idempotency keys to its own retries, so writes retry safely there.
+        stripe.default_http_client = stripe.RequestsClient(timeout=self.timeout)
+        stripe.max_network_retries = self.max_retries
+
+    def _client(self, webhook_url: Optional[str] = None):
+        webhook_url = webhook_url or self.default_webhook_url
+        client = self._clients.get(webhook_url)
+        if client is None:
+            if len(self._clients) >= 16:
+                self._clients.clear()
+            client = self._clients[webhook_url] = self._checkout_class(api_key=self.api_key, webhook_url=webhook_url)
+        return client
+
+    async def _call(self, make_call, retries: int):
+        for attempt in range(retries + 1):
+            try:
+                return await asyncio.wait_for(make_call(), timeout=self.timeout)
+            except Exception as e:
+                if attempt == retries:
+                    raise GatewayError(str(e)) from e
+                # Full jitter: sleep uniformly up to the exponential backoff
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                logger.warning(f"Payment gateway call failed ({e}); retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def create_checkout_session(self, request, webhook_url: Optional[str] = None):
+        # Not retried here: a retry after a timeout could open a second session
+        return await self._call(lambda: self._client(webhook_url).create_checkout_session(request), retries=0)
+
+    async def get_checkout_status(self, session_id: str):
+        return await self._call(lambda: self._client().get_checkout_status(session_id), retries=self.max_retries)
+
+    async def expire_checkout_session(self, session_id: str) -> None:
+        # The checkout wrapper cannot set a session's expiry, so sessions are
+        # closed through the Stripe SDK when their order's reservation lapses
+        try:
+            import stripe
+        except ImportError as e:
+            raise GatewayError("Expiring checkout sessions needs the stripe package") from e
+        await self._call(
+            lambda: asyncio.to_thread(stripe.checkout.Session.expire, session_id, api_key=self.api_key),
+            retries=self.max_retries,
+        )
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str], webhook_url: Optional[str] = None):
+        return await self._client(webhook_url).handle_webhook(body, signature)
+
+    async def close(self) -> None:
+        self._clients.clear()
+
+
+class FakeGateway:
+    """In-memory stand-in for Stripe Checkout.
+
+    Sessions are paid as soon as they are created when ``auto_pay`` is set;
+    otherwise call ``mark_paid``. Webhooks are unsigned JSON bodies of the
+    form ``{"session_id": ..., "payment_status": "paid"}``.
+    """
+
+    def __init__(self, auto_pay: bool = True, latency: float = 0.0):
+        self.auto_pay = auto_pay
+        self.latency = latency
+        self.sessions: Dict[str, dict] = {}
+        self.calls = 0
+
+    async def _simulate_network(self) -> None:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def create_checkout_session(self, request, webhook_url: Optional[str] = None) -> SessionResult:
+        await self._simulate_network()
+        session_id = f"cs_fake_{uuid.uuid4().hex}"
+        self.sessions[session_id] = {
+            "amount_total": int(round(float(request.amount) * 100)),
+            "currency": request.currency,
+            "metadata": dict(request.metadata or {}),
+            "payment_status": "paid" if self.auto_pay else "unpaid",
+        }
+        url = request.success_url.replace("{CHECKOUT_SESSION_ID}", session_id)
+        return SessionResult(session_id=session_id, url=url)
+
+    async def get_checkout_status(self, session_id: str) -> StatusResult:
+        await self._simulate_network()
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise GatewayError(f"Unknown session {session_id}")
+        paid = session["payment_status"] == "paid"
+        return StatusResult(
+            status="complete" if paid else session.get("status", "open"),
+            payment_status=session["payment_status"],
+            amount_total=session["amount_total"],
+            currency=session["currency"],
+            metadata=session["metadata"],
+        )
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str], webhook_url: Optional[str] = None) -> WebhookResult:
+        payload = json.loads(body)
+        session_id = payload["session_id"]
+        session = self.sessions.get(session_id, {})
+        payment_status = payload.get("payment_status", "paid")
+        if session:
+            session["payment_status"] = payment_status
+        return WebhookResult(
+            event_type="checkout.session.completed",
+            event_id=payload.get("event_id", f"evt_fake_{uuid.uuid4().hex}"),
+            session_id=session_id,
+            payment_status=payment_status,
+            metadata=payload.get("metadata") or session.get("metadata", {}),
+        )
+
+    async def expire_checkout_session(self, session_id: str) -> None:
+        await self._simulate_network()
+        session = self.sessions.get(session_id)
+        if session is None or session["payment_status"] == "paid":
+            raise GatewayError(f"Session {session_id} cannot be expired")
+        session["status"] = "expired"
+
+    def mark_paid(self, session_id: str) -> None:
+        self.sessions[session_id]["payment_status"] = "paid"
+
+    async def close(self) -> None:
+        pass
+
+
+def create_gateway():
+    if os.environ.get('PAYMENT_GATEWAY', 'stripe') == 'fake':
+        return FakeGateway(
+            auto_pay=os.environ.get('FAKE_GATEWAY_AUTO_PAY', 'true').lower() == 'true',
+            latency=float(os.environ.get('FAKE_GATEWAY_LATENCY_SECONDS', 0))
+        )
+    return StripeGateway(
+        api_key=os.environ.get('STRIPE_API_KEY'),
+        default_webhook_url=os.environ.get('STRIPE_WEBHOOK_URL', 'http://localhost:8001/api/webhook/stripe'),
+        timeout=float(os.environ.get('STRIPE_TIMEOUT_SECONDS', 15)),
+        max_retries=int(os.environ.get('STRIPE_MAX_RETRIES', 2))
+    )
@@ -0,0 +1,178 @@
+"""Durable, deduplicated queue for payment state transitions.
+
+Webhooks and status checks only record that a checkout session was paid,
+then return. The job's ``_id`` is the transition itself (``<session>:paid``),
+so Stripe retries, duplicate deliveries and concurrent status polls all
+collapse into one job with a single upsert. Every event id seen is kept on
+the job, and finished jobs stay for ``DONE_RETENTION`` as the idempotency
+record.
+
+Background workers claim due jobs in batches and apply them with one
+multi-document update per collection: confirm the orders, mark the
+transactions paid, then notify open payment streams. A batch that fails is
+retried with backoff. A worker that dies mid-batch loses its lease, and
+another worker picks the jobs up. Each step is idempotent, so applying a job
+twice is harmless.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from dates import utcnow
+from order_placement import mark_orders_paid
+
+logger = logging.getLogger(__name__)
+
+PAID = "paid"
+MAX_ATTEMPTS = 8
+LEASE = timedelta(seconds=60)
+# Finished jobs are the dedup record; Stripe retries for up to three days
+DONE_RETENTION = timedelta(days=7)
+
+# (session_id, order_id, amount) for each newly paid session
+PaidCallback = Callable[[str, str, Optional[float]], Awaitable[None]]
+
+
+def job_id(session_id: str, payment_status: str) -> str:
+    return f"{session_id}:{payment_status}"
+
+
+class PaymentJobQueue:
+    def __init__(self, db, on_paid: Optional[PaidCallback] = None, batch_size: int = 100, poll_interval: float = 1.0):
+        self.jobs = db.payment_jobs
+        self.db = db
+        self.on_paid = on_paid
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self.enqueued = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.batches = 0
+        self.failures = 0
+
+    async def enqueue_paid(self, session_id: str, order_id: str, event_id: Optional[str] = None) -> bool:
+        """Record that ``session_id`` was paid; returns False if it already was."""
+        now = utcnow()
+        update = {"$setOnInsert": {
+            "session_id": session_id,
+            "order_id": order_id,
+            "payment_status": PAID,
+            "status": "queued",
+            "attempts": 0,
+            "available_at": now,
+            "created_at": now,
+        }}
+        if event_id:
+            update["$addToSet"] = {"event_ids": event_id}
+        try:
+            result = await self.jobs.update_one({"_id": job_id(session_id, PAID)}, update, upsert=True)
+        except DuplicateKeyError:
+            # Lost an upsert race with an identical delivery
+            self.duplicates += 1
+            return False
+        if result.upserted_id is None:
+            self.duplicates += 1
+            return False
+        self.enqueued += 1
+        self._wakeup.set()
+        return True
+
+    async def _claim(self) -> List[dict]:
+        now = utcnow()
+        due = await self.jobs.find(
+            {"$or": [
+                {"status": "queued", "available_at": {"$lte": now}},
+                {"status": "processing", "locked_until": {"$lt": now}},
+            ], "attempts": {"$lt": MAX_ATTEMPTS}},
+            {"_id": 1}
+        ).limit(self.batch_size).to_list(self.batch_size)
+        if not due:
+            return []
+        claim = uuid.uuid4().hex
+        # Another worker may claim some of the same jobs; the status and
+        # lease conditions make each job go to exactly one claim
+        await self.jobs.update_many(
+            {"_id": {"$in": [job["_id"] for job in due]}, "$or": [
+                {"status": "queued"},
+                {"status": "processing", "locked_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": "processing", "claim": claim, "locked_until": now + LEASE}}
+        )
+        return await self.jobs.find({"claim": claim}).to_list(self.batch_size)
+
+    async def _apply(self, batch: List[dict]) -> None:
+        order_ids = list({job["order_id"] for job in batch})
+        session_ids = [job["session_id"] for job in batch]
+        await mark_orders_paid(self.db, order_ids)
+        await self.db.payment_transactions.update_many(
+            {"session_id": {"$in": session_ids}},
+            {"$set": {"payment_status": PAID}}
+        )
+        if self.on_paid is not None:
+            transactions = await self.db.payment_transactions.find(
+                {"session_id": {"$in": session_ids}}, {"_id": 0, "session_id": 1, "amount": 1}
+            ).to_list(len(session_ids))
+            amounts: Dict[str, float] = {t["session_id"]: t.get("amount") for t in transactions}
+            for job in batch:
+                await self.on_paid(job["session_id"], job["order_id"], amounts.get(job["session_id"]))
+
+    async def process_batch(self) -> int:
+        """Claim and apply one batch of due jobs; returns how many were applied."""
+        batch = await self._claim()
+        if not batch:
+            return 0
+        claim = batch[0]["claim"]
+        self.batches += 1
+        try:
+            await self._apply(batch)
+        except Exception as e:
+            self.failures += 1
+            attempts = max(job.get("attempts", 0) for job in batch) + 1
+            logger.error(f"Payment jobs failed (attempt {attempts}): {e}")
+            await self.jobs.update_many({"claim": claim}, [
+                {"$set": {"attempts": {"$add": ["$attempts", 1]}}},
+                {"$set": {
+                    "status": {"$cond": [{"$gte": ["$attempts", MAX_ATTEMPTS]}, "failed", "queued"]},
+                    "available_at": utcnow() + timedelta(seconds=2 ** attempts),
+                }},
+                {"$unset": ["claim", "locked_until"]},
+            ])
+            return 0
+        await self.jobs.update_many(
+            {"claim": claim},
+            {"$set": {"status": "done", "done_at": utcnow()}, "$unset": {"claim": "", "locked_until": ""}}
+        )
+        self.processed += len(batch)
+        return len(batch)
+
+    async def run(self) -> None:
+        """Process jobs until cancelled."""
+        while True:
+            # Cleared before looking, so a job enqueued meanwhile still wakes us
+            self._wakeup.clear()
+            try:
+                if await self.process_batch():
+                    continue
+            except PyMongoError as e:
+                logger.error(f"Payment job queue unavailable: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def backlog(self) -> int:
+        return await self.jobs.count_documents({"status": {"$in": ["queued", "processing"]}})
+
+    def stats(self) -> dict:
+        return {
+            "enqueued": self.enqueued,
+            "duplicates": self.duplicates,
+            "processed": self.processed,
+            "batches": self.batches,
+            "failures": self.failures,
+        }
@@ -0,0 +1,91 @@
+"""Cache of serialized product, listing and category responses.
+
+Entries are the exact JSON bytes the endpoints return, with their ETag, so
+a hit skips both the Mongo round trip and pydantic validation. Freshness
+comes from catalog events rather than a short TTL: product writes (and the
+change-stream or catalog-version watcher for writes made by other
+processes) invalidate the affected entries. Any product change drops every
+cached listing, since it may move in or out of any page; the dropped
+listings age out within ``list_ttl``, which also bounds staleness when no
+events arrive.
+
+Product bodies include stock. Without a change stream, stock sold by other
+workers raises no event here, so product entries then expire after
+``unwatched_ttl`` instead of ``ttl``.
+"""
+from typing import Any, Dict, Hashable, Optional
+
+from caching import ByteLRUCache
+from catalog_events import (
+    CATALOG_RELOADED, CATEGORIES_CHANGED, PRODUCT_CHANGED, PRODUCT_DELETED, STOCK_CHANGED, CatalogEvent, CatalogEvents,
+    catalog_events,
+)
+from http_cache import CachedBody
+
+CATEGORIES_KEY = "categories"
+
+
+class ProductCache:
+    def __init__(self, max_bytes: int, ttl: float, list_ttl: float = 60.0, unwatched_ttl: float = 30.0,
+                 events: CatalogEvents = catalog_events):
+        self._cache = ByteLRUCache(max_bytes=max_bytes, ttl=ttl)
+        self.list_ttl = list_ttl
+        self.unwatched_ttl = unwatched_ttl
+        self.events = events
+        # Part of every listing key, so invalidating all listings is O(1)
+        self._list_epoch = 0
+        # Bumped on every invalidation. A fill that started before an
+        # invalidation is dropped rather than caching what may be stale data.
+        self.generation = 0
+
+    def get_product(self, product_id: str) -> Optional[CachedBody]:
+        return self._cache.get(("product", product_id))
+
+    def put_product(self, product_id: str, cached: CachedBody, generation: int) -> None:
+        if generation == self.generation:
+            ttl = None if self.events.streaming else min(self.unwatched_ttl, self._cache.ttl)
+            self._store(("product", product_id), cached, ttl)
+
+    def get_list(self, params: Hashable) -> Optional[CachedBody]:
+        return self._cache.get(("list", self._list_epoch, params))
+
+    def put_list(self, params: Hashable, cached: CachedBody, generation: int) -> None:
+        if generation == self.generation:
+            self._store(("list", self._list_epoch, params), cached, self.list_ttl)
+
+    def get_categories(self) -> Optional[CachedBody]:
+        return self._cache.get(CATEGORIES_KEY)
+
+    def put_categories(self, cached: CachedBody, generation: int) -> None:
+        if generation == self.generation:
+            self._store(CATEGORIES_KEY, cached)
+
+    def _store(self, key: Hashable, cached: CachedBody, ttl: Optional[float] = None) -> None:
+        # Compressed variants are added on first request and must be counted
+        cached.on_grow = lambda: self._cache.recount(key)
+        self._cache.set(key, cached, ttl)
+
+    def invalidate_product(self, product_id: str) -> None:
+        self.generation += 1
+        self._cache.invalidate(("product", product_id))
+        self._list_epoch += 1
+
+    def invalidate_categories(self) -> None:
+        self.generation += 1
+        self._cache.invalidate(CATEGORIES_KEY)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._cache.clear()
+
+    async def handle_catalog_event(self, event: CatalogEvent) -> None:
+        if event.kind in (PRODUCT_CHANGED, STOCK_CHANGED) and event.product_id:
+            self.invalidate_product(event.product_id)
+        elif event.kind == CATEGORIES_CHANGED:
+            self.invalidate_categories()
+        elif event.kind in (CATALOG_RELOADED, PRODUCT_DELETED):
+            # Entries are keyed by product id, which a bare delete lacks
+            self.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
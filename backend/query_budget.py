@@ -0,0 +1,142 @@
+"""Mongo round-trip budgets per route.
+
+``ROUTE_BUDGETS`` declares the most Mongo commands each hot route may issue
+per request, counting a user-cache miss in ``get_current_user``. Update it
+whenever a handler legitimately gains or loses a query.
+
+Commands are counted by ``metrics.MongoCommandListener``.
+``QueryBudgetMiddleware`` compares every request against its route's budget.
+It logs the request's command list when the budget is exceeded, or raises
+``QueryBudgetExceeded`` when ``QUERY_BUDGET_MODE=raise``. ``count_queries``
+does the same for a block of code. In tests, enable the ``query_counter``
+fixture with ``pytest_plugins = ["query_budget"]``::
+
+    async def test_add_to_cart(query_counter, client):
+        await client.post("/api/cart/add", json=...)
+        query_counter.assert_within(3)
+"""
+import logging
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from metrics import RequestStats, current_request, route_template
+
+logger = logging.getLogger(__name__)
+
+# off: no checks; warn: log offenders; raise: fail the request
+QUERY_BUDGET_MODE = os.environ.get('QUERY_BUDGET_MODE', 'off')
+
+ROUTE_BUDGETS: Dict[Tuple[str, str], int] = {
+    ("POST", "/api/auth/register"): 2,
+    ("POST", "/api/auth/login"): 1,
+    ("GET", "/api/auth/me"): 1,
+    ("GET", "/api/products"): 1,
+    ("POST", "/api/products/batch"): 1,
+    # Rebuilding a missing summary takes four (find, aggregate, update,
+    # find again), plus the category's own aggregate when filtered
+    ("GET", "/api/products/facets"): 5,
+    ("GET", "/api/products/{product_id}"): 1,
+    ("GET", "/api/categories"): 1,
+    ("GET", "/api/cart"): 4,
+    ("POST", "/api/cart/add"): 3,
+    ("PUT", "/api/cart/update"): 3,
+    ("DELETE", "/api/cart/remove/{product_id}"): 2,
+    # Cart, products, reservation bulk write, order and summary inserts, cart cleanup
+    ("POST", "/api/orders"): 7,
+    # Each page reads both hot and archived orders
+    ("GET", "/api/orders"): 3,
+    ("GET", "/api/orders/history"): 2,
+    # Falls back to the archive
+    ("GET", "/api/orders/{order_id}"): 3,
+    ("POST", "/api/payment/create-session"): 4,
+    ("GET", "/api/payment/status/{session_id}"): 4,
+    # User (when not cached) and the transaction ownership check
+    ("POST", "/api/payment/stream-token/{session_id}"): 2,
+    # Only the queue upsert; the transition is applied in the background
+    ("POST", "/api/webhook/stripe"): 1,
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    def __init__(self, stats: RequestStats):
+        self.stats = stats
+
+    @property
+    def count(self) -> int:
+        return self.stats.mongo_commands
+
+    @property
+    def commands(self):
+        return list(self.stats.commands)
+
+    def assert_within(self, budget: int, label: str = "block") -> None:
+        if self.count > budget:
+            raise QueryBudgetExceeded(_describe(label, budget, self.stats))
+
+
+def _describe(label: str, budget: int, stats: RequestStats) -> str:
+    return f"{label} issued {stats.mongo_commands} Mongo commands (budget {budget}): {', '.join(stats.commands)}"
+
+
+@contextmanager
+def count_queries(budget: Optional[int] = None) -> Iterator[QueryCounter]:
+    """Count every Mongo command issued inside the block, including by requests it makes in-process."""
+    stats = RequestStats(route="block", parent=current_request.get())
+    token = current_request.set(stats)
+    counter = QueryCounter(stats)
+    try:
+        yield counter
+    finally:
+        current_request.reset(token)
+    if budget is not None:
+        counter.assert_within(budget)
+
+
+class QueryBudgetMiddleware:
+    """Checks each request against ``ROUTE_BUDGETS``; install inside ``MetricsMiddleware``."""
+
+    def __init__(self, app, mode: str = QUERY_BUDGET_MODE, budgets: Dict[Tuple[str, str], int] = ROUTE_BUDGETS):
+        self.app = app
+        self.mode = mode
+        self.budgets = budgets
+
+    async def __call__(self, scope, receive, send):
+        if self.mode == "off" or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = current_request.get()
+        token = None
+        if stats is None:
+            stats = RequestStats()
+            token = current_request.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if token is not None:
+                current_request.reset(token)
+        route = route_template(scope)
+        budget = self.budgets.get((scope["method"], route))
+        if budget is None or stats.mongo_commands <= budget:
+            return
+        message = _describe(f"{scope['method']} {route}", budget, stats)
+        if self.mode == "raise":
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+    @pytest.fixture
+    def query_counter():
+        with count_queries() as counter:
+            yield counter
@@ -0,0 +1,309 @@
+"""Rate limiting and admission control.
+
+Every API request is classified by method and path (``ROUTE_RULES``) into a
+route class: bcrypt-backed auth, search, Stripe-backed payment, and so on.
+Two checks run before the request reaches the app:
+
+- A token bucket per (route class, client) from ``RATE_LIMITS``. A client
+  is the authenticated user, or the IP address for anonymous requests.
+  Clients over their rate get 429 with ``Retry-After``.
+- Concurrency caps: a global cap on requests in flight and optional
+  per-class caps. A request that would exceed one gets 503 at once, rather
+  than queueing behind work that is already slow.
+
+Buckets live in this process (``MemoryBuckets``) by default. With
+``RATE_LIMIT_BACKEND=redis``, every worker shares buckets in Redis
+(``RedisBuckets``) through one atomic script call per request. If Redis is
+unreachable the limiter fails open. Limits are set with ``RATE_LIMITS``, as
+``class=rate/burst`` pairs with rate in requests per second, e.g.
+``auth=0.2/10,search=5/20``.
+
+Anonymous clients are keyed by IP, so the limiter must see the real client
+address. Limiting is off unless ``RATE_LIMITING=on``. Behind proxies, set
+``TRUSTED_PROXY_HOPS`` to the number of proxies in front of the app that
+append to ``X-Forwarded-For``; the client is the entry that many places
+from the right. Entries further left are written by the client and never
+trusted. The default of 0 uses the connection's peer address, which behind
+a proxy puts every anonymous client in one bucket.
+"""
+import json
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Pattern, Tuple
+from urllib.parse import parse_qs
+
+from metrics import registry
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Limit:
+    # Tokens added per second
+    rate: float
+    # Bucket size: the burst a fresh client may send
+    burst: float
+
+
+# (method or "*", path pattern, query parameter that must be present, route
+# class or None for unlimited); the first match wins
+ROUTE_RULES: Tuple[Tuple[str, Pattern, Optional[str], Optional[str]], ...] = tuple(
+    (method, re.compile(pattern), param, route_class) for method, pattern, param, route_class in (
+        ("POST", r"/api/auth/(login|register)", None, "auth"),
+        ("GET", r"/api/products(/facets)?", "search", "search"),
+        ("GET", r"/api/payment/stream/[^/]+", None, "stream"),
+        ("*", r"/api/payment/.+", None, "payment"),
+        # Stripe retries on its own schedule and shares IPs across merchants
+        ("POST", r"/api/webhook/stripe", None, None),
+        ("*", r"/api/.*", None, "default"),
+    )
+)
+
+DEFAULT_RATE_LIMITS: Dict[str, Limit] = {
+    "auth": Limit(rate=0.2, burst=10),
+    "search": Limit(rate=5, burst=20),
+    "payment": Limit(rate=1, burst=10),
+    "stream": Limit(rate=0.5, burst=5),
+    "default": Limit(rate=50, burst=200),
+}
+
+# Payment streams are long-lived and mostly idle, so they are not counted
+# against the global cap
+UNCAPPED_CLASSES = frozenset({"stream"})
+
+rate_limited = registry.counter("http_rate_limited_total", "Requests rejected with 429, by route class.")
+shed = registry.counter("http_shed_total", "Requests rejected with 503 by a concurrency cap, by route class and cap.")
+admitted_in_flight = registry.gauge("http_admitted_in_flight", "Admitted requests in flight, by route class.")
+backend_errors = registry.counter("rate_limit_backend_errors_total", "Bucket lookups that failed open.")
+
+
+def parse_limits(text: str) -> Dict[str, Limit]:
+    limits = {}
+    for part in filter(None, (part.strip() for part in text.split(","))):
+        route_class, _, spec = part.partition("=")
+        rate, _, burst = spec.partition("/")
+        limits[route_class.strip()] = Limit(float(rate), float(burst or rate))
+    return limits
+
+
+def parse_caps(text: str) -> Dict[str, int]:
+    caps = {}
+    for part in filter(None, (part.strip() for part in text.split(","))):
+        route_class, _, cap = part.partition("=")
+        caps[route_class.strip()] = int(cap)
+    return caps
+
+
+def classify(method: str, path: str, query_string: bytes = b"") -> Optional[str]:
+    for rule_method, pattern, param, route_class in ROUTE_RULES:
+        if rule_method not in ("*", method) or not pattern.fullmatch(path):
+            continue
+        if param and param not in parse_qs(query_string.decode("latin-1")):
+            continue
+        return route_class
+    return None
+
+
+def client_ip(scope, trusted_hops: int = 0) -> str:
+    """The client address, ``trusted_hops`` entries from the right of ``X-Forwarded-For``."""
+    if trusted_hops > 0:
+        forwarded = []
+        # Repeated headers form one list, in order
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                forwarded += [entry.strip() for entry in value.decode("latin-1").split(",") if entry.strip()]
+        if forwarded:
+            # With fewer entries than proxies, every entry came from a proxy
+            return forwarded[max(len(forwarded) - trusted_hops, 0)]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class MemoryBuckets:
+    """Token buckets in this process; the least recently used are dropped beyond ``max_keys``."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        # key -> (tokens, monotonic time of last update)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        """Spend ``cost`` tokens; returns 0 if allowed, else seconds until it would be."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (limit.burst, now))
+        tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / limit.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+# Same algorithm as MemoryBuckets, on the Redis clock so workers agree; the
+# key expires once the bucket would be full again anyway
+TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker through Redis."""
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.prefix = prefix
+        self._take = client.register_script(TAKE_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisBuckets":
+        if aioredis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis needs the redis package")
+        return cls(aioredis.from_url(url))
+
+    async def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        # Lua numbers come back truncated to integers, so the wait is a string
+        wait = await self._take(keys=[self.prefix + key], args=[limit.rate, limit.burst, cost])
+        return float(wait)
+
+
+class ConcurrencyCaps:
+    """Counts admitted requests; admission fails instead of waiting when a cap is reached."""
+
+    def __init__(self, global_cap: int, caps: Dict[str, int]):
+        self.global_cap = global_cap
+        self.caps = caps
+        self.total = 0
+        self.in_flight: Dict[str, int] = {}
+
+    def try_acquire(self, route_class: str) -> Optional[str]:
+        """Admit a request, or return the name of the cap that is full."""
+        counted = route_class not in UNCAPPED_CLASSES
+        if counted and self.total >= self.global_cap:
+            return "global"
+        current = self.in_flight.get(route_class, 0)
+        cap = self.caps.get(route_class)
+        if cap is not None and current >= cap:
+            return route_class
+        self.in_flight[route_class] = current + 1
+        if counted:
+            self.total += 1
+        admitted_in_flight.inc(route_class=route_class)
+        return None
+
+    def release(self, route_class: str) -> None:
+        self.in_flight[route_class] -= 1
+        if route_class not in UNCAPPED_CLASSES:
+            self.total -= 1
+        admitted_in_flight.dec(route_class=route_class)
+
+
+class RateLimiter:
+    def __init__(self, buckets, limits: Dict[str, Limit], caps: ConcurrencyCaps):
+        self.buckets = buckets
+        self.limits = limits
+        self.caps = caps
+        self.limited = 0
+        self.shed = 0
+        self.backend_errors = 0
+
+    async def retry_after(self, route_class: str, client: str) -> float:
+        limit = self.limits.get(route_class)
+        if limit is None:
+            return 0.0
+        try:
+            return await self.buckets.take(f"{route_class}:{client}", limit)
+        except Exception as e:
+            # A limiter outage must not take the API down with it
+            self.backend_errors += 1
+            backend_errors.inc()
+            logger.warning(f"Rate limit backend failed, admitting request: {e}")
+            return 0.0
+
+    def stats(self) -> dict:
+        return {
+            "limited": self.limited,
+            "shed": self.shed,
+            "backend_errors": self.backend_errors,
+            "in_flight": self.caps.total,
+            "in_flight_by_class": dict(self.caps.in_flight),
+            "global_cap": self.caps.global_cap,
+            "limits": {name: {"rate": limit.rate, "burst": limit.burst} for name, limit in self.limits.items()},
+        }
+
+
+async def _reject(send, status: int, detail: str, retry_after: float) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware; install inside ``CORSMiddleware`` so rejections carry CORS headers."""
+
+    def __init__(self, app, limiter: RateLimiter, identify: Callable[[dict], str] = client_ip):
+        self.app = app
+        self.limiter = limiter
+        self.identify = identify
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route_class = classify(scope["method"], scope["path"], scope.get("query_string", b""))
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        wait = await self.limiter.retry_after(route_class, self.identify(scope))
+        if wait > 0:
+            self.limiter.limited += 1
+            rate_limited.inc(route_class=route_class)
+            await _reject(send, 429, "Too many requests", wait)
+            return
+
+        full = self.limiter.caps.try_acquire(route_class)
+        if full is not None:
+            self.limiter.shed += 1
+            shed.inc(route_class=route_class, cap=full)
+            await _reject(send, 503, "Server busy, please retry", 1)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.caps.release(route_class)
@@ -0,0 +1,169 @@
+"""Response compression.
+
+``CompressionMiddleware`` compresses complete responses of at least
+``COMPRESSION_MIN_SIZE`` bytes. It uses the best encoding the client
+accepts: zstd, brotli or gzip. brotli and zstd are optional; without their
+packages only gzip is offered. Streamed responses (SSE, NDJSON exports)
+pass through untouched, headers included, so events are not held back.
+
+Cached catalog bodies are compressed at stronger levels, once per encoding:
+the first request for an encoding compresses the cached body
+(``compress_stored``), and the cache keeps the result for later requests.
+The handler sends that variant with ``Content-Encoding`` already set, and
+the middleware leaves it alone.
+"""
+import gzip
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+# Sent as they are produced; holding their headers for the first chunk
+# would leave clients waiting on an idle stream
+STREAMING_TYPES = ("text/event-stream", "application/x-ndjson")
+
+# name -> (compress(body, level), per-response level, level for stored bodies)
+CODECS: Dict[str, Tuple[Callable[[bytes, int], bytes], int, int]] = {
+    "gzip": (lambda body, level: gzip.compress(body, compresslevel=level, mtime=0), 6, 9),
+}
+if brotli is not None:
+    CODECS["br"] = (lambda body, level: brotli.compress(body, quality=level), 4, 9)
+if zstd is not None:
+    CODECS["zstd"] = (lambda body, level: zstd.compress(body, level), 3, 12)
+elif zstandard is not None:
+    CODECS["zstd"] = (lambda body, level: zstandard.ZstdCompressor(level=level).compress(body), 3, 12)
+
+# Per response, zstd is the cheapest to produce; cached bodies are
+# compressed once, so brotli's smaller output wins
+RESPONSE_PREFERENCE = [name for name in ("zstd", "br", "gzip") if name in CODECS]
+STORED_PREFERENCE = [name for name in ("br", "zstd", "gzip") if name in CODECS]
+
+
+def choose_encoding(accept_encoding: Optional[str], offered: Iterable[str]) -> Optional[str]:
+    """The first of ``offered`` with the highest q-value in ``accept_encoding``, or None for identity."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for name in offered:
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def stored_encodings(body: bytes) -> List[str]:
+    """Encodings worth offering for a cached ``body``, in ``STORED_PREFERENCE`` order."""
+    return STORED_PREFERENCE if len(body) >= COMPRESSION_MIN_SIZE else []
+
+
+def compress_stored(body: bytes, encoding: str) -> Optional[bytes]:
+    """``body`` compressed at the stored level, or None if that is no smaller."""
+    compress, _, level = CODECS[encoding]
+    compressed = compress(body, level)
+    return compressed if len(compressed) < len(body) else None
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """Tag of one encoding of a representation; each must differ from the identity tag."""
+    if not encoding or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def _is_compressible(headers: list) -> bool:
+    content_type = b""
+    for name, value in headers:
+        if name == b"content-encoding":
+            return False
+        if name == b"content-type":
+            content_type = value
+    content_type = content_type.decode("latin-1").lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) and not content_type.startswith(STREAMING_TYPES)
+
+
+def _add_vary(headers: list) -> list:
+    for i, (name, value) in enumerate(headers):
+        if name == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[i] = (name, value + b", Accept-Encoding")
+            return headers
+    return headers + [(b"vary", b"Accept-Encoding")]
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware; buffers only the first body chunk to tell complete responses from streams."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = None
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        encoding = choose_encoding(accept_encoding, RESPONSE_PREFERENCE)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_wrapper(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                if _is_compressible(message.get("headers", [])):
+                    # Held until the first body chunk shows whether this is a stream
+                    start = message
+                    return
+            elif message["type"] == "http.response.body" and start is not None:
+                held, start = start, None
+                body = message.get("body", b"")
+                if message.get("more_body", False) or len(body) < self.minimum_size:
+                    await send({**held, "headers": _add_vary(list(held["headers"]))})
+                    await send(message)
+                    return
+                compress, level, _ = CODECS[encoding]
+                compressed = compress(body, level)
+                headers = []
+                for name, value in held["headers"]:
+                    if name == b"content-length":
+                        value = str(len(compressed)).encode()
+                    elif name == b"etag":
+                        value = encoded_etag(value.decode("latin-1"), encoding).encode("latin-1")
+                    headers.append((name, value))
+                headers.append((b"content-encoding", encoding.encode()))
+                await send({**held, "headers": _add_vary(headers)})
+                await send({**message, "body": compressed})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,335 @@
+"""In-memory inverted index for product search.
+
+Replaces the unanchored ``$regex`` scan over ``title``/``description``. Text
+is tokenized (accent-folded, case-folded, split on non-alphanumerics), ranked
+with BM25 (title terms weighted above description terms), and every query
+token of at least ``MIN_PREFIX_LENGTH`` characters also matches indexed terms
+it is a prefix of, so partial words typed into the search box still hit.
+
+Searches run on the event loop, so they must not touch every posting of a
+common term. Each term's postings are also kept ordered by their BM25
+contribution. Full builds order them off the event loop; after that they are
+kept ordered on writes. A query reads each token's ordered postings in turn
+(the threshold algorithm). It stops once no unseen product can reach the top
+``offset + limit``, or once it has read ``MAX_CANDIDATES`` postings and has a
+full page. In the second case it returns the best products found so far,
+which all rank high for every token.
+Document lengths are normalized against the average length at the last
+full build, so the ordering stays valid between builds.
+"""
+import asyncio
+import bisect
+import heapq
+import logging
+import math
+import re
+import unicodedata
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from catalog_events import CATALOG_RELOADED, PRODUCT_CHANGED, CatalogEvent
+
+logger = logging.getLogger(__name__)
+
+FIELD_WEIGHTS = {"title": 3.0, "description": 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Prefix matches score below an exact match of the same term
+PREFIX_PENALTY = 0.6
+MAX_PREFIX_EXPANSIONS = 64
+# Shorter tokens only match whole terms; one letter would expand to a large
+# share of the vocabulary
+MIN_PREFIX_LENGTH = 2
+# Most postings one search reads before settling for the best found so far
+MAX_CANDIDATES = 4000
+# Terms with at least this many postings are ordered during full builds;
+# rarer ones are ordered on first use
+PREBUILD_RANKED_MIN = 64
+# Yield to the event loop this often while building
+BUILD_BATCH_SIZE = 2000
+
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def normalize(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(normalize(text or ""))
+
+
+class ProductSearchIndex:
+    def __init__(self, collection):
+        self.collection = collection
+        self.ready = False
+        self._reset()
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self._rebuild_pending = False
+
+    def _reset(self) -> None:
+        # term -> {product_id: BM25 contribution before idf}; raw weighted
+        # term frequencies until the index is finalized
+        self._postings: Dict[str, Dict[str, float]] = {}
+        # product_id -> (weighted length, terms, category)
+        self._docs: Dict[str, Tuple[float, Tuple[str, ...], str]] = {}
+        self._total_length = 0.0
+        self._sorted_terms: List[str] = []
+        self._terms_dirty = False
+        # term -> product ids by descending contribution, built on first use
+        self._ranked: Dict[str, List[str]] = {}
+        # Average document length BM25 normalizes against; fixed between
+        # full builds, None until the index is finalized
+        self._norm_length: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    # Maintenance
+
+    def _impact(self, tf: float, length: float) -> float:
+        return tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / self._norm_length))
+
+    def _finalize(self) -> None:
+        """Fix the length normalization and turn term frequencies into contributions."""
+        self._norm_length = self._total_length / len(self._docs) if self._docs else 1.0
+        for postings in self._postings.values():
+            for product_id, tf in postings.items():
+                postings[product_id] = self._impact(tf, self._docs[product_id][0])
+
+    def _rank_key(self, term: str, product_id: str) -> Tuple[float, str]:
+        return -self._postings[term][product_id], product_id
+
+    def add(self, doc: dict) -> None:
+        product_id = doc.get("id")
+        if not product_id:
+            return
+        self.remove(product_id)
+
+        frequencies: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(doc.get(field, "")):
+                frequencies[token] = frequencies.get(token, 0.0) + weight
+
+        length = sum(frequencies.values())
+        self._docs[product_id] = (length, tuple(frequencies), doc.get("category", ""))
+        self._total_length += length
+        for term, tf in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._terms_dirty = True
+            postings[product_id] = tf if self._norm_length is None else self._impact(tf, length)
+            ranked = self._ranked.get(term)
+            if ranked is not None:
+                bisect.insort(ranked, product_id, key=lambda pid, term=term: self._rank_key(term, pid))
+
+    def remove(self, product_id: str) -> None:
+        entry = self._docs.pop(product_id, None)
+        if entry is None:
+            return
+        length, terms, _ = entry
+        self._total_length -= length
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            ranked = self._ranked.get(term)
+            if ranked is not None:
+                key = lambda pid, term=term: self._rank_key(term, pid)
+                position = bisect.bisect_left(ranked, key(product_id), key=key)
+                if position < len(ranked) and ranked[position] == product_id:
+                    del ranked[position]
+                else:
+                    ranked.remove(product_id)
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+                self._ranked.pop(term, None)
+                self._terms_dirty = True
+
+    def _rank_common_terms(self) -> None:
+        for term, postings in self._postings.items():
+            if len(postings) >= PREBUILD_RANKED_MIN:
+                self._ranked_postings(term)
+
+    async def rebuild(self) -> None:
+        """Reload the whole index from the products collection."""
+        if self._rebuild_task and not self._rebuild_task.done():
+            self._rebuild_pending = True
+            await self._rebuild_task
+            return
+        self._rebuild_task = asyncio.ensure_future(self._rebuild())
+        await self._rebuild_task
+
+    async def _rebuild(self) -> None:
+        while True:
+            self._rebuild_pending = False
+            fresh = ProductSearchIndex(self.collection)
+            projection = {"_id": 0, "id": 1, "title": 1, "description": 1, "category": 1}
+            count = 0
+            async for doc in self.collection.find({}, projection).batch_size(BUILD_BATCH_SIZE):
+                fresh.add(doc)
+                count += 1
+                if count % BUILD_BATCH_SIZE == 0:
+                    await asyncio.sleep(0)
+            fresh._refresh_terms()
+            # The fresh index is not shared yet, so the heavy passes can run
+            # in a thread
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, fresh._finalize)
+            await loop.run_in_executor(None, fresh._rank_common_terms)
+            self._postings = fresh._postings
+            self._ranked = fresh._ranked
+            self._norm_length = fresh._norm_length
+            self._docs = fresh._docs
+            self._total_length = fresh._total_length
+            self._sorted_terms = fresh._sorted_terms
+            self._terms_dirty = False
+            self.ready = True
+            logger.info(f"Search index built with {count} products and {len(self._postings)} terms")
+            if not self._rebuild_pending:
+                return
+
+    async def refresh_product(self, product_id: str, document: Optional[dict] = None) -> None:
+        if self._rebuild_task and not self._rebuild_task.done():
+            # The running build may already have read the old version
+            self._rebuild_pending = True
+        if document is None:
+            projection = {"_id": 0, "id": 1, "title": 1, "description": 1, "category": 1}
+            document = await self.collection.find_one({"id": product_id}, projection)
+        if document is None:
+            self.remove(product_id)
+        else:
+            self.add(document)
+
+    async def handle_catalog_event(self, event: CatalogEvent) -> None:
+        if event.kind == PRODUCT_CHANGED and event.product_id:
+            await self.refresh_product(event.product_id, event.document)
+        elif event.kind == CATALOG_RELOADED:
+            await self.rebuild()
+
+    # Querying
+
+    def _refresh_terms(self) -> None:
+        self._sorted_terms = sorted(self._postings)
+        self._terms_dirty = False
+
+    def _expand(self, token: str) -> List[Tuple[str, float]]:
+        """Indexed terms matching ``token`` exactly or as a prefix, with their boost."""
+        if self._terms_dirty:
+            self._refresh_terms()
+        matches = []
+        if token in self._postings:
+            matches.append((token, 1.0))
+        if len(token) < MIN_PREFIX_LENGTH:
+            return matches
+        terms = self._sorted_terms
+        position = bisect.bisect_right(terms, token)
+        prefixed = []
+        while position < len(terms) and terms[position].startswith(token):
+            prefixed.append(terms[position])
+            position += 1
+        if len(prefixed) > MAX_PREFIX_EXPANSIONS:
+            # Keep the most common completions
+            prefixed.sort(key=lambda t: len(self._postings[t]), reverse=True)
+            prefixed = prefixed[:MAX_PREFIX_EXPANSIONS]
+        matches.extend((term, PREFIX_PENALTY) for term in prefixed)
+        return matches
+
+    def _ranked_postings(self, term: str) -> List[str]:
+        ranked = self._ranked.get(term)
+        if ranked is None:
+            ranked = self._ranked[term] = sorted(self._postings[term], key=lambda pid: self._rank_key(term, pid))
+        return ranked
+
+    def _scored(self, term: str, weight: float) -> Iterator[Tuple[float, str]]:
+        # Negated so heapq.merge yields the best first
+        postings = self._postings[term]
+        for product_id in self._ranked_postings(term):
+            yield -weight * postings[product_id], product_id
+
+    def _token_stream(self, weighted: List[Tuple[str, float]]) -> Iterator[Tuple[float, str]]:
+        """Products matching one token, best contribution first, each once."""
+        seen = set()
+        for negated, product_id in heapq.merge(*(self._scored(term, weight) for term, weight in weighted)):
+            if product_id not in seen:
+                seen.add(product_id)
+                yield -negated, product_id
+
+    def _weighted_terms(self, token: str, doc_count: int) -> List[Tuple[str, float]]:
+        weighted = []
+        for term, boost in self._expand(token):
+            df = len(self._postings[term])
+            weighted.append((term, boost * math.log(1 + (doc_count - df + 0.5) / (df + 0.5))))
+        return weighted
+
+    def _score(self, product_id: str, groups: List[List[Tuple[str, float]]]) -> Optional[float]:
+        total = 0.0
+        for weighted in groups:
+            contributions = [weight * self._postings[term][product_id]
+                             for term, weight in weighted if product_id in self._postings[term]]
+            if not contributions:
+                return None
+            total += max(contributions)
+        return total
+
+    def search(self, query: str, category: Optional[str] = None, limit: int = 50, offset: int = 0) -> List[Tuple[str, float]]:
+        """Return ``(product_id, score)`` pairs, best first.
+
+        Every query token must match (exactly or as a prefix) for a product
+        to be returned, mirroring the phrase semantics of the old regex.
+        Uses the threshold algorithm: read each token's ordered postings in
+        turn, score every new product exactly, and stop once the best
+        scores that unseen products could still reach fall below the
+        current top ``offset + limit`` (or the candidate budget runs out).
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not self._docs:
+            return []
+        if self._norm_length is None:
+            self._finalize()
+
+        groups = []
+        for token in tokens:
+            weighted = self._weighted_terms(token, len(self._docs))
+            if not weighted:
+                return []
+            groups.append(weighted)
+
+        wanted = offset + limit
+        streams = [self._token_stream(weighted) for weighted in groups]
+        frontier = [math.inf] * len(streams)
+        best_scores: List[float] = []
+        scored: List[Tuple[str, float]] = []
+        seen = set()
+        exhausted = False
+        read = 0
+        # The budget only cuts a search short once it has a full page
+        while not exhausted and (read < MAX_CANDIDATES or len(best_scores) < wanted):
+            read += len(streams)
+            for i, stream in enumerate(streams):
+                item = next(stream, None)
+                if item is None:
+                    # Every product with this token has been seen, and the
+                    # rest cannot match
+                    exhausted = True
+                    break
+                frontier[i], product_id = item
+                if product_id in seen:
+                    continue
+                seen.add(product_id)
+                if category and self._docs[product_id][2] != category:
+                    continue
+                total = self._score(product_id, groups)
+                if total is None:
+                    continue
+                scored.append((product_id, total))
+                heapq.heappush(best_scores, total)
+                if len(best_scores) > wanted:
+                    heapq.heappop(best_scores)
+            if len(best_scores) == wanted and sum(frontier) < best_scores[0]:
+                break
+
+        ranked = heapq.nsmallest(wanted, scored, key=lambda item: (-item[1], item[0]))
+        return ranked[offset:]
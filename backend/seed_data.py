@@ -3,8 +3,7 @@ from motor.motor_asyncio import AsyncIOMotorClient
 import os
 from dotenv import load_dotenv
 from pathlib import Path
-from datetime import datetime, timezone
-import uuid
+from catalog_import import CatalogImporter
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -16,49 +15,39 @@ async def seed_database():
     client = AsyncIOMotorClient(mongo_url)
     db = client[db_name]
     
-    # Clear existing data
-    await db.categories.delete_many({})
-    await db.products.delete_many({})
-    
     # Seed categories
     categories = [
         {
-            "id": str(uuid.uuid4()),
             "name": "Electronics",
             "slug": "electronics",
             "description": "Phones, laptops, and gadgets",
             "image": "https://images.unsplash.com/photo-1498049794561-7780e7231661?w=800"
         },
         {
-            "id": str(uuid.uuid4()),
             "name": "Fashion",
             "slug": "fashion",
             "description": "Clothing, shoes, and accessories",
             "image": "https://images.unsplash.com/photo-1445205170230-053b83016050?w=800"
         },
         {
-            "id": str(uuid.uuid4()),
             "name": "Home & Garden",
             "slug": "home-garden",
             "description": "Furniture, decor, and tools",
             "image": "https://images.unsplash.com/photo-1484101403633-562f891dc89a?w=800"
         },
         {
-            "id": str(uuid.uuid4()),
             "name": "Sports",
             "slug": "sports",
             "description": "Equipment and apparel",
             "image": "https://images.unsplash.com/photo-1461896836934-ffe607ba8211?w=800"
         },
         {
-            "id": str(uuid.uuid4()),
             "name": "Books",
             "slug": "books",
             "description": "Fiction, non-fiction, and textbooks",
             "image": "https://images.unsplash.com/photo-1495446815901-a7297e633e8d?w=800"
         },
         {
-            "id": str(uuid.uuid4()),
             "name": "Toys & Games",
             "slug": "toys-games",
             "description": "For kids and adults",
@@ -66,12 +55,9 @@ async def seed_database():
         }
     ]
     
-    await db.categories.insert_many(categories)
-    
     # Seed products
     products = [
         {
-            "id": str(uuid.uuid4()),
             "title": "Wireless Noise-Cancelling Headphones",
             "description": "Premium over-ear headphones with active noise cancellation and 30-hour battery life",
             "price": 299.99,
@@ -79,11 +65,9 @@ async def seed_database():
             "category": "Electronics",
             "stock": 45,
             "rating": 4.7,
-            "reviews_count": 892,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 892
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "4K Ultra HD Smart TV 55\"",
             "description": "Crystal-clear 4K resolution with HDR support and built-in streaming apps",
             "price": 599.99,
@@ -91,11 +75,9 @@ async def seed_database():
             "category": "Electronics",
             "stock": 23,
             "rating": 4.6,
-            "reviews_count": 445,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 445
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Smartphone 128GB",
             "description": "Latest flagship smartphone with triple camera system and all-day battery",
             "price": 899.99,
@@ -103,11 +85,9 @@ async def seed_database():
             "category": "Electronics",
             "stock": 67,
             "rating": 4.8,
-            "reviews_count": 1230,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 1230
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Laptop 15.6\" Core i7",
             "description": "Powerful laptop with 16GB RAM, 512GB SSD, perfect for work and gaming",
             "price": 1299.99,
@@ -115,11 +95,9 @@ async def seed_database():
             "category": "Electronics",
             "stock": 34,
             "rating": 4.5,
-            "reviews_count": 678,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 678
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Wireless Gaming Mouse",
             "description": "High-precision gaming mouse with customizable RGB lighting",
             "price": 79.99,
@@ -127,11 +105,9 @@ async def seed_database():
             "category": "Electronics",
             "stock": 120,
             "rating": 4.4,
-            "reviews_count": 324,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 324
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Men's Leather Jacket",
             "description": "Classic genuine leather jacket in black, perfect for any season",
             "price": 249.99,
@@ -139,11 +115,9 @@ async def seed_database():
             "category": "Fashion",
             "stock": 56,
             "rating": 4.6,
-            "reviews_count": 267,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 267
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Women's Running Shoes",
             "description": "Lightweight and breathable running shoes with superior cushioning",
             "price": 119.99,
@@ -151,11 +125,9 @@ async def seed_database():
             "category": "Fashion",
             "stock": 89,
             "rating": 4.7,
-            "reviews_count": 543,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 543
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Classic Denim Jeans",
             "description": "Comfortable slim-fit jeans in dark blue wash",
             "price": 59.99,
@@ -163,11 +135,9 @@ async def seed_database():
             "category": "Fashion",
             "stock": 145,
             "rating": 4.3,
-            "reviews_count": 789,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 789
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Designer Sunglasses",
             "description": "Polarized sunglasses with UV protection and stylish frames",
             "price": 149.99,
@@ -175,11 +145,9 @@ async def seed_database():
             "category": "Fashion",
             "stock": 72,
             "rating": 4.5,
-            "reviews_count": 234,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 234
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Leather Backpack",
             "description": "Premium leather backpack with laptop compartment",
             "price": 189.99,
@@ -187,11 +155,9 @@ async def seed_database():
             "category": "Fashion",
             "stock": 43,
             "rating": 4.6,
-            "reviews_count": 156,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 156
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Modern Desk Lamp",
             "description": "Adjustable LED desk lamp with touch controls and USB charging",
             "price": 49.99,
@@ -199,11 +165,9 @@ async def seed_database():
             "category": "Home & Garden",
             "stock": 98,
             "rating": 4.4,
-            "reviews_count": 421,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 421
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Ergonomic Office Chair",
             "description": "Comfortable office chair with lumbar support and adjustable height",
             "price": 279.99,
@@ -211,11 +175,9 @@ async def seed_database():
             "category": "Home & Garden",
             "stock": 34,
             "rating": 4.5,
-            "reviews_count": 198,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 198
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Yoga Mat Premium",
             "description": "Non-slip yoga mat with extra cushioning, includes carrying strap",
             "price": 39.99,
@@ -223,11 +185,9 @@ async def seed_database():
             "category": "Sports",
             "stock": 167,
             "rating": 4.7,
-            "reviews_count": 892,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 892
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Adjustable Dumbbells Set",
             "description": "Space-saving adjustable dumbbells from 5 to 52.5 lbs",
             "price": 349.99,
@@ -235,11 +195,9 @@ async def seed_database():
             "category": "Sports",
             "stock": 28,
             "rating": 4.8,
-            "reviews_count": 334,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 334
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Road Bicycle 21-Speed",
             "description": "Lightweight aluminum road bike with Shimano gears",
             "price": 499.99,
@@ -247,11 +205,9 @@ async def seed_database():
             "category": "Sports",
             "stock": 19,
             "rating": 4.6,
-            "reviews_count": 145,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 145
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "The Art of Programming",
             "description": "Comprehensive guide to modern software development practices",
             "price": 49.99,
@@ -259,11 +215,9 @@ async def seed_database():
             "category": "Books",
             "stock": 234,
             "rating": 4.8,
-            "reviews_count": 567,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 567
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Mystery Novel Collection",
             "description": "Box set of bestselling mystery novels by renowned author",
             "price": 79.99,
@@ -271,11 +225,9 @@ async def seed_database():
             "category": "Books",
             "stock": 87,
             "rating": 4.7,
-            "reviews_count": 423,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 423
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "LEGO Architecture Set",
             "description": "Build famous landmarks with this detailed LEGO set",
             "price": 129.99,
@@ -283,11 +235,9 @@ async def seed_database():
             "category": "Toys & Games",
             "stock": 54,
             "rating": 4.9,
-            "reviews_count": 678,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 678
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Board Game Strategy Pack",
             "description": "Classic strategy board game for 2-4 players, ages 10+",
             "price": 44.99,
@@ -295,11 +245,9 @@ async def seed_database():
             "category": "Toys & Games",
             "stock": 112,
             "rating": 4.6,
-            "reviews_count": 289,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 289
         },
         {
-            "id": str(uuid.uuid4()),
             "title": "Remote Control Drone",
             "description": "HD camera drone with GPS and 30-minute flight time",
             "price": 399.99,
@@ -307,16 +255,25 @@ async def seed_database():
             "category": "Toys & Games",
             "stock": 31,
             "rating": 4.5,
-            "reviews_count": 178,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "reviews_count": 178
         }
     ]
     
-    await db.products.insert_many(products)
+    # Re-seeding keeps product ids stable, so existing carts and orders still resolve
+    for n, product in enumerate(products, 1):
+        product["sku"] = f"SEED-{n:03d}"
+        # Catalogs seeded before SKUs existed: tag the same product so the
+        # import matches it and keeps its id
+        await db.products.update_one(
+            {"title": product["title"], "sku": {"$exists": False}}, {"$set": {"sku": product["sku"]}}
+        )
+    
+    # Replaces the catalog in one swap, like any other import
+    report = await CatalogImporter(db, progress=False).run(products, categories)
     
     print(f"✅ Database seeded successfully!")
     print(f"   - {len(categories)} categories")
-    print(f"   - {len(products)} products")
+    print(f"   - {report.upserted} products")
     
     client.close()
 
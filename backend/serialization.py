@@ -0,0 +1,29 @@
+"""Response serialization fast path.
+
+FastAPI's default handling of ``response_model`` validates whatever the
+handler returns, then walks it again with ``jsonable_encoder`` and
+``json.dumps``. Handlers that return many documents instead fetch only the
+model's fields (``projection_for``) and let ``ModelSerializer`` validate once
+and dump straight to JSON bytes in pydantic-core. Everything else goes
+through ``ORJSONResponse``, the app's default response class.
+"""
+from typing import Any, Dict, Optional, Type
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+
+def projection_for(model: Type[BaseModel]) -> Dict[str, int]:
+    """Mongo projection returning exactly the model's fields (and never ``_id``)."""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+
+class ModelSerializer:
+    def __init__(self, tp: Any):
+        self.adapter = TypeAdapter(tp)
+
+    def dumps(self, data: Any) -> bytes:
+        return self.adapter.dump_json(self.adapter.validate_python(data))
+
+    def response(self, data: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+        return Response(content=self.dumps(data), media_type="application/json", headers=headers)
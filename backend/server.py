@@ -1,40 +1,171 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, File, UploadFile, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, File, UploadFile, Request, Response, Query
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import re
+import json
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import List, Optional, Union
 import uuid
 from datetime import datetime, timezone, timedelta
+from urllib.parse import parse_qs
 from passlib.context import CryptContext
 import jwt
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+from emergentintegrations.payments.stripe.checkout import CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+from catalog_events import STOCK_CHANGED, catalog_events, watch_catalog
+from db_indexes import ensure_indexes
+from caching import TTLCache
+import cart_store
+from serialization import ModelSerializer, projection_for
+from dates import DATETIME_FIELDS, coerce_datetimes, utcnow
+from pagination import (
+    PRODUCT_SORTS, ORDER_SORTS, SortSpec, InvalidCursor, cursor_sort, decode_cursor, encode_cursor, fetch_merged_page,
+    fetch_page, iterate_keyset,
+)
+from search_index import ProductSearchIndex
+from product_cache import ProductCache
+from http_cache import CachedBody, conditional_response
+from response_compression import CompressionMiddleware
+from facets import CatalogFacets
+from password_pool import PasswordHasher, PoolSaturated
+from payment_gateway import GatewayError, create_gateway
+from order_events import OrderStatusHub, SingleFlight
+from order_placement import OrderPlacementError, place_order, price_cart, release_expired_reservations
+from payment_jobs import PaymentJobQueue
+from order_history import archive_orders, find_order
+import metrics
+from query_budget import QueryBudgetMiddleware
+from token_auth import TokenKeys, TokenService
+from rate_limit import (
+    DEFAULT_RATE_LIMITS, ConcurrencyCaps, MemoryBuckets, RateLimiter, RateLimitMiddleware, RedisBuckets,
+    client_ip, parse_caps, parse_limits,
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[metrics.MongoCommandListener()])
 db = client[os.environ['DB_NAME']]
 
+# Product search
+search_index = ProductSearchIndex(db.products)
+catalog_events.subscribe(search_index.handle_catalog_event)
+CATALOG_POLL_SECONDS = float(os.environ.get('CATALOG_POLL_SECONDS', 5))
+
+# Serialized product/category responses, invalidated by catalog events
+product_cache = ProductCache(
+    max_bytes=int(os.environ.get('PRODUCT_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    ttl=float(os.environ.get('PRODUCT_CACHE_TTL_SECONDS', 3600)),
+    list_ttl=float(os.environ.get('PRODUCT_LIST_CACHE_TTL_SECONDS', 60)),
+    # Product bodies carry stock; used while no change stream reports other workers' sales
+    unwatched_ttl=float(os.environ.get('PRODUCT_CACHE_UNWATCHED_TTL_SECONDS', 30))
+)
+catalog_events.subscribe(product_cache.handle_catalog_event)
+
+# Sidebar facet counts; whole-catalog counts are precomputed
+catalog_facets = CatalogFacets(db.products, db.catalog_facets)
+catalog_events.subscribe(catalog_facets.handle_catalog_event)
+# Searches matching more products than this are faceted on the best matches
+FACET_SEARCH_LIMIT = int(os.environ.get('FACET_SEARCH_LIMIT', 10000))
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=int(os.environ.get('PASSWORD_POOL_WORKERS', 4)),
+    max_queue=int(os.environ.get('PASSWORD_POOL_QUEUE', 32))
+)
+
+# JWT settings; keys are parsed once (see token_auth.py)
+token_service = TokenService(
+    TokenKeys.from_env(),
+    expiration=timedelta(hours=int(os.environ.get('JWT_EXPIRATION_HOURS', 24))),
+    cache_size=int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+)
+
+# Rate limits per route class and client, and concurrency caps (see rate_limit.py)
+# Off by default: anonymous clients are keyed by IP, so only enable it once
+# TRUSTED_PROXY_HOPS matches the proxies in front of the app
+RATE_LIMITING = os.environ.get('RATE_LIMITING', 'off') == 'on'
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+rate_limiter = RateLimiter(
+    RedisBuckets.from_url(os.environ['REDIS_URL'])
+    if os.environ.get('RATE_LIMIT_BACKEND', 'memory') == 'redis' else MemoryBuckets(),
+    {**DEFAULT_RATE_LIMITS, **parse_limits(os.environ.get('RATE_LIMITS', ''))},
+    ConcurrencyCaps(
+        global_cap=int(os.environ.get('MAX_IN_FLIGHT', 512)),
+        caps=parse_caps(os.environ.get('CONCURRENCY_CAPS', 'auth=64,search=128,payment=64'))
+    )
+)
+
+def client_identity(scope: dict) -> str:
+    """The user for requests with a valid token, otherwise the client IP."""
+    token = None
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            token = value[7:].decode("latin-1")
+    if token is None:
+        # EventSource passes a stream token in the query string
+        token = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("token", [None])[0]
+    if token:
+        try:
+            return f"user:{token_service.verify(token)['sub']}"
+        except (jwt.InvalidTokenError, KeyError):
+            pass
+    return f"ip:{client_ip(scope, TRUSTED_PROXY_HOPS)}"
+
+# Pagination
+MAX_PAGE_SIZE = 100
+# Search results are ranked by relevance; the regex fallback used while the
+# index builds pages newest first
+SEARCH_SORT = "relevance"
+SEARCH_FALLBACK_SORT = "newest"
+EXPORT_BATCH_SIZE = 1000
+
+# Authenticated-user cache
+user_cache = TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+)
+
+# Payment status push
+order_status_hub = OrderStatusHub()
+payment_status_calls = SingleFlight()
+PAYMENT_STREAM_TIMEOUT_SECONDS = float(os.environ.get('PAYMENT_STREAM_TIMEOUT_SECONDS', 600))
+# The stream re-reads the local transaction this often, in case another
+# worker handled the webhook
+PAYMENT_STREAM_RECHECK_SECONDS = float(os.environ.get('PAYMENT_STREAM_RECHECK_SECONDS', 10))
+# Asks the gateway itself only a few times, at doubling intervals from the
+# first delay, in case the webhook never arrives
+PAYMENT_STREAM_GATEWAY_DELAY_SECONDS = float(os.environ.get('PAYMENT_STREAM_GATEWAY_DELAY_SECONDS', 20))
+PAYMENT_STREAM_GATEWAY_CHECKS = int(os.environ.get('PAYMENT_STREAM_GATEWAY_CHECKS', 3))
+# EventSource cannot send headers, so the stream URL carries a token that
+# is short-lived and only good for one session's stream
+PAYMENT_STREAM_TOKEN_TTL = timedelta(seconds=int(os.environ.get('PAYMENT_STREAM_TOKEN_SECONDS', 120)))
+PAYMENT_STREAM_SCOPE = "payment_stream"
+
+# Unpaid orders hold their stock this long
+RESERVATION_TTL = timedelta(minutes=int(os.environ.get('RESERVATION_TTL_MINUTES', 30)))
+RESERVATION_SWEEP_SECONDS = float(os.environ.get('RESERVATION_SWEEP_SECONDS', 60))
 
-# JWT settings
-JWT_SECRET = os.environ.get('JWT_SECRET_KEY', 'your-secret-key')
-JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
-JWT_EXPIRATION = int(os.environ.get('JWT_EXPIRATION_HOURS', 24))
+# Settled orders older than this move to orders_archive; 0 disables archiving
+ORDER_ARCHIVE_AFTER = timedelta(days=int(os.environ.get('ORDER_ARCHIVE_DAYS', 180)))
+ORDER_ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('ORDER_ARCHIVE_INTERVAL_SECONDS', 3600))
 
-# Stripe setup
-stripe_api_key = os.environ.get('STRIPE_API_KEY')
+# Payment gateway, shared by every request
+payment_gateway = create_gateway()
+PAYMENT_WORKERS = int(os.environ.get('PAYMENT_WORKERS', 1))
 
 # Create the main app
-app = FastAPI(title="Marketplace API")
+app = FastAPI(title="Marketplace API", default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 security = HTTPBearer()
@@ -98,6 +229,40 @@ class Product(BaseModel):
     reviews_count: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ProductCard(BaseModel):
+    """Listing-grid view of a product: no description, only the first image."""
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    title: str
+    price: float
+    image: str = ""
+    category: str
+    stock: int = 0
+    rating: float = 0.0
+    reviews_count: int = 0
+
+class ProductBatchRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=250)
+
+class ProductBatchResponse(BaseModel):
+    products: List[Product]
+    missing: List[str]
+
+class FacetValue(BaseModel):
+    value: str
+    count: int
+
+class FacetBucket(BaseModel):
+    min: float
+    max: Optional[float] = None
+    count: int
+
+class ProductFacets(BaseModel):
+    categories: List[FacetValue]
+    price: List[FacetBucket]
+    rating: List[FacetBucket]
+    total: int
+
 class Category(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -122,7 +287,7 @@ class Cart(BaseModel):
 
 class AddToCartRequest(BaseModel):
     product_id: str
-    quantity: int = 1
+    quantity: int = Field(1, ge=1)
 
 class UpdateCartItemRequest(BaseModel):
     product_id: str
@@ -149,6 +314,19 @@ class Order(BaseModel):
     session_id: str = ""
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class OrderSummary(BaseModel):
+    """Order history row: no line items or address."""
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    created_at: datetime
+    total_amount: float
+    payment_method: str = ""
+    payment_status: str = "pending"
+    status: str = "pending"
+    item_count: int = 0
+    image: str = ""
+    archived: bool = False
+
 class CreateOrderRequest(BaseModel):
     payment_method: str
     shipping_address: ShippingAddress
@@ -165,39 +343,76 @@ class PaymentTransaction(BaseModel):
     user_id: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# Serializers and projections for the read paths
+PRODUCT_PROJECTION = projection_for(Product)
+ORDER_PROJECTION = projection_for(Order)
+ORDER_SUMMARY_PROJECTION = projection_for(OrderSummary)
+PRODUCT_CARD_PROJECTION = {
+    **projection_for(ProductCard),
+    # $arrayElemAt gives null when a product has no images; cards expect a string
+    "image": {"$ifNull": [{"$arrayElemAt": ["$images", 0]}, ""]}
+}
+product_serializer = ModelSerializer(Product)
+product_list_serializer = ModelSerializer(List[Product])
+product_card_list_serializer = ModelSerializer(List[ProductCard])
+category_list_serializer = ModelSerializer(List[Category])
+cart_serializer = ModelSerializer(Cart)
+order_serializer = ModelSerializer(Order)
+order_list_serializer = ModelSerializer(List[Order])
+order_summary_list_serializer = ModelSerializer(List[OrderSummary])
+
 # Helper functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PoolSaturated:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    try:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PoolSaturated:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
 
 def create_access_token(data: dict) -> str:
-    to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION)
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return token_service.issue(data)
 
 def decode_token(token: str) -> dict:
     try:
-        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        return token_service.verify(token)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
-    token = credentials.credentials
+    return await authenticate_token(credentials.credentials)
+
+async def authenticate_token(token: str) -> User:
     payload = decode_token(token)
+    if "scope" in payload:
+        # Scoped tokens (payment streams) are not bearer credentials
+        raise HTTPException(status_code=401, detail="Invalid authentication")
     user_id = payload.get("sub")
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid authentication")
     
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    
     user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
     if not user_doc:
         raise HTTPException(status_code=401, detail="User not found")
     
-    return User(**user_doc)
+    user = User(**user_doc)
+    user_cache.set(user_id, user)
+    return user
+
+async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
 
 # Auth endpoints
 @api_router.post("/auth/register")
@@ -208,15 +423,13 @@ async def register(user_data: UserRegister):
     
     user = User(
         email=user_data.email,
-        password_hash=hash_password(user_data.password),
+        password_hash=await hash_password(user_data.password),
         full_name=user_data.full_name,
         verification_token=str(uuid.uuid4()),
         verified=True  # Auto-verify for demo
     )
     
-    user_dict = user.model_dump()
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
-    await db.users.insert_one(user_dict)
+    await db.users.insert_one(user.model_dump())
     
     token = create_access_token({"sub": user.id, "email": user.email})
     
@@ -245,7 +458,7 @@ async def login(credentials: UserLogin):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     user = User(**user_doc)
-    if not verify_password(credentials.password, user.password_hash):
+    if not await verify_password(credentials.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = create_access_token({"sub": user.id, "email": user.email})
@@ -287,110 +500,219 @@ async def update_profile(update_data: UserUpdate, current_user: User = Depends(g
     update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
     if update_dict:
         await db.users.update_one({"id": current_user.id}, {"$set": update_dict})
+        user_cache.invalidate(current_user.id)
     return {"message": "Profile updated successfully"}
 
+# Admin endpoints
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats(admin: User = Depends(get_admin_user)):
+    return {
+        "users": user_cache.stats(),
+        "tokens": token_service.stats(),
+        "products": product_cache.stats(),
+        "facets": catalog_facets.stats()
+    }
+
+@api_router.get("/admin/rate-limit-stats")
+async def get_rate_limit_stats(admin: User = Depends(get_admin_user)):
+    return rate_limiter.stats()
+
+@api_router.get("/admin/payment-jobs")
+async def get_payment_job_stats(admin: User = Depends(get_admin_user)):
+    return {**payment_jobs.stats(), "backlog": await payment_jobs.backlog()}
+
+@api_router.get("/admin/password-pool-stats")
+async def get_password_pool_stats(admin: User = Depends(get_admin_user)):
+    return password_hasher.stats()
+
+async def export_ndjson(collection, spec: SortSpec):
+    fields = DATETIME_FIELDS.get(collection.name, ())
+    async for doc in iterate_keyset(collection, {}, spec, {"_id": 0}, batch_size=EXPORT_BATCH_SIZE):
+        coerce_datetimes(doc, fields)
+        yield json.dumps(doc, default=lambda value: value.isoformat()) + "\n"
+
+@api_router.get("/admin/export/products")
+async def export_products(admin: User = Depends(get_admin_user)):
+    return StreamingResponse(export_ndjson(db.products, PRODUCT_SORTS["newest"]), media_type="application/x-ndjson")
+
+@api_router.get("/admin/export/orders")
+async def export_orders(admin: User = Depends(get_admin_user)):
+    return StreamingResponse(export_ndjson(db.orders, ORDER_SORTS["newest"]), media_type="application/x-ndjson")
+
 # Product endpoints
-@api_router.get("/products", response_model=List[Product])
-async def get_products(category: Optional[str] = None, search: Optional[str] = None, limit: int = 50):
-    query = {}
-    if category:
-        query["category"] = category
+@api_router.get("/products", response_model=Union[List[Product], List[ProductCard]])
+async def get_products(
+    request: Request,
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    view: str = Query("full", pattern="^(full|card)$")
+):
     if search:
-        query["$or"] = [
-            {"title": {"$regex": search, "$options": "i"}},
-            {"description": {"$regex": search, "$options": "i"}}
-        ]
+        if sort not in (None, SEARCH_SORT):
+            raise HTTPException(status_code=400, detail="Search results are ordered by relevance and cannot be sorted")
+        sort = SEARCH_SORT
+    else:
+        sort = sort or "newest"
+    # Regex fallback results are not cached; they change once the index is built
+    cacheable = not search or search_index.ready
+    params = (view, category, search, sort, cursor, limit)
+    cached = product_cache.get_list(params) if cacheable else None
+    if cached is None:
+        generation = product_cache.generation
+        cached = await fetch_products_page(category, search, sort, cursor, limit, view)
+        if cacheable:
+            product_cache.put_list(params, cached, generation)
+    return conditional_response(request, cached)
+
+async def fetch_products_page(
+    category: Optional[str], search: Optional[str], sort: str, cursor: Optional[str], limit: int, view: str
+) -> CachedBody:
+    if view == "card":
+        projection, serializer = PRODUCT_CARD_PROJECTION, product_card_list_serializer
+    else:
+        projection, serializer = PRODUCT_PROJECTION, product_list_serializer
+    try:
+        # Pages the regex fallback started keep going after the index is
+        # ready, rather than breaking or restarting mid-scroll
+        fallback_cursor = bool(search and cursor) and cursor_sort(cursor) == SEARCH_FALLBACK_SORT
+        if search and search_index.ready and not fallback_cursor:
+            # Relevance-ranked; the cursor is an offset into the ranking
+            offset = decode_cursor(cursor, SEARCH_SORT)[0] if cursor else 0
+            if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+                raise InvalidCursor("Malformed cursor")
+            hits = search_index.search(search, category=category, limit=limit + 1, offset=offset)
+            next_cursor = encode_cursor(SEARCH_SORT, offset + limit, "") if len(hits) > limit else None
+            ranks = {product_id: rank for rank, (product_id, _) in enumerate(hits[:limit])}
+            products = await db.products.find({"id": {"$in": list(ranks)}}, projection).to_list(len(ranks))
+            # Deletes seen without a pre-image leave ids in the index; drop them as they surface
+            for product_id in set(ranks) - {p['id'] for p in products}:
+                search_index.remove(product_id)
+            products.sort(key=lambda p: ranks[p['id']])
+        else:
+            spec = PRODUCT_SORTS.get(SEARCH_FALLBACK_SORT if search else sort)
+            if spec is None:
+                raise HTTPException(status_code=400, detail=f"Unsupported sort, use one of: {', '.join(PRODUCT_SORTS)}")
+            query = {}
+            if category:
+                query["category"] = category
+            if search:
+                # Only used while the search index is still being built
+                pattern = re.escape(search)
+                query["$or"] = [
+                    {"title": {"$regex": pattern, "$options": "i"}},
+                    {"description": {"$regex": pattern, "$options": "i"}}
+                ]
+            # The cursor needs the sort field even when the view omits it
+            products, next_cursor = await fetch_page(
+                db.products, query, spec, limit, cursor, {**projection, spec.field: 1}
+            )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return CachedBody.of(serializer.dumps(products), {"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+@api_router.post("/products/batch", response_model=ProductBatchResponse)
+async def get_products_batch(request: ProductBatchRequest):
+    ids = list(dict.fromkeys(request.ids))
+    bodies = {}
+    for product_id in ids:
+        cached = product_cache.get_product(product_id)
+        if cached is not None:
+            bodies[product_id] = cached.body
+    
+    uncached = [product_id for product_id in ids if product_id not in bodies]
+    if uncached:
+        generation = product_cache.generation
+        products = await db.products.find({"id": {"$in": uncached}}, PRODUCT_PROJECTION).to_list(len(uncached))
+        for product in products:
+            cached = CachedBody.of(product_serializer.dumps(product))
+            bodies[product['id']] = cached.body
+            product_cache.put_product(product['id'], cached, generation)
     
-    products = await db.products.find(query, {"_id": 0}).limit(limit).to_list(limit)
-    for p in products:
-        if isinstance(p.get('created_at'), str):
-            p['created_at'] = datetime.fromisoformat(p['created_at'])
-    return products
+    # Stitch the cached JSON fragments together rather than re-serializing
+    found = [bodies[product_id] for product_id in ids if product_id in bodies]
+    missing = [product_id for product_id in ids if product_id not in bodies]
+    body = b'{"products":[' + b",".join(found) + b'],"missing":' + json.dumps(missing).encode() + b"}"
+    return Response(content=body, media_type="application/json")
+
+@api_router.get("/products/facets", response_model=ProductFacets)
+async def get_product_facets(category: Optional[str] = None, search: Optional[str] = None):
+    if not search:
+        return await (catalog_facets.for_category(category) if category else catalog_facets.summary())
+    match = {}
+    if search and search_index.ready:
+        # The category facet needs hits from every category
+        hits = search_index.search(search, limit=FACET_SEARCH_LIMIT)
+        match["id"] = {"$in": [product_id for product_id, _ in hits]}
+    elif search:
+        pattern = re.escape(search)
+        match["$or"] = [
+            {"title": {"$regex": pattern, "$options": "i"}},
+            {"description": {"$regex": pattern, "$options": "i"}}
+        ]
+    return await catalog_facets.compute(match, category)
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    if isinstance(product.get('created_at'), str):
-        product['created_at'] = datetime.fromisoformat(product['created_at'])
-    return Product(**product)
+async def get_product(product_id: str, request: Request):
+    cached = product_cache.get_product(product_id)
+    if cached is None:
+        generation = product_cache.generation
+        product = await db.products.find_one({"id": product_id}, PRODUCT_PROJECTION)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        cached = CachedBody.of(product_serializer.dumps(product))
+        product_cache.put_product(product_id, cached, generation)
+    return conditional_response(request, cached)
 
 # Categories
 @api_router.get("/categories", response_model=List[Category])
-async def get_categories():
-    categories = await db.categories.find({}, {"_id": 0}).to_list(100)
-    return categories
+async def get_categories(request: Request):
+    cached = product_cache.get_categories()
+    if cached is None:
+        generation = product_cache.generation
+        categories = await db.categories.find({}, projection_for(Category)).to_list(100)
+        cached = CachedBody.of(category_list_serializer.dumps(categories))
+        product_cache.put_categories(cached, generation)
+    return conditional_response(request, cached)
 
 # Cart endpoints
 @api_router.get("/cart", response_model=Cart)
 async def get_cart(current_user: User = Depends(get_current_user)):
-    cart_doc = await db.carts.find_one({"user_id": current_user.id}, {"_id": 0})
-    if not cart_doc:
-        cart = Cart(user_id=current_user.id, items=[])
-        cart_dict = cart.model_dump()
-        cart_dict['updated_at'] = cart_dict['updated_at'].isoformat()
-        await db.carts.insert_one(cart_dict)
-        return cart
-    if isinstance(cart_doc.get('updated_at'), str):
-        cart_doc['updated_at'] = datetime.fromisoformat(cart_doc['updated_at'])
-    return Cart(**cart_doc)
+    cart = Cart(user_id=current_user.id, items=[])
+    cart_doc = await cart_store.get_or_create(db.carts, current_user.id, cart.model_dump())
+    return cart_serializer.response(cart_doc)
 
 @api_router.post("/cart/add")
 async def add_to_cart(request: AddToCartRequest, current_user: User = Depends(get_current_user)):
-    product = await db.products.find_one({"id": request.product_id}, {"_id": 0})
+    product = await db.products.find_one(
+        {"id": request.product_id},
+        {"_id": 0, "id": 1, "title": 1, "price": 1, "images": {"$slice": 1}}
+    )
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    cart_doc = await db.carts.find_one({"user_id": current_user.id}, {"_id": 0})
-    if not cart_doc:
-        cart = Cart(user_id=current_user.id, items=[])
-        cart_doc = cart.model_dump()
-        cart_doc['updated_at'] = cart_doc['updated_at'].isoformat()
-        await db.carts.insert_one(cart_doc)
-    
-    items = cart_doc.get('items', [])
-    existing_item = next((item for item in items if item['product_id'] == request.product_id), None)
-    
-    if existing_item:
-        existing_item['quantity'] += request.quantity
-    else:
-        items.append({
-            "product_id": product['id'],
-            "quantity": request.quantity,
-            "price": product['price'],
-            "title": product['title'],
-            "image": product['images'][0] if product.get('images') else ""
-        })
-    
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$set": {"items": items, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    item = CartItem(
+        product_id=product['id'],
+        quantity=request.quantity,
+        price=product['price'],
+        title=product['title'],
+        image=product['images'][0] if product.get('images') else ""
     )
+    await cart_store.add_item(db.carts, current_user.id, item.model_dump(), utcnow())
     
     return {"message": "Item added to cart"}
 
 @api_router.put("/cart/update")
 async def update_cart_item(request: UpdateCartItemRequest, current_user: User = Depends(get_current_user)):
-    cart_doc = await db.carts.find_one({"user_id": current_user.id})
-    if not cart_doc:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    items = cart_doc.get('items', [])
-    item = next((item for item in items if item['product_id'] == request.product_id), None)
-    
-    if not item:
-        raise HTTPException(status_code=404, detail="Item not in cart")
-    
-    if request.quantity <= 0:
-        items = [item for item in items if item['product_id'] != request.product_id]
-    else:
-        item['quantity'] = request.quantity
-    
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$set": {"items": items, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    updated = await cart_store.set_item_quantity(
+        db.carts, current_user.id, request.product_id, request.quantity, utcnow()
     )
+    if not updated:
+        if not await db.carts.count_documents({"user_id": current_user.id}, limit=1):
+            raise HTTPException(status_code=404, detail="Cart not found")
+        raise HTTPException(status_code=404, detail="Item not in cart")
     
     return {"message": "Cart updated"}
 
@@ -405,24 +727,23 @@ async def remove_from_cart(product_id: str, current_user: User = Depends(get_cur
 # Order endpoints
 @api_router.post("/orders")
 async def create_order(request: CreateOrderRequest, current_user: User = Depends(get_current_user)):
-    cart_doc = await db.carts.find_one({"user_id": current_user.id})
-    if not cart_doc or not cart_doc.get('items'):
-        raise HTTPException(status_code=400, detail="Cart is empty")
-    
-    items = cart_doc.get('items', [])
-    total = sum(item['price'] * item['quantity'] for item in items)
-    
-    order = Order(
-        user_id=current_user.id,
-        items=[CartItem(**item) for item in items],
-        total_amount=total,
-        payment_method=request.payment_method,
-        shipping_address=request.shipping_address
-    )
-    
-    order_dict = order.model_dump()
-    order_dict['created_at'] = order_dict['created_at'].isoformat()
-    await db.orders.insert_one(order_dict)
+    try:
+        items, quantities = await price_cart(db, current_user.id)
+        total = round(sum(item['price'] * item['quantity'] for item in items), 2)
+        
+        order = Order(
+            user_id=current_user.id,
+            items=[CartItem(**item) for item in items],
+            total_amount=total,
+            payment_method=request.payment_method,
+            shipping_address=request.shipping_address
+        )
+        
+        await place_order(db, order.model_dump(), quantities, RESERVATION_TTL)
+    except OrderPlacementError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    for product_id in quantities:
+        await catalog_events.publish(STOCK_CHANGED, product_id)
     
     return {
         "order_id": order.id,
@@ -430,22 +751,43 @@ async def create_order(request: CreateOrderRequest, current_user: User = Depends
         "payment_method": request.payment_method
     }
 
+@api_router.get("/orders/history", response_model=List[OrderSummary])
+async def get_order_history(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    # Covers archived orders too; fetch one with GET /orders/{order_id}
+    try:
+        summaries, next_cursor = await fetch_page(
+            db.order_summaries, {"user_id": current_user.id}, ORDER_SORTS["newest"], limit, cursor, ORDER_SUMMARY_PROJECTION
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return order_summary_list_serializer.response(summaries, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str, current_user: User = Depends(get_current_user)):
-    order = await db.orders.find_one({"id": order_id, "user_id": current_user.id}, {"_id": 0})
+    order = await find_order(db, {"id": order_id, "user_id": current_user.id}, ORDER_PROJECTION)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    if isinstance(order.get('created_at'), str):
-        order['created_at'] = datetime.fromisoformat(order['created_at'])
-    return Order(**order)
+    return order_serializer.response(order)
 
 @api_router.get("/orders", response_model=List[Order])
-async def get_user_orders(current_user: User = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": current_user.id}, {"_id": 0}).to_list(100)
-    for order in orders:
-        if isinstance(order.get('created_at'), str):
-            order['created_at'] = datetime.fromisoformat(order['created_at'])
-    return orders
+async def get_user_orders(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        # Old settled orders live in the archive
+        orders, next_cursor = await fetch_merged_page(
+            [db.orders, db.orders_archive], {"user_id": current_user.id}, ORDER_SORTS["newest"], limit, cursor,
+            ORDER_PROJECTION
+        )
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return order_list_serializer.response(orders, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
 
 # Payment endpoints
 @api_router.post("/payment/create-session")
@@ -457,14 +799,18 @@ async def create_payment_session(
     order_doc = await db.orders.find_one({"id": order_id, "user_id": current_user.id})
     if not order_doc:
         raise HTTPException(status_code=404, detail="Order not found")
+    if order_doc.get('payment_status') != 'pending' or order_doc.get('status') != 'pending':
+        raise HTTPException(status_code=409, detail="Order is not awaiting payment")
+    # The sweep may not have expired it yet
+    reservation_expires_at = order_doc.get('reservation_expires_at')
+    if reservation_expires_at is None or reservation_expires_at <= utcnow():
+        raise HTTPException(status_code=409, detail="Order reservation has expired, please order again")
     
     payment_method = order_doc.get('payment_method')
     total_amount = order_doc.get('total_amount')
     
     if payment_method == 'stripe':
         webhook_url = f"{origin_url}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
-        
         success_url = f"{origin_url}/order-success?session_id={{CHECKOUT_SESSION_ID}}"
         cancel_url = f"{origin_url}/checkout"
         
@@ -476,7 +822,11 @@ async def create_payment_session(
             metadata={"order_id": order_id, "user_id": current_user.id}
         )
         
-        session = await stripe_checkout.create_checkout_session(checkout_request)
+        try:
+            session = await payment_gateway.create_checkout_session(checkout_request, webhook_url)
+        except GatewayError as e:
+            logging.error(f"Error creating checkout session: {e}")
+            raise HTTPException(status_code=502, detail="Payment provider unavailable")
         
         transaction = PaymentTransaction(
             order_id=order_id,
@@ -485,9 +835,7 @@ async def create_payment_session(
             payment_method="stripe",
             user_id=current_user.id
         )
-        transaction_dict = transaction.model_dump()
-        transaction_dict['created_at'] = transaction_dict['created_at'].isoformat()
-        await db.payment_transactions.insert_one(transaction_dict)
+        await db.payment_transactions.insert_one(transaction.model_dump())
         
         await db.orders.update_one(
             {"id": order_id},
@@ -499,6 +847,39 @@ async def create_payment_session(
     else:
         raise HTTPException(status_code=400, detail="Unsupported payment method")
 
+def payment_status_event(status: str, payment_status: str, amount: float, order_id: str) -> dict:
+    return {"status": status, "payment_status": payment_status, "amount": amount, "order_id": order_id}
+
+async def publish_payment(session_id: str, order_id: str, amount: Optional[float]) -> None:
+    order_status_hub.publish(session_id, payment_status_event("complete", "paid", amount, order_id))
+
+# Paid transitions from webhooks and status checks, applied in the background
+payment_jobs = PaymentJobQueue(db, on_paid=publish_payment)
+
+async def recheck_payment_status(session_id: str) -> Optional[dict]:
+    """The paid event if the local transaction shows the payment, without asking the gateway."""
+    transaction = await db.payment_transactions.find_one(
+        {"session_id": session_id}, {"_id": 0, "payment_status": 1, "amount": 1, "order_id": 1}
+    )
+    if not transaction or transaction.get('payment_status') != 'paid':
+        return None
+    return payment_status_event("completed", "paid", transaction.get('amount'), transaction.get('order_id'))
+
+async def refresh_payment_status(session_id: str, order_id: str) -> dict:
+    checkout_status = await payment_gateway.get_checkout_status(session_id)
+    
+    await db.payment_transactions.update_one(
+        {"session_id": session_id},
+        {"$set": {"payment_status": checkout_status.payment_status}}
+    )
+    
+    event = payment_status_event(
+        checkout_status.status, checkout_status.payment_status, checkout_status.amount_total / 100, order_id
+    )
+    if checkout_status.payment_status == "paid":
+        await payment_jobs.enqueue_paid(session_id, order_id)
+    return event
+
 @api_router.get("/payment/status/{session_id}")
 async def check_payment_status(session_id: str, current_user: User = Depends(get_current_user)):
     transaction = await db.payment_transactions.find_one({"session_id": session_id, "user_id": current_user.id})
@@ -506,88 +887,198 @@ async def check_payment_status(session_id: str, current_user: User = Depends(get
         raise HTTPException(status_code=404, detail="Transaction not found")
     
     if transaction.get('payment_status') == 'paid':
-        return {
-            "status": "completed",
-            "payment_status": "paid",
-            "order_id": transaction.get('order_id')
-        }
-    
-    webhook_url = "http://localhost:8001/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+        return payment_status_event("completed", "paid", transaction.get('amount'), transaction.get('order_id'))
     
     try:
-        checkout_status = await stripe_checkout.get_checkout_status(session_id)
-        
-        await db.payment_transactions.update_one(
-            {"session_id": session_id},
-            {"$set": {"payment_status": checkout_status.payment_status}}
+        # Concurrent polls for one session share a single gateway call
+        return await payment_status_calls.do(
+            session_id, lambda: refresh_payment_status(session_id, transaction.get('order_id'))
         )
-        
-        if checkout_status.payment_status == "paid":
-            await db.orders.update_one(
-                {"id": transaction.get('order_id')},
-                {"$set": {"payment_status": "paid", "status": "confirmed"}}
-            )
-            
-            await db.carts.update_one(
-                {"user_id": current_user.id},
-                {"$set": {"items": []}}
-            )
-        
-        return {
-            "status": checkout_status.status,
-            "payment_status": checkout_status.payment_status,
-            "amount": checkout_status.amount_total / 100,
-            "order_id": transaction.get('order_id')
-        }
     except Exception as e:
         logging.error(f"Error checking payment status: {e}")
         raise HTTPException(status_code=500, detail="Failed to check payment status")
 
+@api_router.post("/payment/stream-token/{session_id}")
+async def create_payment_stream_token(session_id: str, current_user: User = Depends(get_current_user)):
+    transaction = await db.payment_transactions.find_one(
+        {"session_id": session_id, "user_id": current_user.id}, {"_id": 0, "session_id": 1}
+    )
+    if not transaction:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    token = token_service.issue(
+        {"sub": current_user.id, "scope": PAYMENT_STREAM_SCOPE, "sid": session_id}, PAYMENT_STREAM_TOKEN_TTL
+    )
+    return {"token": token, "expires_in": int(PAYMENT_STREAM_TOKEN_TTL.total_seconds())}
+
+@api_router.get("/payment/stream/{session_id}")
+async def stream_payment_status(session_id: str, request: Request, token: str = Query(...)):
+    claims = decode_token(token)
+    if claims.get("scope") != PAYMENT_STREAM_SCOPE or claims.get("sid") != session_id:
+        raise HTTPException(status_code=401, detail="Invalid stream token")
+    # Subscribe before reading the transaction so a payment landing in
+    # between is not missed
+    queue = order_status_hub.subscribe(session_id)
+    transaction = await db.payment_transactions.find_one(
+        {"session_id": session_id, "user_id": claims.get("sub")},
+        {"_id": 0, "payment_status": 1, "amount": 1, "order_id": 1}
+    )
+    if not transaction:
+        order_status_hub.unsubscribe(session_id, queue)
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    
+    async def events():
+        try:
+            if transaction.get('payment_status') == 'paid':
+                event = payment_status_event("completed", "paid", transaction.get('amount'), transaction.get('order_id'))
+                yield f"event: status\ndata: {json.dumps(event)}\n\n"
+                return
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + PAYMENT_STREAM_TIMEOUT_SECONDS
+            gateway_delay = PAYMENT_STREAM_GATEWAY_DELAY_SECONDS
+            next_gateway_check = loop.time() + gateway_delay
+            gateway_checks = 0
+            while loop.time() < deadline:
+                if await request.is_disconnected():
+                    return
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=PAYMENT_STREAM_RECHECK_SECONDS)
+                except asyncio.TimeoutError:
+                    event = await recheck_payment_status(session_id)
+                    gateway_due = gateway_checks < PAYMENT_STREAM_GATEWAY_CHECKS and loop.time() >= next_gateway_check
+                    if event is None and gateway_due:
+                        # The webhook may be late or lost: ask the gateway,
+                        # sharing the call with status polls
+                        gateway_checks += 1
+                        gateway_delay *= 2
+                        next_gateway_check = loop.time() + gateway_delay
+                        try:
+                            event = await payment_status_calls.do(
+                                session_id, lambda: refresh_payment_status(session_id, transaction.get('order_id'))
+                            )
+                        except Exception as e:
+                            logging.warning(f"Payment status re-check failed for {session_id}: {e}")
+                    if event is None or (event['payment_status'] != 'paid' and event['status'] != 'expired'):
+                        yield ": keep-alive\n\n"
+                        continue
+                yield f"event: status\ndata: {json.dumps(event)}\n\n"
+                if event['payment_status'] == 'paid' or event['status'] == 'expired':
+                    return
+            yield "event: timeout\ndata: {}\n\n"
+        finally:
+            order_status_hub.unsubscribe(session_id, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
     body = await request.body()
     signature = request.headers.get("Stripe-Signature")
     
     webhook_url = str(request.base_url) + "api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
     
     try:
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        if webhook_response.payment_status == "paid":
-            metadata = webhook_response.metadata
-            order_id = metadata.get('order_id')
-            if order_id:
-                await db.orders.update_one(
-                    {"id": order_id},
-                    {"$set": {"payment_status": "paid", "status": "confirmed"}}
-                )
-                
-                await db.payment_transactions.update_one(
-                    {"session_id": webhook_response.session_id},
-                    {"$set": {"payment_status": "paid"}}
-                )
-        
-        return {"status": "success"}
+        webhook_response = await payment_gateway.handle_webhook(body, signature, webhook_url)
     except Exception as e:
         logging.error(f"Webhook error: {e}")
         raise HTTPException(status_code=400, detail="Webhook verification failed")
+    
+    # Acknowledge as soon as the transition is durably queued; retries of
+    # the same event are deduplicated by the queue. A storage error returns
+    # 500 so Stripe delivers again.
+    order_id = webhook_response.metadata.get('order_id')
+    if webhook_response.payment_status == "paid" and order_id:
+        await payment_jobs.enqueue_paid(webhook_response.session_id, order_id, webhook_response.event_id)
+    
+    return {"status": "success"}
+
+# Scraped by Prometheus; outside /api so the public ingress does not route it
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 # Include the router
 app.include_router(api_router)
 
+# Inside CORS, so 429s and 503s stay readable from the browser
+if RATE_LIMITING:
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter, identify=client_identity)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(CompressionMiddleware)
+# Added first so it runs inside MetricsMiddleware and sees its per-request counts
+app.add_middleware(QueryBudgetMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def provision_indexes():
+    await ensure_indexes(db)
+    await catalog_facets.ensure_summary()
+
+async def sweep_expired_reservations():
+    while True:
+        await asyncio.sleep(RESERVATION_SWEEP_SECONDS)
+        try:
+            expired = await release_expired_reservations(db)
+        except Exception as e:
+            logger.error(f"Reservation sweep failed: {e}")
+            continue
+        for product_ids in expired.values():
+            for product_id in product_ids:
+                await catalog_events.publish(STOCK_CHANGED, product_id)
+        if expired:
+            await expire_payment_sessions(list(expired))
+
+async def expire_payment_sessions(order_ids: List[str]) -> None:
+    """Close the checkout sessions of expired orders so their stock cannot be paid for."""
+    orders = await db.orders.find(
+        {"id": {"$in": order_ids}, "session_id": {"$nin": ["", None]}}, {"_id": 0, "session_id": 1}
+    ).to_list(len(order_ids))
+    for order in orders:
+        try:
+            await payment_gateway.expire_checkout_session(order['session_id'])
+        except GatewayError as e:
+            # Already completed: mark_orders_paid takes the stock again or flags the order
+            logger.warning(f"Could not expire checkout session {order['session_id']}: {e}")
+
+async def archive_settled_orders():
+    while True:
+        try:
+            moved = await archive_orders(db, ORDER_ARCHIVE_AFTER)
+            if moved:
+                logger.info(f"Archived {moved} orders")
+        except Exception as e:
+            logger.error(f"Order archiving failed: {e}")
+        await asyncio.sleep(ORDER_ARCHIVE_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_catalog_services():
+    # Build in the background; searches fall back to regex until it is ready
+    app.state.background_tasks = [
+        asyncio.create_task(search_index.rebuild()),
+        asyncio.create_task(watch_catalog(db, catalog_events, poll_interval=CATALOG_POLL_SECONDS)),
+        asyncio.create_task(sweep_expired_reservations()),
+    ]
+    app.state.background_tasks.extend(asyncio.create_task(payment_jobs.run()) for _ in range(PAYMENT_WORKERS))
+    if ORDER_ARCHIVE_AFTER:
+        app.state.background_tasks.append(asyncio.create_task(archive_settled_orders()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in app.state.background_tasks:
+        task.cancel()
+    password_hasher.shutdown()
+    await payment_gateway.close()
     client.close()
@@ -0,0 +1,112 @@
+"""Access token issuing and verification.
+
+Signing keys are parsed once at startup rather than on every ``jwt.decode``
+call. HS256 uses ``JWT_SECRET_KEY``. Asymmetric algorithms (RS256, ES256,
+EdDSA) sign with the PEM in ``JWT_PRIVATE_KEY_FILE`` and put
+``JWT_SIGNING_KID`` in the token header. They verify against every
+``<kid>.pem`` public key in ``JWT_PUBLIC_KEYS_DIR``. To rotate keys, add the new
+public key, switch the signing key and kid, and delete the old public key
+once tokens signed with it have expired.
+
+Verified tokens are cached with their claims until the token's ``exp``, so a
+client making a burst of calls pays for the signature check once. The cache
+is keyed on the whole token, never the signature alone, so claims always
+come from the exact bytes that were verified.
+"""
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+import jwt
+from jwt.algorithms import get_default_algorithms
+
+from caching import TTLCache
+
+SYMMETRIC_ALGORITHMS = {"HS256", "HS384", "HS512"}
+
+
+class TokenKeys:
+    def __init__(self, algorithm: str, signing_key, verification_keys: Dict[Optional[str], object],
+                 signing_kid: Optional[str] = None):
+        self.algorithm = algorithm
+        self.signing_key = signing_key
+        self.signing_kid = signing_kid
+        self.verification_keys = verification_keys
+
+    @classmethod
+    def symmetric(cls, algorithm: str, secret: str) -> "TokenKeys":
+        return cls(algorithm, secret, {None: secret})
+
+    @classmethod
+    def from_pem(cls, algorithm: str, private_pem: bytes, signing_kid: str,
+                 public_pems: Optional[Dict[str, bytes]] = None) -> "TokenKeys":
+        implementation = get_default_algorithms()[algorithm]
+        private_key = implementation.prepare_key(private_pem)
+        verification_keys = {kid: implementation.prepare_key(pem) for kid, pem in (public_pems or {}).items()}
+        # The current key always verifies, even before its public half is published
+        verification_keys.setdefault(signing_kid, private_key.public_key())
+        return cls(algorithm, private_key, verification_keys, signing_kid)
+
+    @classmethod
+    def from_env(cls) -> "TokenKeys":
+        algorithm = os.environ.get('JWT_ALGORITHM', 'HS256')
+        if algorithm in SYMMETRIC_ALGORITHMS:
+            return cls.symmetric(algorithm, os.environ.get('JWT_SECRET_KEY', 'your-secret-key'))
+        private_pem = Path(os.environ['JWT_PRIVATE_KEY_FILE']).read_bytes()
+        signing_kid = os.environ.get('JWT_SIGNING_KID', 'default')
+        public_pems = {}
+        keys_dir = os.environ.get('JWT_PUBLIC_KEYS_DIR')
+        if keys_dir:
+            public_pems = {path.stem: path.read_bytes() for path in Path(keys_dir).glob("*.pem")}
+        return cls.from_pem(algorithm, private_pem, signing_kid, public_pems)
+
+    def verification_key(self, kid: Optional[str]):
+        key = self.verification_keys.get(kid)
+        if key is None and kid is None and len(self.verification_keys) == 1:
+            # Tokens issued before kids were introduced
+            key = next(iter(self.verification_keys.values()))
+        if key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key {kid!r}")
+        return key
+
+
+class TokenService:
+    def __init__(self, keys: TokenKeys, expiration: timedelta, cache_size: int = 10000,
+                 max_cache_seconds: float = 300.0):
+        self.keys = keys
+        self.expiration = expiration
+        # The cache TTL cap bounds how long a token keeps working after its
+        # key is removed from the verification set
+        self._verified = TTLCache(maxsize=cache_size, ttl=max_cache_seconds)
+        self.verifications = 0
+
+    def issue(self, claims: dict, expiration: Optional[timedelta] = None) -> str:
+        payload = {**claims, "exp": datetime.now(timezone.utc) + (expiration or self.expiration)}
+        headers = {"kid": self.keys.signing_kid} if self.keys.signing_kid else None
+        return jwt.encode(payload, self.keys.signing_key, algorithm=self.keys.algorithm, headers=headers)
+
+    def verify(self, token: str) -> dict:
+        """Return the token's claims; raises ``jwt.ExpiredSignatureError`` or ``jwt.InvalidTokenError``."""
+        claims = self._verified.get(token)
+        if claims is not None:
+            if claims["exp"] > time.time():
+                return claims
+            self._verified.invalidate(token)
+
+        self.verifications += 1
+        kid = jwt.get_unverified_header(token).get("kid")
+        claims = jwt.decode(
+            token,
+            self.keys.verification_key(kid),
+            algorithms=[self.keys.algorithm],
+            options={"require": ["exp"]},
+        )
+        remaining = claims["exp"] - time.time()
+        if remaining > 0:
+            self._verified.set(token, claims, min(remaining, self._verified.ttl))
+        return claims
+
+    def stats(self) -> dict:
+        return {**self._verified.stats(), "verifications": self.verifications}
@@ -35,7 +35,7 @@ const Home = () => {
   const fetchProducts = async () => {
     setLoading(true);
     try {
-      const params = {};
+      const params = { view: 'card' };
       if (selectedCategory) params.category = selectedCategory;
       if (searchQuery) params.search = searchQuery;
       
@@ -120,7 +120,7 @@ const Home = () => {
                   data-testid={`product-card-${product.id}`}
                 >
                   <div className="product-image">
-                    <img src={product.images[0]} alt={product.title} />
+                    <img src={product.image} alt={product.title} />
                   </div>
                   <div className="product-info">
                     <h3 className="product-title">{product.title}</h3>
@@ -14,11 +14,61 @@ const OrderSuccess = () => {
 
   useEffect(() => {
     const sessionId = searchParams.get('session_id');
-    if (sessionId) {
-      pollPaymentStatus(sessionId);
-    } else {
+    if (!sessionId) {
       navigate('/');
+      return;
+    }
+    if (!window.EventSource) {
+      pollPaymentStatus(sessionId);
+      return;
     }
+
+    // The server pushes one event when the payment completes. EventSource
+    // cannot send headers, so the URL carries a short-lived token that only
+    // opens this session's stream, never the login token.
+    let source = null;
+    let cancelled = false;
+    const openStream = async () => {
+      let streamToken;
+      try {
+        const token = localStorage.getItem('token');
+        const response = await axios.post(`${API}/payment/stream-token/${sessionId}`, null, {
+          headers: { Authorization: `Bearer ${token}` }
+        });
+        streamToken = response.data.token;
+      } catch (error) {
+        if (!cancelled) pollPaymentStatus(sessionId);
+        return;
+      }
+      if (cancelled) return;
+      source = new EventSource(
+        `${API}/payment/stream/${sessionId}?token=${encodeURIComponent(streamToken)}`
+      );
+      source.addEventListener('status', (event) => {
+        const data = JSON.parse(event.data);
+        if (data.payment_status === 'paid') {
+          setPaymentStatus(data);
+          setChecking(false);
+          source.close();
+        } else if (data.status === 'expired') {
+          source.close();
+          setChecking(false);
+        }
+      });
+      source.addEventListener('timeout', () => {
+        source.close();
+        setChecking(false);
+      });
+      source.onerror = () => {
+        source.close();
+        pollPaymentStatus(sessionId);
+      };
+    };
+    openStream();
+    return () => {
+      cancelled = true;
+      if (source) source.close();
+    };
   }, [searchParams]);
 
   const pollPaymentStatus = async (sessionId, attempts = 0) => {
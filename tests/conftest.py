@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# The backend is a flat set of modules imported from its own directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# query_counter fixture
+pytest_plugins = ["query_budget"]
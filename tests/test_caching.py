@@ -0,0 +1,36 @@
+from caching import ByteLRUCache
+
+
+class Body:
+    """A value that grows in place, like a CachedBody gaining compressed variants."""
+
+    def __init__(self, size):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+
+def test_recount_charges_growth_and_evicts():
+    cache = ByteLRUCache(max_bytes=100)
+    first, second = Body(40), Body(40)
+    cache.set("first", first)
+    cache.set("second", second)
+    assert cache.current_bytes == 80
+
+    second.size = 70
+    cache.recount("second")
+    assert cache.get("first") is None
+    assert cache.current_bytes == 70
+
+
+def test_grown_value_is_released_by_its_charge():
+    cache = ByteLRUCache(max_bytes=100)
+    body = Body(10)
+    cache.set("key", body)
+    body.size = 30
+    cache.invalidate("key")
+    assert cache.current_bytes == 0
+
+    cache.recount("key")
+    assert cache.current_bytes == 0
@@ -0,0 +1,57 @@
+"""Cart writes against a real MongoDB; skipped when none is reachable."""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+motor_asyncio = pytest.importorskip("motor.motor_asyncio")
+pytest.importorskip("dotenv")
+
+import cart_store  # noqa: E402
+from benchmarks import cart_stress  # noqa: E402
+from benchmarks.common import BENCH_DB_NAME  # noqa: E402
+from metrics import MongoCommandListener  # noqa: E402
+
+
+async def _reachable(url: str) -> bool:
+    client = motor_asyncio.AsyncIOMotorClient(url, serverSelectionTimeoutMS=1000)
+    try:
+        await client.admin.command("ping")
+        return True
+    except Exception:
+        return False
+    finally:
+        client.close()
+
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("MONGO_URL") or not asyncio.run(_reachable(os.environ["MONGO_URL"])),
+    reason="needs MongoDB at MONGO_URL",
+)
+
+
+def test_concurrent_adds_lose_no_quantity():
+    assert asyncio.run(cart_stress.run(adds=300, product_count=5, legacy=False))
+
+
+def test_add_item_is_one_round_trip(query_counter):
+    async def add():
+        client = motor_asyncio.AsyncIOMotorClient(os.environ["MONGO_URL"], event_listeners=[MongoCommandListener()])
+        carts = client[BENCH_DB_NAME].cart_store_test
+        user_id = str(uuid.uuid4())
+        item = {"product_id": "p1", "quantity": 2, "price": 9.99, "title": "P1", "image": ""}
+        try:
+            await cart_store.add_item(carts, user_id, item, datetime.now(timezone.utc))
+            query_counter.assert_within(1, "first add")
+            await cart_store.add_item(carts, user_id, item, datetime.now(timezone.utc))
+            query_counter.assert_within(2, "second add")
+            cart = await carts.find_one({"user_id": user_id})
+        finally:
+            await carts.drop()
+            client.close()
+        return cart
+
+    cart = asyncio.run(add())
+    assert [(line["product_id"], line["quantity"]) for line in cart["items"]] == [("p1", 4)]
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+import catalog_events
+from catalog_events import CATALOG_RELOADED, PRODUCT_CHANGED, PRODUCT_DELETED, CatalogEvents, watch_catalog
+
+
+class Stream:
+    def __init__(self, changes, then=None):
+        self.changes = changes
+        self.then = then
+        self.resume_token = {"_data": "open"}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for change in self.changes:
+            self.resume_token = change["_id"]
+            yield change
+        if self.then is not None:
+            raise self.then
+        await asyncio.Event().wait()
+
+
+class Database:
+    """``watch`` hands out the given streams in turn, or raises the given errors."""
+
+    def __init__(self, *outcomes, pre_images=True):
+        self.outcomes = list(outcomes)
+        self.pre_images = pre_images
+        self.calls = []
+
+    def watch(self, pipeline, **options):
+        self.calls.append(options)
+        if "full_document_before_change" in options and not self.pre_images:
+            # What MongoDB 5.0 answers
+            raise OperationFailure("BSON field '$changeStream.fullDocumentBeforeChange' is an unknown field.", 40415)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def change(n, operation="update", **fields):
+    return {"_id": {"_data": f"t{n}"}, "operationType": operation, "ns": {"coll": "products"},
+            "documentKey": {"_id": f"oid{n}"}, **fields}
+
+
+def follow(db, seconds=0.05):
+    events = CatalogEvents()
+    received = []
+
+    async def listener(event):
+        received.append(event)
+
+    events.subscribe(listener)
+
+    async def run():
+        task = asyncio.create_task(watch_catalog(db, events, poll_interval=60, max_backoff=0.01))
+        await asyncio.sleep(seconds)
+        task.cancel()
+
+    asyncio.run(run())
+    return received, events
+
+
+def test_server_without_pre_images_still_streams(caplog):
+    db = Database(Stream([change(1, fullDocument={"id": "p1", "title": "Lamp"})]), pre_images=False)
+    with caplog.at_level(logging.WARNING):
+        received, events = follow(db)
+    assert [(event.kind, event.product_id) for event in received] == [(PRODUCT_CHANGED, "p1")]
+    assert "full_document_before_change" not in db.calls[-1]
+    assert events.streaming
+    assert "rejected pre-images" in caplog.text and "unknown field" in caplog.text
+
+
+def test_server_without_change_streams_polls(monkeypatch):
+    polled = []
+
+    async def poll(db, events, interval):
+        polled.append(interval)
+
+    monkeypatch.setattr(catalog_events, "_poll_catalog_version", poll)
+    not_replica_set = OperationFailure("The $changeStream stage is only supported on replica sets", 40573)
+    db = Database(not_replica_set, not_replica_set)
+    received, events = follow(db)
+    assert polled == [60]
+    assert len(db.calls) == 2
+    assert not events.streaming
+
+
+def test_delete_without_pre_image_is_not_a_reload():
+    db = Database(Stream([change(1, "delete")]))
+    received, _ = follow(db)
+    assert [event.kind for event in received] == [PRODUCT_DELETED]
+    assert received[0].document_key == {"_id": "oid1"}
+
+
+def test_stream_resumes_after_errors():
+    first = Stream([change(1, fullDocument={"id": "p1"})], then=PyMongoError("connection reset"))
+    lost = OperationFailure("resume point no longer in the oplog", 286)
+    db = Database(first, Stream([], then=lost), Stream([change(2, fullDocument={"id": "p2"})]))
+    received, _ = follow(db, seconds=0.2)
+    assert [call["resume_after"] for call in db.calls] == [None, {"_data": "t1"}, None]
+    assert [(event.kind, event.product_id) for event in received] == [
+        (PRODUCT_CHANGED, "p1"), (CATALOG_RELOADED, None), (PRODUCT_CHANGED, "p2"),
+    ]
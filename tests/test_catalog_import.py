@@ -0,0 +1,112 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from catalog_import import CatalogImporter, ImportAborted
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return list(self.docs)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class Collection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.writes = 0
+
+    async def index_information(self):
+        return {}
+
+    async def create_indexes(self, models):
+        pass
+
+    def find(self, query=None, projection=None):
+        return Cursor([])
+
+    async def bulk_write(self, ops, ordered=True):
+        self.writes += len(ops)
+        return SimpleNamespace(upserted_count=len(ops), modified_count=0)
+
+    async def update_one(self, query, update, upsert=False):
+        pass
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        return {"version": 1}
+
+    async def rename(self, name, dropTarget=False):
+        self.db.renamed.append((self.name, name))
+
+    async def drop(self):
+        self.db.dropped.append(self.name)
+
+
+class Database:
+    def __init__(self):
+        self.collections = {}
+        self.renamed = []
+        self.dropped = []
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = Collection(self, name)
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def row(n, **overrides):
+    return {"sku": f"SKU-{n}", "title": f"Product {n}", "category": "Books", "price": "9.99", **overrides}
+
+
+def run(db, rows, **options):
+    return asyncio.run(CatalogImporter(db, progress=False, **options).run(rows))
+
+
+def test_good_file_replaces_catalog():
+    db = Database()
+    report = run(db, [row(n) for n in range(20)])
+    assert report.upserted == 20
+    assert [target for _, target in db.renamed] == ["products"]
+    assert db.dropped == []
+
+
+def test_wrong_header_leaves_catalog_alone():
+    db = Database()
+    # Every row lacks the columns the importer needs
+    rows = [{"SKU": f"SKU-{n}", "Name": f"Product {n}", "Price": "9.99"} for n in range(20)]
+    with pytest.raises(ImportAborted, match="No products imported") as aborted:
+        run(db, rows)
+    assert aborted.value.report.rejected == 20
+    assert db.renamed == []
+    assert len(db.dropped) == 1 and db.dropped[0].startswith("products_import_")
+
+
+def test_too_many_rejected_rows_abort():
+    db = Database()
+    rows = [row(n) if n % 4 else row(n, price="n/a") for n in range(20)]
+    with pytest.raises(ImportAborted, match="5 of 20 rows rejected"):
+        run(db, rows, max_reject_ratio=0.1)
+    assert db.renamed == []
+    assert len(db.dropped) == 1
+
+
+def test_rejections_within_limit_still_swap():
+    db = Database()
+    rows = [row(n) if n % 4 else row(n, price="n/a") for n in range(20)]
+    report = run(db, rows, max_reject_ratio=0.5)
+    assert (report.upserted, report.rejected) == (15, 5)
+    assert [target for _, target in db.renamed] == ["products"]
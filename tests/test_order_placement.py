@@ -0,0 +1,200 @@
+import asyncio
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from dates import utcnow
+from order_placement import (
+    NEEDS_REVIEW,
+    OrderPlacementError,
+    mark_orders_paid,
+    release_expired_reservations,
+    reserve_stock,
+)
+
+
+def _value(doc, path):
+    for part in path.split("."):
+        if isinstance(doc, list):
+            return [item.get(part) for item in doc]
+        doc = (doc or {}).get(part)
+    return doc
+
+
+def _compare(value, op, operand):
+    values = value if isinstance(value, list) else [value]
+    if op == "$in":
+        return any(v in operand for v in values)
+    if op == "$ne":
+        return operand not in values
+    if op == "$gte":
+        return value is not None and value >= operand
+    if op == "$lt":
+        return value is not None and value < operand
+    raise NotImplementedError(op)
+
+
+def matches(doc, query):
+    for path, condition in query.items():
+        value = _value(doc, path)
+        if isinstance(condition, dict):
+            if not all(_compare(value, op, operand) for op, operand in condition.items()):
+                return False
+        elif condition not in (value if isinstance(value, list) else [value]):
+            return False
+    return True
+
+
+def apply(doc, update):
+    for field, value in update.get("$set", {}).items():
+        doc[field] = value
+    for field in update.get("$unset", {}):
+        doc.pop(field, None)
+    for field, value in update.get("$inc", {}).items():
+        doc[field] = doc.get(field, 0) + value
+    for field, value in update.get("$push", {}).items():
+        doc.setdefault(field, []).append(value)
+    for field, condition in update.get("$pull", {}).items():
+        doc[field] = [item for item in doc.get(field, []) if not matches(item, condition)]
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def limit(self, n):
+        return Cursor(self.docs[:n])
+
+    async def to_list(self, length):
+        return [dict(doc) for doc in self.docs]
+
+
+class Collection:
+    def __init__(self, docs=()):
+        self.docs = [dict(doc) for doc in docs]
+        self.fail_after = None
+
+    def get(self, doc_id):
+        return next(doc for doc in self.docs if doc["id"] == doc_id)
+
+    def find(self, query, projection=None):
+        return Cursor([doc for doc in self.docs if matches(doc, query)])
+
+    async def _update(self, query, update, many):
+        matched = [doc for doc in self.docs if matches(doc, query)]
+        if not many:
+            matched = matched[:1]
+        for doc in matched:
+            apply(doc, update)
+        return SimpleNamespace(matched_count=len(matched), modified_count=len(matched))
+
+    async def update_one(self, query, update):
+        return await self._update(query, update, many=False)
+
+    async def update_many(self, query, update):
+        return await self._update(query, update, many=True)
+
+    async def bulk_write(self, ops, ordered=True):
+        modified = 0
+        for n, op in enumerate(ops):
+            if n == self.fail_after:
+                self.fail_after = None
+                raise BulkWriteError({"writeErrors": [{"index": n}], "nModified": modified})
+            modified += (await self.update_one(op._filter, op._doc)).modified_count
+        return SimpleNamespace(modified_count=modified)
+
+
+def database(products, orders=(), archived=()):
+    return SimpleNamespace(
+        products=Collection(products),
+        orders=Collection(orders),
+        orders_archive=Collection(archived),
+        order_summaries=Collection([{"id": order["id"]} for order in [*orders, *archived]]),
+    )
+
+
+def product(pid, stock, reservations=()):
+    return {"id": pid, "stock": stock, "reservations": list(reservations)}
+
+
+def order(order_id, status="pending", **fields):
+    items = [{"product_id": "p1", "quantity": 2}, {"product_id": "p2", "quantity": 1}]
+    return {"id": order_id, "status": status, "payment_status": "pending", "items": items, **fields}
+
+
+def test_reserve_takes_every_line():
+    products = Collection([product("p1", 5), product("p2", 1)])
+    asyncio.run(reserve_stock(products, "o1", {"p1": 2, "p2": 1}))
+    assert [p["stock"] for p in products.docs] == [3, 0]
+    assert products.get("p1")["reservations"] == [{"order_id": "o1", "quantity": 2}]
+
+
+def test_reserve_short_line_takes_nothing():
+    products = Collection([product("p1", 5), product("p2", 0)])
+    with pytest.raises(OrderPlacementError) as e:
+        asyncio.run(reserve_stock(products, "o1", {"p1": 2, "p2": 1}))
+    assert e.value.status_code == 409
+    assert [(p["stock"], p["reservations"]) for p in products.docs] == [(5, []), (0, [])]
+
+
+def test_reserve_write_error_releases_applied_lines():
+    products = Collection([product("p1", 5), product("p2", 1)])
+    products.fail_after = 1
+    with pytest.raises(BulkWriteError):
+        asyncio.run(reserve_stock(products, "o1", {"p1": 2, "p2": 1}))
+    assert [(p["stock"], p["reservations"]) for p in products.docs] == [(5, []), (1, [])]
+
+
+def test_sweep_expires_unpaid_orders_and_returns_stock():
+    past = utcnow() - timedelta(minutes=1)
+    held = [{"order_id": "o1", "quantity": 2}]
+    db = database(
+        [product("p1", 3, held), product("p2", 0, [{"order_id": "o1", "quantity": 1}])],
+        [
+            order("o1", reservation_expires_at=past),
+            order("o2", reservation_expires_at=utcnow() + timedelta(minutes=5)),
+            order("o3", payment_status="paid", reservation_expires_at=past),
+        ],
+    )
+    assert asyncio.run(release_expired_reservations(db)) == {"o1": ["p1", "p2"]}
+    assert [(p["stock"], p["reservations"]) for p in db.products.docs] == [(5, []), (1, [])]
+    assert db.orders.get("o1")["status"] == "expired"
+    assert db.orders.get("o2")["status"] == "pending"
+    assert db.orders.get("o3")["status"] == "pending"
+    assert db.order_summaries.get("o1")["status"] == "expired"
+
+
+def test_payment_confirms_order_and_keeps_stock():
+    db = database(
+        [product("p1", 3, [{"order_id": "o1", "quantity": 2}]), product("p2", 0, [{"order_id": "o1", "quantity": 1}])],
+        [order("o1", reservation_expires_at=utcnow())],
+    )
+    asyncio.run(mark_orders_paid(db, ["o1"]))
+    assert db.orders.get("o1")["status"] == "confirmed"
+    assert "reservation_expires_at" not in db.orders.get("o1")
+    assert [(p["stock"], p["reservations"]) for p in db.products.docs] == [(3, []), (0, [])]
+
+
+def test_late_payment_takes_stock_again():
+    db = database([product("p1", 5), product("p2", 1)], [order("o1", status="expired")])
+    asyncio.run(mark_orders_paid(db, ["o1"]))
+    assert db.orders.get("o1")["status"] == "confirmed"
+    assert [(p["stock"], p["reservations"]) for p in db.products.docs] == [(3, []), (0, [])]
+
+
+def test_late_payment_without_stock_is_flagged_for_review():
+    db = database([product("p1", 5), product("p2", 0)], [order("o1", status="expired"), order("o2")])
+    asyncio.run(mark_orders_paid(db, ["o1", "o2"]))
+    assert (db.orders.get("o1")["status"], db.orders.get("o1")["payment_status"]) == (NEEDS_REVIEW, "paid")
+    assert db.order_summaries.get("o1")["status"] == NEEDS_REVIEW
+    assert db.orders.get("o2")["status"] == "confirmed"
+    assert [p["stock"] for p in db.products.docs] == [5, 0]
+
+
+def test_late_payment_on_archived_order():
+    db = database([product("p1", 1), product("p2", 1)], archived=[order("o1", status="expired")])
+    asyncio.run(mark_orders_paid(db, ["o1"]))
+    assert db.orders_archive.get("o1")["status"] == NEEDS_REVIEW
+    assert [p["stock"] for p in db.products.docs] == [1, 1]
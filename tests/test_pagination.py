@@ -0,0 +1,112 @@
+import asyncio
+import base64
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from pagination import ORDER_SORTS, InvalidCursor, cursor_sort, decode_cursor, encode_cursor, fetch_merged_page
+
+
+def forge(*parts) -> str:
+    raw = json.dumps(list(parts)).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("value", [
+    19.99,
+    42,
+    "Lamp",
+    None,
+    datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc),
+])
+def test_round_trip(value):
+    assert decode_cursor(encode_cursor("newest", value, "p-1"), "newest") == (value, "p-1")
+
+
+def test_rejects_other_sort():
+    with pytest.raises(InvalidCursor, match="different sort"):
+        decode_cursor(encode_cursor("price_asc", 10, "p-1"), "newest")
+
+
+def test_cursor_sort():
+    assert cursor_sort(encode_cursor("relevance", 50, "")) == "relevance"
+    assert cursor_sort(encode_cursor("newest", None, "p-1")) == "newest"
+    with pytest.raises(InvalidCursor):
+        cursor_sort(forge(["newest"], 1, "p-1"))
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    forge("newest", 1),
+    forge("newest", {"$gt": ""}, "p-1"),
+    forge("newest", {"$ne": None}, "p-1"),
+    forge("newest", {"$dt": "2024-05-01", "$ne": None}, "p-1"),
+    forge("newest", {"$dt": "yesterday"}, "p-1"),
+    forge("newest", {"$dt": 5}, "p-1"),
+    forge("newest", [1, 2], "p-1"),
+    forge("newest", 1, {"$gt": ""}),
+    forge("newest", 1, None),
+    forge(["newest"], 1, "p-1"),
+])
+def test_rejects_forged_cursors(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, "newest")
+
+
+class FakeCollection:
+    """Enough of a Motor collection for fetch_page: equality and keyset filters, one sort."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        self._matched = [doc for doc in self.docs if matches(doc, query)]
+        return self
+
+    def sort(self, keys):
+        for field, direction in reversed(keys):
+            self._matched.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self._matched = self._matched[:n]
+        return self
+
+    async def to_list(self, n):
+        return self._matched[:n]
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(doc, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, part) for part in condition):
+                return False
+        elif isinstance(condition, dict):
+            (op, value), = condition.items()
+            if not (doc[key] > value if op == "$gt" else doc[key] < value):
+                return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+
+def test_merged_pages_interleave_collections():
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    orders = [{"id": f"o-{n:02d}", "user_id": "u", "created_at": start.replace(day=n)} for n in range(1, 21)]
+    # Old settled orders are archived, but an old pending one stays hot
+    hot = FakeCollection([order for n, order in enumerate(orders, 1) if n > 12 or n == 3])
+    archive = FakeCollection([order for n, order in enumerate(orders, 1) if n <= 12 and n != 3])
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = asyncio.run(
+            fetch_merged_page([hot, archive], {"user_id": "u"}, ORDER_SORTS["newest"], 6, cursor)
+        )
+        seen += [order["id"] for order in page]
+        if cursor is None:
+            break
+    assert seen == [order["id"] for order in reversed(orders)]
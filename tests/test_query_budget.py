@@ -0,0 +1,121 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from metrics import MongoCommandListener, RequestStats, current_request
+from query_budget import QueryBudgetExceeded, count_queries
+
+
+def run_command(listener, name, collection, request_id):
+    """Feed the listener a command's start and success, as the driver would."""
+    started = SimpleNamespace(command_name=name, command={name: collection}, connection_id=1, request_id=request_id)
+    listener.started(started)
+    listener.succeeded(SimpleNamespace(command_name=name, connection_id=1, request_id=request_id,
+                                       duration_micros=1500))
+
+
+def test_query_counter_counts_commands_in_the_test(query_counter):
+    listener = MongoCommandListener()
+    run_command(listener, "find", "carts", 1)
+    run_command(listener, "update", "carts", 2)
+    assert query_counter.count == 2
+    assert query_counter.commands == ["find carts", "update carts"]
+    query_counter.assert_within(2)
+    with pytest.raises(QueryBudgetExceeded, match="issued 2 Mongo commands"):
+        query_counter.assert_within(1)
+
+
+def test_query_counter_sees_commands_of_tasks_it_starts(query_counter):
+    listener = MongoCommandListener()
+
+    async def handler():
+        # A request in the block gets its own stats, which charge the block too
+        stats = RequestStats(route="/api/cart", parent=current_request.get())
+        current_request.set(stats)
+        run_command(listener, "find", "carts", 1)
+        await asyncio.sleep(0)
+        run_command(listener, "find", "products", 2)
+        return stats
+
+    stats = asyncio.run(handler())
+    assert stats.mongo_commands == 2
+    assert query_counter.count == 2
+
+
+def test_count_queries_enforces_budget():
+    listener = MongoCommandListener()
+    with count_queries(budget=1) as counter:
+        run_command(listener, "find", "users", 1)
+    assert counter.count == 1
+
+    with pytest.raises(QueryBudgetExceeded):
+        with count_queries(budget=1):
+            run_command(listener, "find", "users", 2)
+            run_command(listener, "find", "users", 3)
+
+
+def test_commands_outside_a_block_are_not_counted():
+    listener = MongoCommandListener()
+    run_command(listener, "find", "users", 1)
+    with count_queries() as counter:
+        pass
+    assert counter.count == 0
+
+
+class Recorded:
+    """A collection stand-in that reports each call as the command listener would."""
+
+    def __init__(self, name, find_one_results=()):
+        self.name = name
+        self.find_one_results = list(find_one_results)
+
+    def _record(self, command):
+        current_request.get().record(f"{command} {self.name}", 0.001)
+
+    def find(self, query, projection=None):
+        return self
+
+    def aggregate(self, pipeline):
+        return self
+
+    def sort(self, keys):
+        return self
+
+    def limit(self, n):
+        return self
+
+    async def to_list(self, n):
+        self._record("find")
+        return []
+
+    async def find_one(self, query, projection=None):
+        self._record("find")
+        return self.find_one_results.pop(0) if self.find_one_results else None
+
+    async def update_one(self, query, update, upsert=False):
+        self._record("update")
+
+
+def test_orders_page_fits_route_budget():
+    from pagination import ORDER_SORTS, fetch_merged_page
+    from query_budget import ROUTE_BUDGETS
+
+    users = Recorded("users")
+    with count_queries(budget=ROUTE_BUDGETS[("GET", "/api/orders")]):
+        # get_current_user on a user-cache miss, then the page itself
+        asyncio.run(users.find_one({"id": "u"}))
+        asyncio.run(fetch_merged_page(
+            [Recorded("orders"), Recorded("orders_archive")], {"user_id": "u"}, ORDER_SORTS["newest"], 20
+        ))
+
+
+@pytest.mark.parametrize("category", [None, "Books"])
+def test_cold_facets_fit_route_budget(category):
+    from facets import CatalogFacets
+    from query_budget import ROUTE_BUDGETS
+
+    facets = CatalogFacets(Recorded("products"), Recorded("catalog_facets", [None, {}]))
+    with count_queries(budget=ROUTE_BUDGETS[("GET", "/api/products/facets")]) as counter:
+        asyncio.run(facets.for_category(category) if category else facets.summary())
+    assert counter.count == (5 if category else 4)
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+import rate_limit
+from rate_limit import ConcurrencyCaps, Limit, MemoryBuckets, classify, client_ip, parse_caps, parse_limits
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def take(buckets, key, limit, cost=1.0):
+    return asyncio.run(buckets.take(key, limit, cost))
+
+
+def test_bucket_allows_burst_then_waits(clock):
+    buckets = MemoryBuckets()
+    limit = Limit(rate=2, burst=3)
+    assert [take(buckets, "a", limit) for _ in range(3)] == [0, 0, 0]
+    assert take(buckets, "a", limit) == pytest.approx(0.5)
+
+
+def test_bucket_refills_at_rate_up_to_burst(clock):
+    buckets = MemoryBuckets()
+    limit = Limit(rate=2, burst=3)
+    for _ in range(3):
+        take(buckets, "a", limit)
+    clock.now += 1
+    assert [take(buckets, "a", limit) for _ in range(2)] == [0, 0]
+    assert take(buckets, "a", limit) > 0
+
+    clock.now += 60
+    assert [take(buckets, "a", limit) for _ in range(3)] == [0, 0, 0]
+    assert take(buckets, "a", limit) > 0
+
+
+def test_rejected_request_costs_nothing(clock):
+    buckets = MemoryBuckets()
+    limit = Limit(rate=1, burst=1)
+    take(buckets, "a", limit)
+    for _ in range(5):
+        assert take(buckets, "a", limit) == pytest.approx(1)
+    clock.now += 1
+    assert take(buckets, "a", limit) == 0
+
+
+def test_buckets_are_per_key_and_bounded(clock):
+    buckets = MemoryBuckets(max_keys=2)
+    limit = Limit(rate=1, burst=1)
+    take(buckets, "a", limit)
+    assert take(buckets, "b", limit) == 0
+    take(buckets, "c", limit)
+    assert len(buckets) == 2
+    # "a" was the least recently used, so it starts over with a full bucket
+    assert take(buckets, "a", limit) == 0
+
+
+@pytest.mark.parametrize("method, path, query, expected", [
+    ("POST", "/api/auth/login", b"", "auth"),
+    ("POST", "/api/auth/register", b"", "auth"),
+    ("GET", "/api/auth/me", b"", "default"),
+    ("GET", "/api/products", b"search=lamp", "search"),
+    ("GET", "/api/products/facets", b"search=lamp&category=Books", "search"),
+    ("GET", "/api/products", b"category=Books", "default"),
+    ("GET", "/api/payment/stream/cs_1", b"", "stream"),
+    ("POST", "/api/payment/create-session", b"order_id=1", "payment"),
+    ("GET", "/api/payment/status/cs_1", b"", "payment"),
+    ("POST", "/api/webhook/stripe", b"", None),
+    ("GET", "/health", b"", None),
+])
+def test_classify(method, path, query, expected):
+    assert classify(method, path, query) == expected
+
+
+def test_global_cap_sheds_and_release_frees():
+    caps = ConcurrencyCaps(global_cap=2, caps={})
+    assert caps.try_acquire("default") is None
+    assert caps.try_acquire("search") is None
+    assert caps.try_acquire("auth") == "global"
+    caps.release("search")
+    assert caps.try_acquire("auth") is None
+    assert caps.total == 2
+
+
+def test_class_cap_leaves_other_classes_alone():
+    caps = ConcurrencyCaps(global_cap=10, caps={"search": 1})
+    assert caps.try_acquire("search") is None
+    assert caps.try_acquire("search") == "search"
+    assert caps.try_acquire("default") is None
+    assert caps.in_flight == {"search": 1, "default": 1}
+
+
+def test_streams_skip_the_global_cap():
+    caps = ConcurrencyCaps(global_cap=1, caps={"stream": 2})
+    assert caps.try_acquire("default") is None
+    assert caps.try_acquire("stream") is None
+    assert caps.try_acquire("stream") is None
+    assert caps.try_acquire("stream") == "stream"
+    assert caps.total == 1
+    caps.release("stream")
+    assert caps.total == 1
+    assert caps.in_flight["stream"] == 1
+
+
+def test_parse_limits():
+    assert parse_limits(" auth=0.2/10, search=5 ,") == {"auth": Limit(0.2, 10), "search": Limit(5, 5)}
+    assert parse_limits("") == {}
+
+
+def test_parse_caps():
+    assert parse_caps("auth=8, search=16") == {"auth": 8, "search": 16}
+
+
+def scope(peer="10.0.0.1", *forwarded):
+    return {"client": (peer, 443), "headers": [(b"x-forwarded-for", value.encode()) for value in forwarded]}
+
+
+def test_client_ip_ignores_forwarded_for_by_default():
+    assert client_ip(scope("10.0.0.1", "203.0.113.9")) == "10.0.0.1"
+    assert client_ip({"headers": []}) == "unknown"
+
+
+@pytest.mark.parametrize("forwarded, hops, expected", [
+    (["198.51.100.7"], 1, "198.51.100.7"),
+    # The client wrote the leftmost entry; the proxy appended the real address
+    (["1.2.3.4, 198.51.100.7"], 1, "198.51.100.7"),
+    (["1.2.3.4, 198.51.100.7, 10.0.0.5"], 2, "198.51.100.7"),
+    (["1.2.3.4", "198.51.100.7, 10.0.0.5"], 2, "198.51.100.7"),
+    (["198.51.100.7"], 2, "198.51.100.7"),
+])
+def test_client_ip_counts_trusted_hops_from_the_right(forwarded, hops, expected):
+    assert client_ip(scope("10.0.0.1", *forwarded), hops) == expected
+
+
+def test_client_ip_without_forwarded_for_uses_peer():
+    assert client_ip(scope("10.0.0.1"), 1) == "10.0.0.1"
@@ -0,0 +1,40 @@
+import asyncio
+import gzip
+
+from response_compression import CompressionMiddleware
+
+
+def call(asgi, messages):
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(asgi, minimum_size=10)(scope, None, send))
+    return messages
+
+
+def test_complete_json_response_is_compressed():
+    body = b'{"items": [' + b"1, " * 100 + b"1]}"
+
+    async def asgi(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+    start, message = call(asgi, [])
+    assert (b"content-encoding", b"gzip") in start["headers"]
+    assert gzip.decompress(message["body"]) == body
+
+
+def test_event_stream_headers_are_not_held():
+    messages, sent_before_first_event = [], []
+
+    async def asgi(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+        # An idle stream sends nothing for a while; the client must already have the headers
+        sent_before_first_event.append(len(messages))
+        await send({"type": "http.response.body", "body": b"event: status\ndata: {}\n\n", "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    call(asgi, messages)
+    assert sent_before_first_event == [1]
+    assert all(name != b"content-encoding" for name, _ in messages[0]["headers"])
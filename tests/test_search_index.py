@@ -0,0 +1,72 @@
+import heapq
+import random
+
+import pytest
+
+from search_index import ProductSearchIndex, tokenize
+
+WORDS = ["wireless", "wired", "speaker", "smart", "watch", "leather", "lamp", "tent", "travel", "stainless", "bottle"]
+CATEGORIES = ["Electronics", "Books", "Sports"]
+
+
+def make_index(count=2000, seed=3):
+    rng = random.Random(seed)
+    index = ProductSearchIndex(collection=None)
+    for i in range(count):
+        index.add({
+            "id": f"p{i:05d}",
+            "title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))),
+            "description": " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 20))),
+            "category": rng.choice(CATEGORIES),
+        })
+    return index
+
+
+def exhaustive(index, query, category=None, limit=50):
+    groups = [index._weighted_terms(token, len(index._docs)) for token in dict.fromkeys(tokenize(query))]
+    if not all(groups):
+        return []
+    candidates = set(index._docs)
+    for weighted in groups:
+        candidates &= set().union(*(index._postings[term] for term, _ in weighted))
+    scored = [(pid, index._score(pid, groups)) for pid in candidates
+              if not category or index._docs[pid][2] == category]
+    return heapq.nsmallest(limit, scored, key=lambda item: (-item[1], item[0]))
+
+
+@pytest.fixture(scope="module")
+def index():
+    index = make_index()
+    index.search("warm up")
+    return index
+
+
+@pytest.mark.parametrize("query", ["wireless", "wir", "smart watch", "leather tent travel", "sta bot"])
+@pytest.mark.parametrize("category", [None, "Books"])
+def test_matches_exhaustive_ranking(index, query, category):
+    assert index.search(query, category=category, limit=20) == exhaustive(index, query, category, 20)
+
+
+def test_offset_pages_are_contiguous(index):
+    first = index.search("smart watch", limit=10)
+    second = index.search("smart watch", limit=10, offset=10)
+    assert first + second == index.search("smart watch", limit=20)
+
+
+def test_short_tokens_match_whole_terms_only(index):
+    assert index.search("w") == []
+    assert index.search("wi")
+
+
+def test_every_token_must_match(index):
+    assert index.search("wireless nothingmatches") == []
+
+
+def test_updates_keep_postings_ordered():
+    index = make_index(500)
+    index.search("lamp")
+    index.add({"id": "p00001", "title": "lamp lamp lamp", "description": "lamp", "category": "Books"})
+    assert index.search("lamp", limit=1)[0][0] == "p00001"
+    index.remove("p00001")
+    assert all(pid != "p00001" for pid, _ in index.search("lamp", limit=2000))
+    assert index.search("lamp", limit=20) == exhaustive(index, "lamp", limit=20)